@@ -5,141 +5,3225 @@
 #
 # ********************************************
 
-from json import dumps, loads
-from requests import post, get
+import asyncio
+import gzip
+import json
+import mmap
+import os
+import random
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import (Future, ThreadPoolExecutor, wait,
+                                FIRST_COMPLETED,
+                                TimeoutError as FutureTimeoutError)
+from functools import lru_cache
+from http.client import HTTPConnection, HTTPException
+from queue import Empty, Queue
+from requests import HTTPError, RequestException, Session
+from requests import ConnectionError as RequestsConnectionError
+from requests import ReadTimeout, Timeout
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # AsyncBug is optional
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:  # Faster JSON backend, used if available
+    orjson = None
+
+
+# Connection pool defaults. POOL_CONNECTIONS is the number of distinct
+# hosts kept in the pool, POOL_MAXSIZE the number of keep-alive
+# connections kept per host.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+# Response encodings negotiated by new_session, decoded transparently
+# (and incrementally, chunk by chunk, as the body is read).
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# gzip level for request bodies compressed through compress_min_size;
+# low levels trade compression ratio for client CPU.
+COMPRESS_LEVEL = 6
+_GZIP_HEADERS = {'Content-Encoding' : 'gzip'}
+
+# Default seconds a request may wait for the server to connect or to
+# send more data, see Client.
+TIMEOUT = 60.0
+
+
+def new_session(pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE,
+                pool_block=False):
+    """
+    Builds a keep-alive requests Session with a connection pool mounted
+    for both http and https.
+
+    pool_connections is the number of hosts whose pools are cached,
+    pool_maxsize the number of connections kept alive per host. If
+    pool_block is True, no more than pool_maxsize connections are ever
+    opened to the same host; extra callers wait for a free connection
+    instead of opening a throwaway one.
+
+    """
+
+    session = Session()
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Bug sends every request through its session parameter: a requests
+# Session by default (see new_session), or any transport with the same
+# request(method, url, data=None, headers=None, timeout=None) method
+# returning a response with status_code, ok, content, text and
+# raise_for_status(). Transport errors are raised as requests
+# exceptions, timeouts as requests Timeout.
+
+
+class Response(object):
+
+    """
+    Response returned by the transports below: the subset of
+    requests.Response used by Bug.
+
+    """
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError("%d error" % self.status_code, response=self)
+
+
+def _path(url):
+    # Path of an absolute url, base url ignored
+    return url[url.index('/', url.index('//') + 2):]
+
+
+class _UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class UnixSocketTransport(object):
+
+    """
+    Transport for a Bugspad server on the same host, listening on the
+    Unix domain socket at path: HTTP/1.1 through http.client, without
+    the TCP loopback and requests overheads.
+
+        bug = Bug('http://localhost', user, pwd,
+                  session=UnixSocketTransport('/run/bugspad.sock'))
+
+    Only the path of request urls is used. Up to pool_maxsize idle
+    connections are kept alive; a request failing on a reused one is
+    retried once on a new connection, in case the server closed it.
+    timeout is the default for requests made without one.
+
+    """
+
+    def __init__(self, path, pool_maxsize=POOL_MAXSIZE, timeout=None):
+        self.path = path
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._idle = deque()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    def _exchange(self, connection, method, path, data, headers, timeout):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request(method, path, data, headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        path = _path(url)
+        if type(data) is str:
+            data = data.encode('utf-8')
+        headers = headers or {}
+        if timeout is None:
+            timeout = self.timeout
+
+        try:
+            connection = self._idle.pop()
+        except IndexError:
+            connection = None
+        try:
+            if connection is not None:
+                try:
+                    response, body = self._exchange(connection, method,
+                                                    path, data, headers,
+                                                    timeout)
+                except socket.timeout:
+                    raise   # Not a closed connection, don't retry
+                except (OSError, HTTPException):
+                    connection.close()
+                    connection = None
+            if connection is None:
+                connection = _UnixHTTPConnection(self.path, timeout)
+                response, body = self._exchange(connection, method, path,
+                                                data, headers, timeout)
+        except socket.timeout as error:
+            connection.close()
+            raise ReadTimeout(error)
+        except (OSError, HTTPException) as error:
+            connection.close()
+            raise RequestsConnectionError(error)
+
+        if response.will_close or len(self._idle) >= self.pool_maxsize:
+            connection.close()
+        else:
+            self._idle.append(connection)
+        return Response(response.status, body, response.headers)
+
+
+class InProcessTransport(object):
+
+    """
+    Transport calling a request handler in the same process, with no
+    I/O at all, for tests and benchmarks:
+
+        app = bugspad_server.BugspadApp()
+        bug = Bug('http://localhost', user, pwd,
+                  session=InProcessTransport(app))
+
+    app is called with (method, path, headers, body), body as bytes,
+    and returns the (status, body) response.
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def close(self):
+        pass
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        # No I/O to time out
+        if type(data) is str:
+            data = data.encode('utf-8')
+        status, body = self.app(method, _path(url), headers or {},
+                                data or b'')
+        return Response(status, body)
+
+
+def _gzip(body):
+    if type(body) is str:
+        body = body.encode('utf-8')
+    return gzip.compress(body, COMPRESS_LEVEL)
+
+
+def set_json_backend(loads_funct=None, dumps_funct=None):
+    """
+    Sets the functions used to decode every response (loads) and encode
+    every request body (dumps). loads must accept str and bytes; dumps
+    may return either.
+
+    Called without arguments, selects the fastest backend available:
+    orjson if installed, the standard json module otherwise. This is
+    done at import time.
+
+    """
+
+    global loads, dumps
+    if loads_funct is None and dumps_funct is None:
+        if orjson is not None:
+            loads_funct, dumps_funct = orjson.loads, orjson.dumps
+        else:
+            loads_funct, dumps_funct = json.loads, json.dumps
+    loads = loads_funct or json.loads
+    dumps = dumps_funct or json.dumps
+
+set_json_backend()
+
+
+# Server response to successful updates, once stripped
+_SUCCESS = '"Success"'
+# Start of the server response to requests failing authentication
+_AUTH_ERROR_BODY = b'"Authentication failure.'
+
+# Every endpoint path, relative to the server base url.
+ENDPOINTS = ('/bug/', '/updatebug/', '/comment/', '/bug/cc', '/component/',
+             '/components/', '/releases/', '/product/', '/latestcreated/',
+             '/latestupdated/', '/login/')
+
+
+@lru_cache(maxsize=64)
+def _endpoint_urls(base_url):
+    # {endpoint path : complete url}, built once per server
+    return dict((path, base_url + path) for path in ENDPOINTS)
+
+
+def _json_fragment(*items):
+    # Opening of a json object holding the given (key, value) items,
+    # pre-serialized both as str and as bytes. See Client._post.
+    text = json.dumps(dict(items))[:-1]
+    return text, text.encode('utf-8')
+
+
+@lru_cache(maxsize=64)
+def _auth_fragment(user, pwd):
+    return _json_fragment(('user', user), ('password', pwd))
+
+
+def _bug_fragment(fragment, bug_id):
+    # fragment plus bug_id, built on every request; see Client._post
+    if type(bug_id) is int:
+        text = '%s, "bug_id": %d' % (fragment[0], bug_id)
+    else:
+        text = '%s, "bug_id": %s' % (fragment[0], json.dumps(bug_id))
+    return text, text.encode('utf-8')
+
+
+def loads_nested(body, object_hook=None):
+    """
+    Decodes a json list of json encoded strings, as returned by the
+    latestcreated and latestupdated endpoints, into a list of objects.
+    The inner strings are joined back into a single json array, so they
+    are decoded in one call instead of one call per element.
+
+    With an object_hook, the inner array is decoded by the standard
+    json module, which returns what object_hook returns for each object
+    as it is decoded, as in json.loads, instead of its dictionary.
+
+    """
+
+    if object_hook is None:
+        return loads("[%s]" % ",".join(loads(body)))
+    return json.loads("[%s]" % ",".join(loads(body)),
+                      object_hook=object_hook)
+
+
+class SingleFlight(object):
+
+    """
+    Thread-safe request coalescing: while a call for a given key is in
+    flight, further calls for the same key wait for its outcome instead
+    of running their own. Bug instances use the module-level
+    SINGLE_FLIGHT one for all their GET requests, keyed by their
+    session and url: transports such as UnixSocketTransport use the same
+    placeholder url for every server, so the url alone would mix up the
+    responses of different servers.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}   # key -> [done event, result, exception]
+
+    def do(self, key, funct, *args, timeout=None, deadline=None):
+        """
+        Returns funct(*args), or the result of the identical call
+        already in flight for key. Exceptions are raised to every
+        caller, except Timeout ones, which come from the time limits of
+        the caller whose call it was: the others try again instead,
+        making the call themselves if no other one is in flight.
+
+        timeout and deadline (a time.monotonic() value) bound how long
+        a caller waits for another's call, after which Timeout, or
+        DeadlineExceeded, is raised. The call a caller makes itself is
+        only bounded by what funct does with args.
+
+        """
+
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = [threading.Event(), None, None]
+
+            if leader:
+                try:
+                    call[1] = funct(*args)
+                except Exception as error:
+                    call[2] = error
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call[0].set()
+                return call[1]
+
+            now = time.monotonic()
+            limits = [limit - now for limit in (end, deadline)
+                      if limit is not None]
+            if not call[0].wait(max(0, min(limits)) if limits else None):
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded("Deadline exceeded")
+                raise Timeout("Identical call still in flight after %s "
+                              "seconds" % timeout)
+            if isinstance(call[2], Timeout):
+                continue   # The caller's own limits, not ours
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+
+class _Abandoned(Exception):
+
+    """
+    Outcome of an AsyncSingleFlight call whose caller was cancelled.
+
+    """
+
+
+class AsyncSingleFlight(object):
+
+    """
+    asyncio version of SingleFlight, coalescing identical calls made
+    from coroutines of the same event loop. AsyncBug instances use the
+    module-level ASYNC_SINGLE_FLIGHT one.
+
+    """
+
+    def __init__(self):
+        self._calls = {}   # (event loop, key) -> future
+
+    async def do(self, key, funct, *args):
+        """
+        Returns await funct(*args), or the result of the identical call
+        already in flight for key in the running event loop. Should the
+        caller awaiting that call be cancelled, the others make it again
+        instead, the first one to get there for all of them.
+
+        """
+
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                # Shielded, so a cancelled waiter doesn't cancel the others
+                return await asyncio.shield(future)
+            except _Abandoned:
+                continue
+
+        future = self._calls[key] = loop.create_future()
+        try:
+            result = await funct(*args)
+        except asyncio.CancelledError:
+            future.set_exception(_Abandoned())
+            future.exception()   # Retrieved, even if nobody waits
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()   # Retrieved, even if nobody waits
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+SINGLE_FLIGHT = SingleFlight()
+ASYNC_SINGLE_FLIGHT = AsyncSingleFlight()
+
+# Tasks running detached from any caller, see AsyncBug
+_background_tasks = set()
+
+
+# Passed to metrics hooks after every request sent by Bug or AsyncBug.
+# endpoint is the request path, with ids replaced by <id> (e.g.
+# '/components/<id>/'); status is None if no response was received, in
+# which case error holds the exception raised. latency is in seconds.
+RequestEvent = namedtuple('RequestEvent', 'endpoint method status latency '
+                                          'request_bytes response_bytes '
+                                          'error')
+
+_metrics_hooks = ()
+
+
+def add_metrics_hook(hook):
+    """
+    Registers a callable to be called with a RequestEvent after every
+    request. Hooks run in the requesting thread (or event loop), so
+    they should be quick and must not raise. While no hook is
+    registered, requests are not timed at all.
+
+    """
+
+    global _metrics_hooks
+    _metrics_hooks = _metrics_hooks + (hook,)
+
+
+def remove_metrics_hook(hook):
+    global _metrics_hooks
+    _metrics_hooks = tuple(registered for registered in _metrics_hooks
+                           if registered is not hook)
+
+
+def _endpoint(base_url, complete_url):
+    # Request path, with ids replaced by <id>
+    endpoint = complete_url[len(base_url):]
+    if endpoint.startswith('/components/'):
+        endpoint = '/components/<id>/'
+    return endpoint
+
+
+def _emit_request_event(base_url, complete_url, method, start, status,
+                        request_body, response_body, error):
+    event = RequestEvent(_endpoint(base_url, complete_url),
+                         method,
+                         status,
+                         time.perf_counter() - start,
+                         len(request_body or b''),
+                         len(response_body or b''),
+                         error)
+    for hook in _metrics_hooks:
+        hook(event)
+
+
+class Metrics(object):
+
+    """
+    Metrics hook aggregating per-endpoint call counts, error counts
+    (exceptions and 4xx/5xx responses), latency histograms and request
+    and response byte counts:
+
+        metrics = Metrics()
+        add_metrics_hook(metrics)
+        ...
+        scrape(metrics.snapshot())
+
+    buckets are the upper bounds, in seconds, of the latency histogram
+    buckets; a last unbounded one is always added.
+
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                       1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._endpoints.get(event.endpoint)
+            if stats is None:
+                stats = self._endpoints[event.endpoint] = {
+                    'calls' : 0,
+                    'errors' : 0,
+                    'request_bytes' : 0,
+                    'response_bytes' : 0,
+                    'latency_sum' : 0.0,
+                    'latency_counts' : [0] * len(self.buckets)}
+            stats['calls'] += 1
+            if event.error is not None or event.status >= 400:
+                stats['errors'] += 1
+            stats['request_bytes'] += event.request_bytes
+            stats['response_bytes'] += event.response_bytes
+            stats['latency_sum'] += event.latency
+            stats['latency_counts'][bisect_left(self.buckets,
+                                                event.latency)] += 1
+
+    def snapshot(self):
+        """
+        Returns a dictionary with the metrics gathered so far, keyed by
+        endpoint:
+
+            {'/comment/' : {'calls' : 10,
+                            'errors' : 1,
+                            'request_bytes' : 1270,
+                            'response_bytes' : 20,
+                            'latency_sum' : 0.0231,
+                            'latency_histogram' : [(0.005, 9), ...
+                                                   (inf, 0)]}, ...}
+
+        Histogram counts are per bucket, not cumulative.
+
+        """
+
+        with self._lock:
+            snapshot = {}
+            for endpoint, stats in self._endpoints.items():
+                stats = dict(stats)
+                stats['latency_histogram'] = list(
+                    zip(self.buckets, stats.pop('latency_counts')))
+                snapshot[endpoint] = stats
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+class Hedging(object):
+
+    """
+    Hedged requests policy for idempotent reads, shared by every Bug or
+    AsyncBug it is passed to in the hedging parameter. All their GET
+    requests (get_latest_created_bugs, get_latest_updated_bugs,
+    get_components_list and get_releases) are then sent as follows: if
+    the response hasn't arrived after the percentile latency observed
+    for that endpoint (over the last window requests), a second,
+    identical request is sent and whichever answers first is used.
+
+    Until min_samples latencies are observed, initial_delay is used;
+    the delay is never shorter than min_delay. To bound extra server
+    load, at most max_ratio of the requests are hedged on average, with
+    bursts of up to burst hedges.
+
+    AsyncBug cancels the losing request. Bug can't abort a request
+    already sent through requests, so the loser is left to complete in
+    one of the max_workers threads used to wait for both, and then
+    discarded.
+
+    requests, hedged and hedge_wins count the requests sent through this
+    policy, those hedged, and those answered first by the hedge.
+
+    """
+
+    def __init__(self, percentile=0.95, initial_delay=0.1, min_delay=0.005,
+                 min_samples=20, window=256, max_ratio=0.1, burst=10,
+                 max_workers=32):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self.max_workers = max_workers
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+        self._lock = threading.Lock()
+        self._latencies = {}   # endpoint -> deque of latencies
+        self._delays = {}      # endpoint -> current hedging delay
+        self._budget = 1.0     # hedges allowed right now
+        self._executor = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    def delay(self, endpoint):
+        """
+        Accounts for a new request to endpoint and returns how long to
+        wait for it before hedging.
+
+        """
+
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self._budget + self.max_ratio, self.burst)
+            return self._delays.get(endpoint, self.initial_delay)
+
+    def allow(self):
+        """
+        Returns True, and accounts for it, if a hedge may be sent now.
+
+        """
+
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self.hedged += 1
+            return True
+
+    def observe(self, endpoint, latency, hedge_won=False):
+        with self._lock:
+            if hedge_won:
+                self.hedge_wins += 1
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                latencies = self._latencies[endpoint] = deque(
+                    maxlen=self.window)
+            latencies.append(latency)
+
+            # Recomputed every few samples only; sorting is not free
+            if (len(latencies) >= self.min_samples and
+                    len(latencies) % 8 == 0):
+                ordered = sorted(latencies)
+                index = min(int(len(ordered) * self.percentile),
+                            len(ordered) - 1)
+                self._delays[endpoint] = max(self.min_delay, ordered[index])
+
+
+class ServerPool(object):
+
+    """
+    Latency-aware routing over several Bugspad servers, replicas of the
+    same data, for clients created with a list of urls (see Client).
+
+    Writes are sent to the primary url (the first one by default). Reads
+    are spread over every server by the power of two choices: of two
+    random healthy servers, the one with the lowest latency EWMA (with
+    weight alpha for each new sample), scaled by its requests in flight,
+    gets the request. Read throughput so grows with the servers, while
+    slow ones get less of it.
+
+    A server failing a request (a transport error, a timeout, or a 5xx
+    or 429 response) is taken out for cooldown seconds, and a read is
+    retried on the next best healthy server, by latency. While out,
+    servers are only used once every healthy one has failed too.
+
+    Writes only go to the primary, unless write_failover is True: they
+    then move on to the others, in urls order, when a server cannot be
+    reached. Only turn it on if the replicas can all take writes, and
+    failed writes can safely be retried, as a connection error may come
+    after the server got the request.
+
+    """
+
+    def __init__(self, urls, primary=None, alpha=0.2, cooldown=5.0,
+                 clock=time.monotonic, rng=None, write_failover=False):
+        self.urls = [url.rstrip('/') for url in urls]
+        if not self.urls:
+            raise ValueError("No server urls")
+        self.primary = (self.urls[0] if primary is None
+                        else primary.rstrip('/'))
+        if self.primary not in self.urls:
+            raise ValueError("Primary %s not in urls" % primary)
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.write_failover = write_failover
+
+        self._lock = threading.Lock()
+        self._latency = dict((url, None) for url in self.urls)
+        self._in_flight = dict((url, 0) for url in self.urls)
+        self._down_until = dict((url, 0.0) for url in self.urls)
+        # Write order: the primary, then the rest in urls order
+        self._write_order = [self.primary] + [url for url in self.urls
+                                              if url != self.primary]
+
+    def _score(self, url):
+        # Unmeasured servers score 0, so they get measured first
+        return (self._latency[url] or 0.0) * (self._in_flight[url] + 1)
+
+    def candidates(self, read):
+        """
+        Returns the urls to try for a request, best first.
+
+        """
+
+        with self._lock:
+            now = self.clock()
+            order = self.urls if read else self._write_order
+            healthy = [url for url in order if self._down_until[url] <= now]
+            down = [url for url in order if self._down_until[url] > now]
+            if not read:
+                if not self.write_failover:
+                    return [self.primary]
+                return healthy + down
+
+            healthy.sort(key=self._score)
+            if len(healthy) > 2:
+                first, second = self.rng.sample(healthy, 2)
+                if self._score(second) < self._score(first):
+                    first = second
+                healthy.remove(first)
+                healthy.insert(0, first)
+            return healthy + down
+
+    def start(self, url):
+        """
+        Counts a request to url in flight, returning its start time for
+        finish.
+
+        """
+
+        with self._lock:
+            self._in_flight[url] += 1
+        return self.clock()
+
+    def finish(self, url, start, ok):
+        """
+        Records the outcome of a request to url started at start: its
+        latency if ok, or else the failure taking url out.
+
+        """
+
+        now = self.clock()
+        with self._lock:
+            self._in_flight[url] -= 1
+            if not ok:
+                self._down_until[url] = now + self.cooldown
+                return
+            latency = now - start
+            average = self._latency[url]
+            if average is None:
+                self._latency[url] = latency
+            else:
+                self._latency[url] = average + self.alpha * (latency -
+                                                             average)
+
+    def snapshot(self):
+        """
+        Returns a {url: {'latency', 'in_flight', 'healthy'}} dict of the
+        current state, latency being None until measured.
+
+        """
+
+        with self._lock:
+            now = self.clock()
+            return dict((url, {'latency' : self._latency[url],
+                               'in_flight' : self._in_flight[url],
+                               'healthy' : self._down_until[url] <= now})
+                        for url in self.urls)
+
+
+class LimitExceeded(Exception):
+
+    """
+    Raised when a request waits longer than an AdaptiveLimit's max_wait
+    for a free slot.
+
+    """
+
+
+class AdaptiveLimit(object):
+
+    """
+    Adaptive concurrency limit for the requests of every Bug it is
+    passed to in the limiter parameter, and so for the bulk paths built
+    on them (BugSet, WriteBehind, the importer):
+
+        limit = AdaptiveLimit(max_limit=32)
+        bugs = BugSet(Bug(base_url, user, pwd, limiter=limit),
+                      bug_ids, max_workers=32)
+
+    At most limit requests are in flight at once; the rest wait for a
+    free slot. The limit follows AIMD: every healthy response raises it
+    by increase / limit (about increase per round of limit requests),
+    up to max_limit. Failed requests (errors, timeouts, 429 and 5xx
+    responses) and latency spikes cut it by the decrease factor, down to
+    min_limit, once per round: requests started before the last cut
+    don't cut it again.
+
+    A response is a latency spike when slower than max_latency seconds,
+    if given, or than tolerance times the moving average latency once
+    min_samples responses have been seen.
+
+    A request waiting longer than max_wait seconds (None waits forever)
+    for a slot raises LimitExceeded. waited counts requests which had to
+    wait for a slot, rejected those that gave up, and drops the
+    failures and spikes observed; see snapshot().
+
+    The pool of threads (or tasks) sending the requests bounds the
+    concurrency too, so it should allow for max_limit.
+
+    """
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64,
+                 increase=1.0, decrease=0.5, tolerance=2.0, min_samples=20,
+                 max_latency=None, max_wait=None, clock=time.monotonic):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.max_latency = max_latency
+        self.max_wait = max_wait
+        self.clock = clock
+
+        self.in_flight = 0
+        self.latency = None   # moving average, in seconds
+        self.samples = 0
+        self.waited = 0
+        self.rejected = 0
+        self.drops = 0
+
+        self._cond = threading.Condition()
+        self._last_cut = None
+
+    def _full(self):
+        return self.in_flight >= max(int(self.limit), 1)
+
+    def acquire(self):
+        """
+        Takes a slot, waiting for one if needed, and returns a token to
+        pass to release.
+
+        """
+
+        with self._cond:
+            if self._full():
+                self.waited += 1
+                if not self._cond.wait_for(lambda: not self._full(),
+                                           self.max_wait):
+                    self.rejected += 1
+                    raise LimitExceeded("No free slot after %ss" %
+                                        self.max_wait)
+            self.in_flight += 1
+            return self.clock()
+
+    def release(self, token, ok=True):
+        """
+        Frees the slot taken by acquire, adapting the limit to the
+        outcome: ok is False if the request failed.
+
+        """
+
+        with self._cond:
+            self._observe(token, ok)
+            self._cond.notify()
+
+    def _observe(self, token, ok):
+        # Called with the lock held
+        now = self.clock()
+        latency = now - token
+        self.in_flight -= 1
+
+        if self.max_latency is not None:
+            spike = latency > self.max_latency
+        else:
+            spike = (self.samples >= self.min_samples and
+                     latency > self.latency * self.tolerance)
+        if ok:
+            self.samples += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += (latency - self.latency) * 0.1
+
+        if ok and not spike:
+            self.limit = min(self.limit + self.increase / self.limit,
+                             self.max_limit)
+            return
+        self.drops += 1
+        if self._last_cut is None or token >= self._last_cut:
+            self.limit = max(self.limit * self.decrease, self.min_limit)
+            self._last_cut = now
+
+    def snapshot(self):
+        """
+        Returns the current state as a dictionary, for monitoring.
+
+        """
+
+        with self._cond:
+            return {'limit' : int(self.limit),
+                    'in_flight' : self.in_flight,
+                    'latency' : self.latency,
+                    'waited' : self.waited,
+                    'rejected' : self.rejected,
+                    'drops' : self.drops}
+
+
+class AsyncAdaptiveLimit(AdaptiveLimit):
+
+    """
+    AdaptiveLimit for AsyncBug, whose acquire is a coroutine waiting
+    without blocking the event loop. It may be shared across event
+    loops.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        AdaptiveLimit.__init__(self, *args, **kwargs)
+        self._waiters = deque()
+
+    async def acquire(self):
+        with self._cond:
+            if not self._full():
+                self.in_flight += 1
+                return self.clock()
+            self.waited += 1
+            loop = asyncio.get_running_loop()
+            # [loop, future, slot handed over]
+            waiter = [loop, loop.create_future(), False]
+            self._waiters.append(waiter)
+
+        try:
+            # Woken up by release, which takes the slot on our behalf
+            await asyncio.wait_for(waiter[1], self.max_wait)
+        except BaseException as error:
+            with self._cond:
+                if waiter[2]:   # Too late, give the slot to another
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(waiter)
+                if isinstance(error, asyncio.TimeoutError):
+                    self.rejected += 1
+                    raise LimitExceeded("No free slot after %ss" %
+                                        self.max_wait)
+            raise
+        return self.clock()
+
+    def release(self, token, ok=True):
+        with self._cond:
+            self._observe(token, ok)
+            self._wake()
+
+    def _wake(self):
+        # Called with the lock held
+        while self._waiters and not self._full():
+            waiter = self._waiters.popleft()
+            waiter[2] = True
+            self.in_flight += 1
+            waiter[0].call_soon_threadsafe(_set_slot, waiter[1])
+
+
+def _set_slot(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _healthy(status):
+    # Whether a response status tells the server is coping with the load
+    return status < 500 and status != 429
+
+
+class WriteBehind(object):
+
+    """
+    Write-behind buffer for update_bug, shared by every Bug it is passed
+    to in the write_behind parameter. Their update_bug calls no longer
+    send a request each: the keyword arguments are buffered per bug for
+    window seconds after the first call, merged (last write wins per
+    field) and sent as a single update, by a pool of max_workers
+    threads. Updates of the same bug are never sent concurrently.
+
+    In this mode update_bug returns a concurrent.futures.Future instead
+    of the server response. Every future of a merged update resolves to
+    the same server response, or raises the same exception if the
+    request failed. Keyword arguments rejected by optional_args_filter
+    are still reported immediately with the "Wrong kwargs" string.
+
+    flush() sends every buffered update at once and waits for them.
+    Used as a context manager, it is closed (flushed, then stopped) on
+    exit:
+
+        with WriteBehind() as write_behind:
+            bug = Bug(base_url, user, pwd, bug_id,
+                      write_behind=write_behind)
+            bug.update_bug(status='assigned')
+            bug.update_bug(priority='high')   # Same request
+
+    """
+
+    def __init__(self, window=0.05, max_workers=8):
+        self.window = window
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        # key -> [deadline, Bug, merged kwargs, futures], by deadline
+        self._pending = OrderedDict()
+        self._in_flight = set()
+        self._executor = None
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, bug, kwargs):
+        """
+        Buffers an update of bug and returns its Future.
+
+        """
+
+        future = Future()
+        key = (bug.client, bug.bug_id)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBehind is closed")
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = [time.monotonic() + self.window,
+                                              bug, {}, []]
+                self._cond.notify_all()
+            batch[2].update(kwargs)
+            batch[3].append(future)
+
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def flush(self):
+        """
+        Sends every buffered update now, and waits until all of them
+        have been answered.
+
+        """
+
+        with self._cond:
+            for batch in self._pending.values():
+                batch[0] = 0
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._executor.shutdown()
+
+    def _run(self):
+        with self._cond:
+            while not (self._closed and not self._pending):
+                now = time.monotonic()
+                timeout = None
+                for key, batch in list(self._pending.items()):
+                    if key in self._in_flight:
+                        continue
+                    if batch[0] > now:
+                        timeout = batch[0] - now
+                        break
+                    del self._pending[key]
+                    self._in_flight.add(key)
+                    self._executor.submit(self._send, key, batch)
+                self._cond.wait(timeout)
+
+    def _send(self, key, batch):
+        deadline, bug, kwargs, futures = batch
+        try:
+            response = bug._send_update(kwargs)
+        except Exception as error:
+            for future in futures:
+                future.set_exception(error)
+        else:
+            for future in futures:
+                future.set_result(response)
+        finally:
+            with self._cond:
+                self._in_flight.discard(key)
+                self._cond.notify_all()
+
+
+class ReferenceCache(object):
+
+    """
+    Thread-safe TTL/LRU cache for reference data lookups (releases and
+    components lists), shared by every Bug or AsyncBug instance it is
+    passed to:
+
+        cache = ReferenceCache(ttl=300)
+        bug = Bug(base_url, user, pwd, cache=cache)
+
+    Entries are keyed by request url and hold the raw response body,
+    which is decoded on every hit so callers never share mutable
+    results. Entries expire ttl seconds after being stored. Once more
+    than maxsize entries or max_bytes bytes of response bodies are held,
+    the least recently used entries are evicted; bodies larger than
+    max_bytes are never cached.
+
+    Bug instances invalidate the affected entries themselves after
+    add_release, add_component and add_product, so lookups through the
+    same cache always reflect their own writes. Every invalidation
+    advances the generation of the keys it affects: responses fetched
+    before it, passed to set with the generation read when their fetch
+    started, are not stored, and fetches started after it are not
+    coalesced with those.
+
+    """
+
+    def __init__(self, ttl=300, maxsize=256, max_bytes=16 * 1024 * 1024,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.size = 0   # bytes held
+        self._entries = OrderedDict()   # key -> (expires, text)
+        self._invalidations = 0
+        self._generations = {}          # key -> invalidations when discarded
+        self._prefix_generations = {}   # prefix -> same
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, refresh=None):
+        """
+        Returns the cached text for key, or None if missing or expired.
+        Caches able to serve stale entries (see SnapshotCache) call
+        refresh with key to have it fetched again in the background.
+
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def generation(self, key):
+        """
+        Returns the number of invalidations so far when key was last
+        invalidated, to be read before fetching its text and passed to
+        set.
+
+        """
+
+        with self._lock:
+            return self._generation(key)
+
+    def set(self, key, text, generation=None):
+        """
+        Stores text for key, unless key was invalidated since generation
+        was read.
+
+        """
+
+        with self._lock:
+            if not self._is_stale(key, generation):
+                self._set(key, text)
+
+    def discard(self, key):
+        with self._lock:
+            self._invalidations += 1
+            self._generations[key] = self._invalidations
+            if key in self._entries:
+                self._remove(key)
+
+    def discard_prefix(self, prefix):
+        """
+        Removes every entry whose key starts with prefix.
+
+        """
+
+        with self._lock:
+            self._invalidations += 1
+            self._prefix_generations[prefix] = self._invalidations
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._cleared = self._invalidations
+            self._generations.clear()
+            self._prefix_generations.clear()
+            self._entries.clear()
+            self.size = 0
+
+    def _generation(self, key):
+        generation = max(self._cleared, self._generations.get(key, 0))
+        for prefix, invalidated in self._prefix_generations.items():
+            if key.startswith(prefix):
+                generation = max(generation, invalidated)
+        return generation
+
+    def _is_stale(self, key, generation):
+        return generation is not None and generation < self._generation(key)
+
+    def _set(self, key, text):
+        if key in self._entries:
+            self._remove(key)
+        if len(text) > self.max_bytes:
+            return
+        self._entries[key] = (self.clock() + self.ttl, text)
+        self.size += len(text)
+        while (len(self._entries) > self.maxsize or
+                self.size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self.size -= len(self._entries.pop(key)[1])
+
+
+class SnapshotCache(ReferenceCache):
+
+    """
+    ReferenceCache persisted to an on-disk snapshot, so short-lived
+    processes (cron jobs, hooks) start with warm reference data:
+
+        cache = SnapshotCache('~/.cache/bugspad.snapshot', max_age=3600)
+        bug = Bug(base_url, user, pwd, cache=cache)
+
+    Every response stored in the cache is also written to the snapshot
+    file at path, with the time it was fetched. Lookups missing the
+    in-memory cache are answered from the snapshot: entries younger
+    than max_age seconds as they are, older ones too, but the Bug
+    instance looking them up refreshes them in the background (at most
+    once per ttl seconds per entry). Invalidations, such as those after
+    add_release, are written through as well.
+
+    The snapshot is a compact binary file, memory-mapped so only the
+    entries looked up are ever read: a header (MAGIC, FORMAT_VERSION,
+    entry count) followed by one (fetched at, key length, body length)
+    record per entry, each followed by its key and body. Files of other
+    versions, or unreadable, are ignored and overwritten. Writes go
+    through a temporary file atomically replacing the snapshot, merged
+    with entries written meanwhile by other processes.
+
+    The other parameters are those of ReferenceCache; wall_clock gives
+    the time entries are stamped and aged with.
+
+    """
+
+    MAGIC = b'BSPS'
+    FORMAT_VERSION = 1
+    _HEADER = struct.Struct('<4sHI')   # magic, version, entries
+    _ENTRY = struct.Struct('<dHI')     # fetched at, key length, body length
+
+    def __init__(self, path, max_age=3600, ttl=300, maxsize=256,
+                 max_bytes=16 * 1024 * 1024, clock=time.monotonic,
+                 wall_clock=time.time):
+        ReferenceCache.__init__(self, ttl, maxsize, max_bytes, clock)
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.wall_clock = wall_clock
+        self._refreshing = {}   # key -> clock() when last refreshed
+        self._map, self._index = self._read()
+
+    def _read(self):
+        # Returns (mmap or None, {key: (fetched at, offset, length)})
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                snapshot = mmap.mmap(snapshot_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        except (OSError, ValueError):   # Missing or empty
+            return None, {}
+
+        index = {}
+        try:
+            magic, version, count = self._HEADER.unpack_from(snapshot)
+            if magic != self.MAGIC or version != self.FORMAT_VERSION:
+                raise ValueError("Unknown snapshot format")
+            offset = self._HEADER.size
+            for _ in range(count):
+                fetched, key_length, length = self._ENTRY.unpack_from(
+                    snapshot, offset)
+                offset += self._ENTRY.size
+                key = snapshot[offset:offset + key_length].decode('utf-8')
+                offset += key_length
+                if offset + length > len(snapshot):
+                    raise ValueError("Truncated snapshot")
+                index[key] = (fetched, offset, length)
+                offset += length
+        except (struct.error, ValueError, UnicodeDecodeError):
+            snapshot.close()
+            return None, {}
+        return snapshot, index
+
+    def _write(self, update):
+        # Rewrites the snapshot, merged with the current file, after
+        # applying update to its {key: (fetched at, body)} entries.
+        snapshot, index = self._read()
+        entries = dict((key, (fetched, snapshot[offset:offset + length]))
+                       for key, (fetched, offset, length) in index.items())
+        if snapshot is not None:
+            snapshot.close()
+        update(entries)
+
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as snapshot_file:
+                snapshot_file.write(self._HEADER.pack(self.MAGIC,
+                                                      self.FORMAT_VERSION,
+                                                      len(entries)))
+                for key, (fetched, body) in entries.items():
+                    key = key.encode('utf-8')
+                    snapshot_file.write(self._ENTRY.pack(fetched, len(key),
+                                                         len(body)))
+                    snapshot_file.write(key)
+                    snapshot_file.write(body)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The snapshot is only an optimization; keep serving the
+            # in-memory cache.
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        if self._map is not None:
+            self._map.close()
+        self._map, self._index = self._read()
+
+    def get(self, key, refresh=None):
+        text = ReferenceCache.get(self, key)
+        if text is not None:
+            return text
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            fetched, offset, length = entry
+            text = self._map[offset:offset + length]
+            if self.wall_clock() - fetched < self.max_age or refresh is None:
+                return text
+            last = self._refreshing.get(key)
+            if last is not None and self.clock() - last < self.ttl:
+                return text
+            self._refreshing[key] = self.clock()
+        refresh(key)
+        return text
+
+    def set(self, key, text, generation=None):
+        encoded = text
+        if type(text) is str:
+            encoded = text.encode('utf-8')
+        fetched = self.wall_clock()
+
+        def update(entries):
+            entries[key] = (fetched, encoded)
+
+        with self._lock:
+            if self._is_stale(key, generation):
+                return
+            self._set(key, text)
+            self._refreshing.pop(key, None)
+            self._write(update)
+
+    def discard(self, key):
+        ReferenceCache.discard(self, key)
+        with self._lock:
+            if key in self._index:
+                self._write(lambda entries: entries.pop(key, None))
+
+    def discard_prefix(self, prefix):
+        ReferenceCache.discard_prefix(self, prefix)
+
+        def update(entries):
+            for key in [key for key in entries if key.startswith(prefix)]:
+                del entries[key]
+
+        with self._lock:
+            if any(key.startswith(prefix) for key in self._index):
+                self._write(update)
+
+    def clear(self):
+        ReferenceCache.clear(self)
+        with self._lock:
+            self._write(lambda entries: entries.clear())
+
+
+class CcTracker(object):
+
+    """
+    Thread-safe record of the cc list of each bug, as known from the
+    requests made through the Bug instances it is shared by (new_bug,
+    add_bug_cc, remove_bug_cc and set_bug_cc). Lets set_bug_cc send
+    only what changed. A Replica can be used instead, to keep it across
+    processes.
+
+    """
+
+    def __init__(self):
+        self._cc = {}   # bug id -> frozenset of emails
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cc)
+
+    def cc(self, bug_id):
+        """
+        Returns the frozenset of emails known to be cc'd to bug_id, or
+        None if unknown.
+
+        """
+
+        return self._cc.get(bug_id)
+
+    def record_cc(self, bug_id, added=(), removed=()):
+        with self._lock:
+            self._cc[bug_id] = (self._cc.get(bug_id, frozenset())
+                                .union(added).difference(removed))
+
+
+class Replica(object):
+
+    """
+    Local SQLite mirror of what Bug instances learn from the server, to
+    answer reporting queries without any round-trip:
+
+        replica = Replica('bugspad.db')
+        bug = Bug(base_url, user, pwd, replica=replica)
+        ...
+        replica.bugs(status=('new', 'assigned'), priority='high',
+                     component_id=3)
+
+    It is fed incrementally by every Bug instance it is passed to:
+    bugs from get_latest_created_bugs and get_latest_updated_bugs (id,
+    status and summary) and from the instance's own successful new_bug
+    and update_bug calls (the fields sent), components from
+    get_components_list and add_component, and releases from
+    get_releases and add_release. Running a ChangeFeed over such a Bug
+    keeps the replica in sync with changes made by other clients.
+
+    Bug fields never learned are NULL; a field is only overwritten by
+    a newer known value. Cc lists are not bug fields; a replica passed
+    to Bug also serves as its CcTracker (see cc and record_cc).
+
+    path is the database file, ':memory:' by default. The replica is
+    thread-safe and shared by every Bug instance it is passed to.
+
+    """
+
+    BUG_FIELDS = ('summary', 'description', 'status', 'priority',
+                  'severity', 'hardware', 'whiteboard', 'fixedinver',
+                  'version', 'component_id', 'subcomponent_id')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bugs (
+            id INTEGER PRIMARY KEY,
+            summary TEXT,
+            description TEXT,
+            status TEXT,
+            priority TEXT,
+            severity TEXT,
+            hardware TEXT,
+            whiteboard TEXT,
+            fixedinver TEXT,
+            version TEXT,
+            component_id INTEGER,
+            subcomponent_id INTEGER,
+            synced REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS bugs_status ON bugs (status);
+        CREATE INDEX IF NOT EXISTS bugs_priority ON bugs (priority);
+        CREATE INDEX IF NOT EXISTS bugs_component
+            ON bugs (component_id);
+        CREATE TABLE IF NOT EXISTS components (
+            id INTEGER PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT);
+        CREATE INDEX IF NOT EXISTS components_product
+            ON components (product_id);
+        CREATE TABLE IF NOT EXISTS releases (
+            name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS cc_known (
+            bug_id INTEGER PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS bug_cc (
+            bug_id INTEGER NOT NULL,
+            email TEXT NOT NULL,
+            PRIMARY KEY (bug_id, email)) WITHOUT ROWID;
+        """
+
+    def __init__(self, path=':memory:', clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = _dict_row
+        if path != ':memory:':
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+
+        # Upserts by the set of fields known, see record_bug
+        self._upserts = {}
+        # Last lists recorded, to skip rewriting unchanged ones
+        self._last_releases = None
+        self._last_components = {}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _upsert(self, fields):
+        # Without fields (e.g. an emails only update) only synced changes
+        statement = self._upserts.get(fields)
+        if statement is None:
+            statement = self._upserts[fields] = (
+                "INSERT INTO bugs (id, synced%s) VALUES (?, ?%s) "
+                "ON CONFLICT (id) DO UPDATE SET synced = excluded.synced"
+                "%s" % ("".join(", %s" % field for field in fields),
+                        ", ?" * len(fields),
+                        "".join(", %s = excluded.%s" % (field, field)
+                                for field in fields)))
+        return statement
+
+    def record_bug(self, bug_id, fields):
+        """
+        Stores the given fields of bug_id, leaving the others as they
+        were. Keys not in BUG_FIELDS are ignored.
+
+        """
+
+        self.record_bugs([dict(fields, id=bug_id)])
+
+    def record_bugs(self, bugs):
+        """
+        Stores a list of bug dictionaries holding an 'id' key, or of
+        BugRecord instances, in a single transaction.
+
+        """
+
+        now = self.clock()
+        with self._lock, self._db:
+            for bug in bugs:
+                fields = tuple(field for field in self.BUG_FIELDS
+                               if bug.get(field) is not None)
+                self._db.execute(self._upsert(fields),
+                                 (bug['id'], now) +
+                                 tuple(bug[field] for field in fields))
+
+    def record_components(self, product_id, components):
+        """
+        Replaces the components of product_id with the given
+        get_components_list result.
+
+        """
+
+        if self._last_components.get(product_id) == components:
+            return
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM components WHERE product_id = ?",
+                             (product_id,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO components VALUES (?, ?, ?, ?)",
+                [(component[0], product_id, component[1], component[2])
+                 for component in components.values()])
+            self._last_components[product_id] = components
+
+    def record_component(self, product_id, component):
+        """
+        Stores a single component, as returned by add_component.
+
+        """
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO components VALUES (?, ?, ?, ?)",
+                (component['id'], product_id, component['name'],
+                 component['description']))
+            self._last_components.pop(product_id, None)
+
+    def record_releases(self, releases):
+        """
+        Replaces the releases with the given get_releases result.
+
+        """
+
+        if releases == self._last_releases:
+            return
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM releases")
+            self._db.executemany("INSERT OR IGNORE INTO releases VALUES (?)",
+                                 [(name,) for name in releases])
+            self._last_releases = releases
+
+    def record_release(self, name):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO releases VALUES (?)",
+                             (name,))
+            self._last_releases = None
+
+    def cc(self, bug_id):
+        """
+        Returns the frozenset of emails known to be cc'd to bug_id, or
+        None if unknown, as CcTracker.cc.
+
+        """
+
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM cc_known WHERE bug_id = ?",
+                                (bug_id,)).fetchone() is None:
+                return None
+            return frozenset(row['email'] for row in self._db.execute(
+                "SELECT email FROM bug_cc WHERE bug_id = ?", (bug_id,)))
+
+    def record_cc(self, bug_id, added=(), removed=()):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO cc_known VALUES (?)",
+                             (bug_id,))
+            self._db.executemany("INSERT OR IGNORE INTO bug_cc VALUES (?, ?)",
+                                 [(bug_id, email) for email in added])
+            self._db.executemany(
+                "DELETE FROM bug_cc WHERE bug_id = ? AND email = ?",
+                [(bug_id, email) for email in removed])
+
+    def bug(self, bug_id):
+        """
+        Returns the dictionary of fields known of bug_id, or None. Its
+        'synced' key holds the time it was last recorded.
+
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT * FROM bugs WHERE id = ?",
+                                    (bug_id,)).fetchone()
+
+    def bugs(self, order_by='id', limit=None, **filters):
+        """
+        Returns the list of bug dictionaries (see bug) matching every
+        keyword filter, ordered by order_by. Filters are bug fields, and
+        match either one value or, given a list/tuple, any of its
+        values; None matches fields never learned:
+
+            replica.bugs(status=('new', 'assigned'), component_id=3)
+
+        Raises ValueError for unknown fields.
+
+        """
+
+        if order_by.lstrip('-') not in self.BUG_FIELDS + ('id', 'synced'):
+            raise ValueError("Unknown bug field '%s'" % order_by)
+        where, params = self._where(filters)
+
+        query = "SELECT * FROM bugs" + where
+        if order_by.startswith('-'):
+            query += " ORDER BY %s DESC" % order_by[1:]
+        else:
+            query += " ORDER BY %s" % order_by
+        if limit is not None:
+            query += " LIMIT %d" % limit
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def count(self, **filters):
+        """
+        Returns the number of bugs matching filters, as in bugs.
+
+        """
+
+        where, params = self._where(filters)
+        with self._lock:
+            row = self._db.execute("SELECT COUNT(*) AS count FROM bugs" +
+                                   where, params).fetchone()
+        return row['count']
+
+    def _where(self, filters):
+        clauses = []
+        params = []
+        for field, value in sorted(filters.items()):
+            if field not in self.BUG_FIELDS and field != 'id':
+                raise ValueError("Unknown bug field '%s'" % field)
+            if value is None:
+                clauses.append("%s IS NULL" % field)
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                clauses.append("%s IN (%s)" % (field,
+                                               ", ".join("?" * len(value))))
+                params.extend(value)
+            else:
+                clauses.append("%s = ?" % field)
+                params.append(value)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def components(self, product_id):
+        """
+        Returns the known components of product_id, in the same form as
+        Bug.get_components_list.
+
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, description FROM components "
+                "WHERE product_id = ? ORDER BY id", (product_id,))
+            return dict((row['name'], [row['id'], row['name'],
+                                       row['description']])
+                        for row in rows)
+
+    def releases(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name FROM releases ORDER BY rowid")
+            return [row['name'] for row in rows]
+
+
+def _dict_row(cursor, row):
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+class BugRecord(object):
+
+    """
+    Compact form of a bug as returned by get_latest_*_bugs, for clients
+    created with results='records' (see Client). Holds the id, status
+    and summary as attributes, the status interned so every record with
+    the same one shares it. Fields can also be read by name, as in the
+    dictionaries it replaces: record['status'].
+
+    """
+
+    __slots__ = ('id', 'status', 'summary')
+
+    def __init__(self, id, status, summary):
+        self.id = id
+        self.status = status
+        self.summary = summary
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if not isinstance(other, BugRecord):
+            return NotImplemented
+        return (self.id, self.status, self.summary) == \
+               (other.id, other.status, other.summary)
+
+    def __hash__(self):
+        return hash((self.id, self.status, self.summary))
+
+    def __repr__(self):
+        return "BugRecord(id=%r, status=%r, summary=%r)" % (
+            self.id, self.status, self.summary)
+
+    @classmethod
+    def from_dict(cls, bug):
+        return cls(bug['id'], sys.intern(bug['status']), bug['summary'])
+
+
+# Compact form of a component, as the [id, name, description] lists in
+# get_components_list results, for clients created with
+# results='records'.
+ComponentRecord = namedtuple('ComponentRecord', 'id name description')
+
+
+class BugColumns(object):
+
+    """
+    Columnar batch of bugs, returned by get_latest_*_bugs for clients
+    created with results='columns' (see Client): ids in an array of
+    64-bit integers, interned statuses and summaries in lists, and no
+    object per bug. Indexing and iterating build BugRecord instances on
+    the fly. Batches can be merged with extend, so large lists of bugs
+    are best kept in a single one.
+
+    """
+
+    __slots__ = ('ids', 'statuses', 'summaries')
+
+    def __init__(self, bugs=()):
+        self.ids = array('q')
+        self.statuses = []
+        self.summaries = []
+        self.extend(bugs)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return BugRecord(self.ids[index], self.statuses[index],
+                         self.summaries[index])
+
+    def __iter__(self):
+        return map(BugRecord, self.ids, self.statuses, self.summaries)
+
+    def extend(self, bugs):
+        """
+        Appends bugs, either another BugColumns or an iterable of bug
+        dictionaries or BugRecord instances.
+
+        """
+
+        if isinstance(bugs, BugColumns):
+            self.ids.extend(bugs.ids)
+            self.statuses.extend(bugs.statuses)
+            self.summaries.extend(bugs.summaries)
+            return
+        for bug in bugs:
+            self.append(bug)
+
+    def append(self, bug):
+        """
+        Appends a bug dictionary or BugRecord instance.
+
+        """
+
+        self.ids.append(bug['id'])
+        self.statuses.append(sys.intern(bug['status']))
+        self.summaries.append(bug['summary'])
+
+
+class ComponentColumns(object):
+
+    """
+    Columnar form of a product's components, returned by
+    get_components_list for clients created with results='columns'
+    (see Client). Indexing and iterating build ComponentRecord
+    instances on the fly; get looks one up by name.
+
+    """
+
+    __slots__ = ('ids', 'names', 'descriptions')
+
+    def __init__(self, components=()):
+        self.ids = array('q')
+        self.names = []
+        self.descriptions = []
+        for component_id, name, description in components:
+            self.ids.append(component_id)
+            self.names.append(sys.intern(name))
+            self.descriptions.append(description)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return ComponentRecord(self.ids[index], self.names[index],
+                               self.descriptions[index])
+
+    def __iter__(self):
+        return map(ComponentRecord, self.ids, self.names, self.descriptions)
+
+    def get(self, name, default=None):
+        try:
+            return self[self.names.index(name)]
+        except ValueError:
+            return default
+
+
+# Keyword arguments of every Bug method, besides its own
+_CALL_KWARGS = frozenset(('timeout', 'deadline'))
+
+# Result forms accepted by Client
+RESULTS = ('dicts', 'records', 'columns')
+
+
+def _bug_results(body, results):
+    # Decodes a get_latest_*_bugs response body. Records and columns are
+    # built as each bug is decoded, so no list of dictionaries is.
+    if results == 'records':
+        return loads_nested(body, BugRecord.from_dict)
+    if results == 'columns':
+        bugs = BugColumns()
+        loads_nested(body, bugs.append)
+        return bugs
+    return loads_nested(body)
+
+
+def _component_results(components, results):
+    if results == 'records':
+        return dict((sys.intern(name), ComponentRecord(*component))
+                    for name, component in components.items())
+    if results == 'columns':
+        return ComponentColumns(components.values())
+    return components
+
+
+class DeadlineExceeded(Timeout):
+
+    """
+    Raised when a call's deadline, or a bulk operation's budget, runs
+    out before it is done. A requests Timeout, like the ones raised by
+    requests that time out.
+
+    """
+
+
+def _time_left(timeout, deadline):
+    # timeout, capped by the seconds left before deadline
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    return left if timeout is None or left < timeout else timeout
+
+
+class AuthenticationError(Exception):
+
+    """
+    Raised when the server rejects a client's credentials.
+
+    """
+
+
+class Authentication(object):
+
+    """
+    Authentication state of a Client, shared by every Bug handle on it,
+    so credentials are validated only once. token is the session token
+    issued by the server, if any; fragment is the pre-serialized token,
+    or credentials, sent with every request (see Client._post).
+
+    """
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+        self.token = None
+        self.lock = threading.Lock()
+
+
+class Client(object):
+
+    """
+    Thread-safe connection to a Bugspad server, owning everything the
+    Bug handles it gives out share: session, credentials, caches and the
+    rest of the settings below. Create one per server and user, and get
+    a handle for each bug through bug(bug_id); handles are cheap, and
+    any number of threads can use them, and the client, concurrently.
+
+    If the server issues session tokens (through /login/), the user and
+    password are validated once when the client is created: if the user
+    is not registered, AuthenticationError is raised. Requests then
+    carry the token instead of the credentials, and expired tokens are
+    renewed transparently. Otherwise the credentials are sent with every
+    request, and the first one the server rejects raises
+    AuthenticationError instead. Should the server be unreachable at
+    creation, the credentials are sent until it answers, and any later
+    rejection raises AuthenticationError as well.
+
+    With authenticate=False, nothing is validated; if the user is not
+    registered, an 'authentication failure' error message is return on
+    every function.
+
+    base_url refers to the base url of the server. It is, together with
+    user and pwd, serialized once at instantiation time for all the
+    requests made, so create a new client to change any of them.
+
+    base_url may also be a list of urls of replicas of the same server,
+    or a ServerPool of them: reads are then spread over them by latency,
+    and moved on from a failing one to another, while writes are sent to
+    the primary one (see ServerPool for write failover). The ServerPool
+    is built with the primary url, if given, and the keyword arguments
+    in server_options. url is then the primary's url.
+
+    All requests are sent through a pooled keep-alive session. Either
+    pass an existing requests Session in the session parameter, or let
+    the client build its own one from pool_connections, pool_maxsize
+    and pool_block (see new_session). The session may also be another
+    transport, such as UnixSocketTransport for a server on the same
+    host, or InProcessTransport.
+
+    get_releases and get_components_list results can be cached by
+    passing a ReferenceCache in the cache parameter, or a SnapshotCache
+    to keep them across processes.
+
+    Identical GET requests made concurrently, from any thread, through
+    the same session, are coalesced into a single one through
+    SINGLE_FLIGHT; pass another SingleFlight in the single_flight
+    parameter to scope coalescing further, or None to disable it.
+
+    Every request is reported to the hooks registered with
+    add_metrics_hook (see Metrics).
+
+    Reads can be hedged against slow responses by passing a Hedging
+    policy in the hedging parameter, and update_bug calls buffered and
+    merged by passing a WriteBehind in the write_behind parameter.
+
+    Bugs, components and releases learned through the client are
+    mirrored to the Replica passed in the replica parameter, if any, so
+    they can be queried locally.
+
+    The cc lists set through the client are tracked by the CcTracker
+    given in the cc_tracker parameter, by the replica if None, or else
+    by a new one, for Bug.set_bug_cc. The server silently drops the
+    emails of unregistered users from cc lists, and cannot be asked for
+    them, so tracking needs to know the registered users: pass their
+    emails in the registered parameter (the client's own user is always
+    one). Without them, nothing is tracked and set_bug_cc is unavailable.
+
+    Responses are requested gzip or deflate compressed (see
+    ACCEPT_ENCODING). Request bodies of compress_min_size bytes or more
+    are sent gzip compressed, with a 'Content-Encoding: gzip' header;
+    this is off by default, as the server must support it.
+
+    Requests can be throttled to what the server copes with by passing
+    an AdaptiveLimit in the limiter parameter.
+
+    Requests fail with a requests Timeout when the server takes more
+    than timeout seconds (TIMEOUT by default) to accept the connection
+    or to send more of its response; pass None to wait forever. Every
+    Bug method also takes a timeout, replacing this one for its own
+    requests, and a deadline: a time.monotonic() time by which the whole
+    call must be done, or DeadlineExceeded is raised. A deadline can be
+    shared by several calls, and bounds every request they send.
+
+    Bugs and components are returned as dictionaries and lists by
+    default (results='dicts'). With results='records', get_latest_*_bugs
+    return lists of BugRecord, get_components_list a dictionary of
+    ComponentRecord by name, and get_releases interned strings, all of
+    them far smaller when many are kept. With results='columns', they
+    return a BugColumns and a ComponentColumns batch instead, smaller
+    still for large lists.
+
+    """
+
+    def __init__(self, base_url, user, pwd, session=None,
+                 pool_connections=POOL_CONNECTIONS,
+                 pool_maxsize=POOL_MAXSIZE,
+                 pool_block=False, cache=None,
+                 single_flight=SINGLE_FLIGHT, hedging=None,
+                 write_behind=None, replica=None, compress_min_size=None,
+                 limiter=None, authenticate=True, cc_tracker=None,
+                 results='dicts', timeout=TIMEOUT, primary=None,
+                 server_options=None, registered=None):
+        if results not in RESULTS:
+            raise ValueError("results must be one of %s" % ", ".join(RESULTS))
+        self.servers = None
+        if isinstance(base_url, ServerPool):
+            self.servers = base_url
+        elif not isinstance(base_url, str):
+            self.servers = ServerPool(base_url, primary,
+                                      **(server_options or {}))
+        if self.servers is not None:
+            base_url = self.servers.primary
+        self.url = base_url
+        self.user = user
+        self.pwd = pwd
+        self.cache = cache
+        self.single_flight = single_flight
+        self.hedging = hedging
+        self.write_behind = write_behind
+        self.replica = replica
+        self.compress_min_size = compress_min_size
+        self.limiter = limiter
+        self.timeout = timeout
+        if cc_tracker is None:
+            cc_tracker = CcTracker() if replica is None else replica
+        self.cc_tracker = cc_tracker
+        self.registered = None
+        if registered is not None:
+            self.registered = frozenset(registered).union((user,))
+        self.results = results
+
+        # Request fragments serialized once per client, see _post
+        self._urls = _endpoint_urls(base_url)
+        self._credentials = _auth_fragment(user, pwd)
+
+        if session is None:
+            session = new_session(pool_connections,
+                                  pool_maxsize,
+                                  pool_block)
+        self.session = session
+
+        self.authentication = None
+        if authenticate:
+            self.authentication = Authentication(self._credentials)
+            try:
+                self._login(self._credentials)
+            except (RequestException, ValueError, KeyError):
+                pass   # Unreachable or failing server, see above
+
+    def bug(self, bug_id=None):
+        """
+        Returns a Bug handle for bug_id, or for no bug in particular if
+        None, making its requests through this client.
+
+        """
+
+        handle = object.__new__(Bug)   # Skips Bug.__init__
+        handle.client = self
+        handle.bug_id = bug_id
+        return handle
+
+    def close(self):
+        """
+        Closes the client's session, and its pooled connections.
+
+        """
+
+        self.session.close()
+
+    def _send(self, method, complete_url, data=None, headers=None,
+              timeout=None, deadline=None):
+        # Every request goes through here, complete_url on the primary
+        # server. Only timed while metrics hooks are registered, a
+        # limiter is set or there are several servers.
+        if timeout is None:
+            timeout = self.timeout
+        if self.servers is not None:
+            return self._send_routed(method, complete_url, data, headers,
+                                     timeout, deadline)
+        if deadline is not None:
+            timeout = _time_left(timeout, deadline)
+        if not _metrics_hooks and self.limiter is None:
+            return self.session.request(method, complete_url, data=data,
+                                        headers=headers, timeout=timeout)
+        return self._request(method, complete_url, data, headers, timeout,
+                             self.url)
+
+    def _request(self, method, complete_url, data, headers, timeout,
+                 base_url):
+        limiter = self.limiter
+        if limiter is not None:
+            token = limiter.acquire()
+        start = time.perf_counter()
+        request = None
+        try:
+            request = self.session.request(method, complete_url, data=data,
+                                           headers=headers, timeout=timeout)
+        except Exception as error:
+            if limiter is not None:
+                limiter.release(token, False)
+            if _metrics_hooks:
+                _emit_request_event(base_url, complete_url, method, start,
+                                    None, data, None, error)
+            raise
+        if limiter is not None:
+            limiter.release(token, _healthy(request.status_code))
+        if _metrics_hooks:
+            _emit_request_event(base_url, complete_url, method, start,
+                                request.status_code, data, request.content,
+                                None)
+        return request
+
+    def _send_routed(self, method, complete_url, data, headers, timeout,
+                     deadline):
+        # Reads go to the best servers first, see ServerPool. Writes
+        # only move on from a server that could not be reached, if the
+        # pool allows it, as they may have been applied otherwise.
+        path = complete_url[len(self.url):]
+        read = method == 'GET'
+        servers = self.servers
+        request = error = None
+        for base_url in servers.candidates(read):
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = _time_left(timeout, deadline)
+            start = servers.start(base_url)
+            try:
+                request = self._request(method, base_url + path, data,
+                                        headers, attempt_timeout, base_url)
+            except RequestException as exception:
+                servers.finish(base_url, start, False)
+                if not read and not isinstance(exception,
+                                               RequestsConnectionError):
+                    raise
+                error = exception
+                continue
+            healthy = _healthy(request.status_code)
+            servers.finish(base_url, start, healthy)
+            if healthy or not read:
+                return request
+        if request is None:
+            raise error
+        return request   # Every server failed, the last one answering
+
+    def _login(self, used_fragment, timeout=None, deadline=None):
+        # Validates the credentials, switching to a session token if the
+        # server issues them, unless another thread did since
+        # used_fragment was sent. Raises AuthenticationError if the
+        # server rejects them. Returns False if it has no /login/: the
+        # credentials are then only checked by the requests sending
+        # them, and retrying a rejected one is pointless.
+        auth = self.authentication
+        with auth.lock:
+            if auth.fragment is not used_fragment:
+                return True
+
+            request = self._send('POST', self._urls['/login/'],
+                                 self._credentials[0] + "}", None, timeout,
+                                 deadline)
+            if request.status_code == 404:
+                auth.fragment = self._credentials
+                auth.token = None
+                return False
+            if request.content.startswith(_AUTH_ERROR_BODY):
+                raise AuthenticationError("Authentication failure for %s" %
+                                          self.user)
+            request.raise_for_status()
+
+            auth.token = loads(request.content)['token']
+            auth.fragment = _json_fragment(('token', auth.token))
+            return True
+
+    def _post(self, complete_url, json_data, bug_id=None, retry=True,
+              timeout=None, deadline=None):
+        # The body is the pre-serialized authentication fragment (and
+        # bug_id, if any) merged with json_data.
+        auth = self.authentication
+        fragment = self._credentials if auth is None else auth.fragment
+        if bug_id is None:
+            request = self._send_body(complete_url, json_data, fragment,
+                                      timeout, deadline)
+        else:
+            request = self._send_body(complete_url, json_data,
+                                      _bug_fragment(fragment, bug_id),
+                                      timeout, deadline)
+
+        if auth is not None and request.content.startswith(_AUTH_ERROR_BODY):
+            if not retry:
+                raise AuthenticationError("Authentication failure for %s" %
+                                          self.user)
+            # Expired token, or credentials never validated
+            if not self._login(fragment, timeout, deadline):
+                raise AuthenticationError("Authentication failure for %s" %
+                                          self.user)
+            return self._post(complete_url, json_data, bug_id, False,
+                              timeout, deadline)
+        return request
+
+    def _send_body(self, complete_url, json_data, fragment, timeout=None,
+                   deadline=None):
+        if not json_data:
+            return self._send('POST', complete_url, fragment[0] + "}", None,
+                              timeout, deadline)
+
+        body = dumps(json_data)
+        if type(body) is bytes:
+            body = fragment[1] + b", " + body[1:]
+        else:
+            body = fragment[0] + ", " + body[1:]
+        if (self.compress_min_size is not None and
+                len(body) >= self.compress_min_size):
+            return self._send('POST', complete_url, _gzip(body),
+                              _GZIP_HEADERS, timeout, deadline)
+        return self._send('POST', complete_url, body, None, timeout, deadline)
+
+    def _timed_send(self, method, complete_url, timeout, deadline):
+        start = time.perf_counter()
+        return self._send(method, complete_url, None, None, timeout,
+                          deadline), start
+
+    def _send_hedged(self, method, complete_url, data=None, headers=None,
+                     timeout=None, deadline=None):
+        # Only for idempotent requests, see Hedging. Takes the same
+        # parameters as _send, but data and headers are not sent.
+        hedging = self.hedging
+        endpoint = _endpoint(self.url, complete_url)
+        delay = hedging.delay(endpoint)
+
+        first = hedging.executor.submit(self._timed_send, method,
+                                        complete_url, timeout, deadline)
+        try:
+            request, start = first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        else:
+            hedging.observe(endpoint, time.perf_counter() - start)
+            return request
+
+        if not hedging.allow():
+            request, start = first.result()
+            hedging.observe(endpoint, time.perf_counter() - start)
+            return request
+
+        second = hedging.executor.submit(self._timed_send, method,
+                                         complete_url, timeout, deadline)
+        pending = set((first, second))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()   # Only if not started yet
+                    request, start = future.result()
+                    hedging.observe(endpoint, time.perf_counter() - start,
+                                    hedge_won=future is second)
+                    return request
+        return future.result()   # Both failed, raise the last error
+
+    def _get(self, complete_url, timeout=None, deadline=None,
+             generation=None):
+        # Responses are read eagerly, so once returned they can be
+        # shared by every coalesced caller, each waiting for them within
+        # its own timeout and deadline. Reference data fetches only join
+        # those of the same cache generation.
+        send = self._send if self.hedging is None else self._send_hedged
+        if self.single_flight is None:
+            return send('GET', complete_url, None, None, timeout, deadline)
+        return self.single_flight.do(
+            (self.session, complete_url, generation), send, 'GET',
+            complete_url, None, None, timeout, deadline,
+            timeout=self.timeout if timeout is None else timeout,
+            deadline=deadline)
+
+    def _get_reference(self, complete_url, timeout=None, deadline=None):
+        # GET through the reference data cache, if any
+        if self.cache is None:
+            return loads(self._get(complete_url, timeout, deadline).content)
+
+        body = self.cache.get(complete_url, self._refresh_reference)
+        if body is None:
+            body = self._fetch_reference(complete_url, timeout, deadline)
+        return loads(body)
+
+    def _fetch_reference(self, complete_url, timeout=None, deadline=None):
+        generation = self.cache.generation(complete_url)
+        request = self._get(complete_url, timeout, deadline, generation)
+        if request.ok:
+            self.cache.set(complete_url, request.content, generation)
+        return request.content
+
+    def _refresh_reference(self, complete_url):
+        # Called by caches serving a stale entry. Failures leave it be.
+        def refresh():
+            try:
+                self._fetch_reference(complete_url)
+            except Exception:
+                pass
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+
+class Bug(object):
+
+    """
+    Object that manages all bug manipulation, as a handle on a Client
+    making its requests. Requires a registered user and password as
+    parameters, validated by the client (see Client): if the user is
+    not registered, AuthenticationError is raised.
+
+    There are 2 forms in which this object can be instantiated.
+        - Without bug_id: Can call only those generic functions which
+          doesn't require a concrete bug representation. Those which
+          require bug_id will raise a NameError exception when called
+          without bug_id.
+
+        - With bug_id: Represents a bug, thus apart from the functions
+          available without bug_id, it allows those functions that
+          manages a concrete bug, being able to update it, comment it...
+
+    Instantiating Bug creates a new client from base_url, user, pwd and
+    the keyword arguments in options, which are those of Client. Every
+    other handle, such as the ones returned by new_bug and derive, or by
+    Client.bug, shares an existing client instead, and holds nothing
+    but it and its bug_id: a million of them take about 50MB. Attributes
+    not found in the handle, such as url, session or cache, are those of
+    its client.
+
+    Every method also takes timeout and deadline keyword arguments,
+    bounding how long its requests may take (see Client). Those that
+    run out raise a requests Timeout.
+
+    Callable methods:
+        * new_bug
+        * update_bug
+        * add_comment
+        * add_bug_cc
+        * remove_bug_cc
+        * set_bug_cc
+        * add_component
+        * add_release
+        * add_product
+        * get_latest_created_bugs
+        * get_latest_updated_bugs
+        * get_components_list
+        * get_releases
+
+    """
+
+    # This works as **kwargs filter
+    OPTIONAL_KWARGS = ('priority',
+                       'severity',
+                       'status',
+                       'hardware',
+                       'whiteboard',
+                       'fixedinver',
+                       'version',
+                       'component_id',
+                       'subcomponent_id',
+                       'emails')
+    OPTIONAL_KWARGS_SET = frozenset(OPTIONAL_KWARGS)
+
+    __slots__ = ('client', 'bug_id')
+
+    def __init__(self, base_url, user, pwd, bug_id=None, **options):
+        self.client = Client(base_url, user, pwd, **options)
+        self.bug_id = bug_id
+
+    def __getattr__(self, name):
+        # Only called for attributes not in the handle. client may not
+        # be set yet, e.g. when copied.
+        if name == 'client' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def derive(self, bug_id):
+        """
+        Returns a Bug handle for bug_id sharing this instance's client.
+
+        """
+
+        return self.client.bug(bug_id)
+
+
+    def requires_bug_id(funct):
+        """
+        Decorator for those functions which fetch or modifies existing
+        bugs, thus requiring a bug_id. If Bug class is instantiated
+        without bug_id the calling of these functions will raise a
+        NameError exception.
+
+        """
+
+        def inner(self, *args, **kwargs):
+            if self.bug_id is not None:
+                return funct(self, *args, **kwargs)
+            else:
+                raise NameError("Not callable without bug_id")
+        # Lets optional_args_filter do this check itself, see below.
+        inner.requires_bug_id = funct
+        return inner
+
+    def optional_args_filter(funct):
+        """
+        Decorator that filters optional keyword arguments, accepting
+        only those data fields available in the Bugspad API:
+            - severity
+            - priority
+            - status
+            - version
+            - hardware
+            - whiteboard
+            - fixedinver
+            - component_id
+            - subcomponent_id
+            - emails (Can be either a single email or a list/tuple of
+                      mails)
+
+        Applicable to those functions which accepts arbitrary keyword
+        arguments. If any of the keyword arguments added is not in
+        OPTIONAL_KWARGS list, or timeout and deadline, those functions
+        will return "Wrong kwargs" string invariably.
+
+        """
+
+        # Applied over requires_bug_id, its check is folded in here to
+        # save a call per request.
+        requires_bug_id = hasattr(funct, 'requires_bug_id')
+        if requires_bug_id:
+            funct = funct.requires_bug_id
+
+        def inner(self, *args, **kwargs):
+            if kwargs:
+                if (not kwargs.keys() <= self.OPTIONAL_KWARGS_SET and not
+                        kwargs.keys() - _CALL_KWARGS <=
+                        self.OPTIONAL_KWARGS_SET):
+                    return "Wrong kwargs"
+
+                # Server requires a list as 'emails' value
+                if ('emails' in kwargs and not
+                        isinstance(kwargs['emails'], (list, tuple))):
+                    kwargs['emails'] = [kwargs['emails']]
+            if requires_bug_id and self.bug_id is None:
+                raise NameError("Not callable without bug_id")
+            return funct(self, *args, **kwargs)
+        return inner
+
+
+    @optional_args_filter
+    def new_bug(self, summary, description, component_id, timeout=None,
+                deadline=None, **kwargs):
+        """
+        Adds a new bug for the component given in component_id.
+        Summary and description are the minimum required data for a new
+        bug to be filed. The other optional data fields can be added as
+        keyword arguments, which include:
+                * priority
+                * severity
+                * status
+                * version
+                * hardware
+                * witheboard
+                * fixedinver
+                * subcomponent_id
+                * emails (can be either a single mail or a list/tuple or
+                          mails)
+
+        These keyword arguments are filtered by the optional_args_filter
+        decorator, meaning that if one of the keywords is wrong, the
+        whole function will not be called and error message is returned
+        instead.
+
+        Returns a Bug handle with the new bug's id provided, sharing
+        the instance's client, thus representing it and being able to
+        modify it.
+
+        """
+
+        complete_url = self.client._urls['/bug/']
+        json_data = {'component_id' : component_id,
+                     'summary' : summary,
+                     'description' : description}
+        json_data.update(kwargs) # Adds optional args if any
+        request = self.client._post(complete_url, json_data, None, True,
+                                    timeout, deadline)
+
+        try: 
+            bug_id = int(request.text)
+        except ValueError:
+            return request.text
+        if self.client.replica is not None:
+            self.client.replica.record_bug(bug_id, json_data)
+        if self.client.registered is not None:
+            self.client.cc_tracker.record_cc(
+                bug_id, self.client.registered.intersection(
+                    json_data.get('emails', ())))
+        return self.derive(bug_id)
+
+    @optional_args_filter
+    @requires_bug_id
+    def update_bug(self, timeout=None, deadline=None, **kwargs):
+        """
+        Updates the bug represented by the instance, adding or updating
+        those data fields passed as keyword arguments. As with new_bug,
+        these can be any of those keywords accepted by
+        optional_args_filter decorator, or else it won't be called and
+        an error message will be returned instead.
+
+        Returns the server response, wether 'Success' string if
+        succesful or convenient error message otherwise. With a
+        WriteBehind, returns a Future of that response instead, sent
+        within the client's default timeout; passing timeout or deadline
+        then raises ValueError, as they could not be kept.
+
+        """
+
+        if self.client.write_behind is not None:
+            if timeout is not None or deadline is not None:
+                raise ValueError("timeout and deadline can't be kept "
+                                 "through a WriteBehind")
+            return self.client.write_behind.update(self, kwargs)
+        return self._send_update(kwargs, timeout, deadline)
+
+    def _send_update(self, kwargs, timeout=None, deadline=None):
+        complete_url = self.client._urls['/updatebug/']
+        request = self.client._post(complete_url, kwargs, self.bug_id, True,
+                                    timeout, deadline)
+        replica = self.client.replica
+        if replica is not None and request.text.strip() == _SUCCESS:
+            replica.record_bug(self.bug_id, kwargs)
+
+        return request.text
+
+    def flush(self):
+        """
+        Sends the updates buffered by the instance's WriteBehind, if
+        any, and waits for them.
+
+        """
+
+        if self.client.write_behind is not None:
+            self.client.write_behind.flush()
+
+    @requires_bug_id
+    def add_comment(self, comment, timeout=None, deadline=None):
+        """
+        Adds a new comment to the bug, therefore requires an instance
+        with bug_id provided.
+
+        Returns server response, either the new comment's id if
+        succesful or an error message. [WHICH?]
+
+        """
+
+        complete_url = self.client._urls['/comment/']
+        json_data = {'desc' : comment}
+        request = self.client._post(complete_url, json_data, self.bug_id, True,
+                                    timeout, deadline)
+
+        return request.text # ??
+
+    @requires_bug_id
+    def add_bug_cc(self, *emails, timeout=None,
+                   deadline=None): # REVISE FUNCTION NAME
+        """
+        Adds cc users to the bug represented by the class instance. It
+        admits either one email or many, as many parameters or in a
+        single list/tuple. Must be an already registered user email,
+        otherwise it won't be added.
+
+        Returns empty string.
+
+        """
+
+        # ASK KUSHAL IF POSSIBLE TO ADD SOME FEEDBACK WHEN SUCCEED OR ERROR
+
+        if isinstance(emails[0], (list, tuple)): # unpack if list is passed
+            emails = emails[0]
+
+        return self._send_cc('add', emails, timeout, deadline)
+
+    @requires_bug_id
+    def remove_bug_cc(self, *emails, timeout=None, deadline=None):
+        """
+        Removes cc users from the bug represented by the class instance.
+        Emails can be either a single email, or many mails, as many
+        parameters or in a single list/tuple as the only parameter.
+
+        Returns empty string.
+
+        """
+
+        if isinstance(emails[0], (list, tuple)):
+            emails = emails[0]
+
+        return self._send_cc('remove', emails, timeout, deadline)
+
+    @requires_bug_id
+    def set_bug_cc(self, *emails, timeout=None, deadline=None):
+        """
+        Makes the given emails the cc list of the bug represented by the
+        class instance. As in add_bug_cc, emails can be passed as many
+        parameters or in a single list/tuple/set.
+
+        Only the difference with the cc list known by the instance's
+        CcTracker is sent: at most one request adding the missing emails
+        and one removing the extra ones, or none at all if nothing
+        changed. Emails cc'd by other means, unknown to the tracker, are
+        left as they are. Emails of users not registered (see Client) are
+        left out, as the server would drop them anyway.
+
+        Returns the server response to the last request sent, or None if
+        nothing was sent. Raises ValueError if the client was given no
+        registered users.
+
+        """
+
+        if self.client.registered is None:
+            raise ValueError("set_bug_cc needs the registered users, "
+                             "see Client")
+        if emails and isinstance(emails[0], (list, tuple, set, frozenset)):
+            emails = emails[0]
+        desired = self.client.registered.intersection(emails)
+        known = self.client.cc_tracker.cc(self.bug_id) or frozenset()
+
+        response = None
+        added = desired - known
+        if added:
+            response = self._send_cc('add', sorted(added), timeout,
+                                     deadline)
+        removed = known - desired
+        if removed:
+            response = self._send_cc('remove', sorted(removed), timeout,
+                                     deadline)
+        return response
+
+    def _send_cc(self, action, emails, timeout=None, deadline=None):
+        complete_url = self.client._urls['/bug/cc']
+        json_data = {'action' : action,
+                     'emails' : emails}
+        request = self.client._post(complete_url, json_data, self.bug_id, True,
+                                    timeout, deadline)
+
+        registered = self.client.registered
+        if registered is not None and not request.text.strip():   # Success
+            if action == 'add':
+                # Unregistered users' emails were dropped
+                self.client.cc_tracker.record_cc(
+                    self.bug_id, added=registered.intersection(emails))
+            else:
+                self.client.cc_tracker.record_cc(self.bug_id, removed=emails)
+        return request.text
+
+    def add_component(self, name, description, product_id, timeout=None,
+                      deadline=None):
+        """
+        Adds new component to the given product. Requires the product id
+        to which to add the component, and the name and description of
+        this new component.
+
+        Returns server response: if success, returns the new component's
+        data in a dictionary, as this:
+
+            {'id' : 'new_id',
+             'name' : 'name_of_new_component',
+             'description' : 'description_of_new_component'}
+
+        If the product doesn't exist, an error message 'No such product'
+        is returned.
+
+        """
+
+        complete_url = self.client._urls['/component/']
+        json_data = {'owner' : self.client.user,
+                     'name' : name,
+                     'description' : description,
+                     'product_id' : product_id}
+        request = self.client._post(complete_url, json_data, None, True,
+                                    timeout, deadline)
+        if self.client.cache is not None:
+            self.client.cache.discard("%s/components/%s/" %
+                                      (self.client.url, product_id))
+
+        if request.text[:1] == '{':    # Extra step for error message
+            component = loads(request.content)  # quotation consistency.
+            if (self.client.replica is not None and
+                    isinstance(component['id'], int)):
+                self.client.replica.record_component(product_id, component)
+            return component
+        else:
+            return request.text
+
+    def add_release(self, release_name, timeout=None, deadline=None):
+        """
+        Adds release to database, of which the name is provided in
+        release_name parameter. Returns SUCCESS msg.
+
+        """
+
+        complete_url = self.client._urls['/releases/']
+        json_data = {'name' : release_name}
+        request = self.client._post(complete_url, json_data, None, True,
+                                    timeout, deadline)
+        if self.client.cache is not None:
+            self.client.cache.discard(complete_url)
+        replica = self.client.replica
+        if replica is not None and request.text.strip() == _SUCCESS:
+            replica.record_release(release_name)
+
+        return request.text
+
+    def add_product(self, product_name, product_description, timeout=None,
+                    deadline=None):
+        """
+        Adds a new product to the database. Requires its name and
+        description as parameters.
+
+        Returns a dictionary containing id, name and description of the
+        new added product.
+
+        """
+
+        complete_url = self.client._urls['/product/']
+        json_data = {'name' : product_name,
+                     'description' : product_description}
+        request = self.client._post(complete_url, json_data, None, True,
+                                    timeout, deadline)
+        if self.client.cache is not None:
+            # The new id may have been looked up, and cached, as an
+            # unknown product before.
+            self.client.cache.discard_prefix("%s/components/" %
+                                             self.client.url)
+
+        return loads(request.content)
+
+
+    def get_latest_created_bugs(self, timeout=None, deadline=None):
+        """
+        Fetches the 10 latest created bugs' ids. 
+
+        Returns a list with these 10 bugs' information, which is
+        delivered in a dictionary containing bug's id, status and
+        summary, as this:
+
+            [{id : 'id0', status : 'status0', summary : 'summary0'}, ...
+             {id : 'idX', status : 'statusX', summary : 'summaryX'}]
+
+        Or a list of BugRecord, or a BugColumns, depending on the
+        client's results (see Client).
+
+        """
+
+        complete_url = self.client._urls['/latestcreated/']
+        request = self.client._get(complete_url, timeout, deadline)
+
+        # Server's response is not well formed json data, needs to be
+        # recursively parsed.
+        # FIXME: Server's returns a list of string, not a list of json
+        # objects.
+        bugs = _bug_results(request.content, self.client.results)
+        if self.client.replica is not None:
+            self.client.replica.record_bugs(bugs)
+        return bugs
+
+    def get_latest_updated_bugs(self, timeout=None, deadline=None):
+        """
+        Fetches the 10 latest updated bugs' id.
+
+        Returns a list with these 10 bugs' information, which is
+        delivered in a dictionary containing bug's id, status and
+        summary, as this:
+
+            [{id : 'id0', status : 'status0', summary : 'summary0'}, ...
+             {id : 'idX', status : 'statusX', summary : 'summaryX'}]
+
+        Or a list of BugRecord, or a BugColumns, depending on the
+        client's results (see Client).
+
+        """
+
+        complete_url = self.client._urls['/latestupdated/']
+        request = self.client._get(complete_url, timeout, deadline)
+
+        bugs = _bug_results(request.content, self.client.results)
+        if self.client.replica is not None:
+            self.client.replica.record_bugs(bugs)
+        return bugs
+
+    def get_components_list(self, product_id, timeout=None, deadline=None):
+        """
+        Fetches the components list of a product. Requires this
+        product's id.
+
+        Returns a dictionary containing the components of the given
+        product, where keys are the component's name and their values
+        are themself a list containing the id, name and description of
+        the corresponding component. Those lists are ComponentRecord
+        instances, or the whole dictionary a ComponentColumns, depending
+        on the client's results (see Client).
 
+        """
 
-class Bug(object):
+        complete_url = "%s%s/" % (self.client._urls['/components/'],
+                                  product_id)
 
-    """
-    Object that manages all bug manipulation. Requires a registered user
-    and password as parameters; if the user is not registered, an
-    'authentication failure' error message is return on every function.
+        components = self.client._get_reference(complete_url, timeout,
+                                                 deadline)
+        if isinstance(components, dict):
+            if self.client.replica is not None:
+                self.client.replica.record_components(product_id,
+                                                      components)
+            components = _component_results(components, self.client.results)
+        return components
 
-    There are 2 forms in which this object can be instantiated.
-        - Without bug_id: Can call only those generic functions which
-          doesn't require a concrete bug representation. Those which
-          require bug_id will raise a NameError exception when called
-          without bug_id.
+    def get_releases(self, timeout=None, deadline=None):
+        """
+        Fetches the releases list, returns a list with all releases name
+        as strings.
 
-        - With bug_id: Represents a bug, thus apart from the functions
-          available without bug_id, it allows those functions that
-          manages a concrete bug, being able to update it, comment it...
+        """
 
-    base_url refers to the base url of the server.
+        complete_url = self.client._urls['/releases/']
 
-    Callable methods:
-        * new_bug
-        * update_bug
-        * add_comment
-        * add_bug_cc
-        * remove_bug_cc
-        * add_component
-        * add_release
-        * add_product
-        * get_latest_created_bugs
-        * get_latest_updated_bugs
-        * get_components_list
-        * get_releases
+        releases = self.client._get_reference(complete_url, timeout,
+                                              deadline)
+        if isinstance(releases, list):
+            if self.client.replica is not None:
+                self.client.replica.record_releases(releases)
+            if self.client.results != 'dicts':
+                releases = [sys.intern(release) for release in releases]
+        return releases
+
+
+class AsyncBug(object):
 
     """
+    asyncio counterpart of Bug. The Bug methods sending requests are
+    available here as coroutines with the same return values and filters
+    (requires_bug_id, optional_args_filter), so many calls can run
+    concurrently in a single event loop:
+
+        await asyncio.gather(*[bug.add_comment(text) for bug in bugs])
+
+    Requires the aiohttp package. Requests are sent through an aiohttp
+    ClientSession, created on first use or passed in the session
+    parameter. limit and limit_per_host bound the connector's
+    connections, and max_in_flight bounds how many requests may be
+    awaiting a response at once; callers beyond it wait their turn.
+    AsyncBug instances returned by new_bug share the session and the
+    in-flight bound of the instance that created them, as well as its
+    ReferenceCache if one was given in the cache parameter.
+
+    Identical GET requests awaited concurrently in the same event loop
+    are coalesced through ASYNC_SINGLE_FLIGHT, or the AsyncSingleFlight
+    given in the single_flight parameter (None disables it). They can
+    also be hedged with a Hedging policy, as in Bug, and request bodies
+    compressed through compress_min_size, as in Bug. An
+    AsyncAdaptiveLimit passed in the limiter parameter throttles them
+    as AdaptiveLimit does for Bug.
+
+    Every coroutine takes the timeout and deadline keyword arguments of
+    the Bug methods, but timeout bounds the whole call rather than each
+    request. Calls running out of either raise Timeout, or
+    DeadlineExceeded, as in Bug. The cc lists are tracked by the
+    CcTracker in cc_tracker, or a new one, for set_bug_cc, knowing the
+    registered users as in Client.
+
+    The session should be closed when done, either by awaiting close()
+    or by using the instance as an async context manager.
 
-    # This works as **kwargs filter
-    OPTIONAL_KWARGS = ('priority',
-                       'severity',
-                       'status',
-                       'hardware',
-                       'whiteboard',
-                       'fixedinver',
-                       'version',
-                       'component_id',
-                       'subcomponent_id',
-                       'emails')
+    """
+
+    OPTIONAL_KWARGS = Bug.OPTIONAL_KWARGS
+    OPTIONAL_KWARGS_SET = Bug.OPTIONAL_KWARGS_SET
+
+    def __init__(self, base_url, user, pwd, bug_id=None, session=None,
+                 limit=POOL_CONNECTIONS * POOL_MAXSIZE,
+                 limit_per_host=POOL_MAXSIZE,
+                 max_in_flight=POOL_MAXSIZE,
+                 semaphore=None, cache=None,
+                 single_flight=ASYNC_SINGLE_FLIGHT, hedging=None,
+                 compress_min_size=None, limiter=None, cc_tracker=None,
+                 registered=None):
+        if aiohttp is None:
+            raise ImportError("AsyncBug requires the aiohttp package")
 
-    def __init__(self, base_url, user, pwd, bug_id=None):
         self.bug_id = bug_id
         self.url = base_url
         self.user = user
         self.pwd = pwd
 
+        self.session = session
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max_in_flight)
+        self.semaphore = semaphore
+        self.cache = cache
+        self.single_flight = single_flight
+        self.hedging = hedging
+        self.compress_min_size = compress_min_size
+        self.limiter = limiter
+        if cc_tracker is None:
+            cc_tracker = CcTracker()
+        self.cc_tracker = cc_tracker
+        self.registered = registered
+        if registered is not None:
+            self.registered = frozenset(registered).union((user,))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the underlying aiohttp session, shared with every
+        instance derived from this one.
+
+        """
+
+        if self.session is not None:
+            await self.session.close()
+
+    def _get_session(self):
+        # ClientSession must be created inside a running event loop.
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def _send(self, method, complete_url, data=None, headers=None):
+        # Returns (response status, response body)
+        limiter = self.limiter
+        async with self.semaphore:
+            if not _metrics_hooks and limiter is None:
+                async with self._get_session().request(
+                        method, complete_url, data=data,
+                        headers=headers) as response:
+                    return response.status, await response.read()
+
+            if limiter is not None:
+                token = await limiter.acquire()
+            start = time.perf_counter()
+            try:
+                async with self._get_session().request(
+                        method, complete_url, data=data,
+                        headers=headers) as response:
+                    body = await response.read()
+            except BaseException as error:
+                # Cancelled hedges are not the server's fault
+                if limiter is not None:
+                    limiter.release(token,
+                                    isinstance(error, asyncio.CancelledError))
+                if _metrics_hooks and isinstance(error, Exception):
+                    _emit_request_event(self.url, complete_url, method,
+                                        start, None, data, None, error)
+                raise
+            if limiter is not None:
+                limiter.release(token, _healthy(response.status))
+            if _metrics_hooks:
+                _emit_request_event(self.url, complete_url, method, start,
+                                    response.status, data, body, None)
+            return response.status, body
+
+    async def _post(self, complete_url, json_data):
+        data = dumps(json_data)
+        headers = None
+        if (self.compress_min_size is not None and
+                len(data) >= self.compress_min_size):
+            data = _gzip(data)
+            headers = _GZIP_HEADERS
+        status, body = await self._send('POST', complete_url, data, headers)
+        return body.decode('utf-8')
+
+    async def _timed_send(self, method, complete_url):
+        start = time.perf_counter()
+        return await self._send(method, complete_url), start
+
+    async def _send_hedged(self, method, complete_url):
+        hedging = self.hedging
+        endpoint = _endpoint(self.url, complete_url)
+        delay = hedging.delay(endpoint)
+
+        first = asyncio.ensure_future(self._timed_send(method, complete_url))
+        done, _ = await asyncio.wait((first,), timeout=delay)
+        if done or not hedging.allow():
+            response, start = await first
+            hedging.observe(endpoint, time.perf_counter() - start)
+            return response
+
+        second = asyncio.ensure_future(self._timed_send(method,
+                                                        complete_url))
+        pending = set((first, second))
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        response, start = task.result()
+                        hedging.observe(endpoint,
+                                        time.perf_counter() - start,
+                                        hedge_won=task is second)
+                        return response
+            return task.result()   # Both failed, raise the last error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch(self, complete_url):
+        # Returns (response ok, response body)
+        if self.hedging is None:
+            status, body = await self._send('GET', complete_url)
+        else:
+            status, body = await self._send_hedged('GET', complete_url)
+        return status < 400, body
+
+    async def _coalesced_fetch(self, complete_url, generation=None):
+        if self.single_flight is None:
+            return await self._fetch(complete_url)
+        return await self.single_flight.do((self._get_session(),
+                                            complete_url, generation),
+                                           self._fetch,
+                                           complete_url)
+
+    async def _get(self, complete_url):
+        return (await self._coalesced_fetch(complete_url))[1]
+
+    async def _get_reference(self, complete_url):
+        if self.cache is None:
+            return loads(await self._get(complete_url))
+
+        body = self.cache.get(complete_url, self._refresh_reference)
+        if body is None:
+            body = await self._fetch_reference(complete_url)
+        return loads(body)
+
+    async def _fetch_reference(self, complete_url):
+        generation = self.cache.generation(complete_url)
+        ok, body = await self._coalesced_fetch(complete_url, generation)
+        if ok:
+            self.cache.set(complete_url, body, generation)
+        return body
+
+    def _refresh_reference(self, complete_url):
+        # Called by caches serving a stale entry. Failures leave it be.
+        async def refresh():
+            try:
+                await self._fetch_reference(complete_url)
+            except Exception:
+                pass
+
+        task = asyncio.ensure_future(refresh())
+        _background_tasks.add(task)   # Keeps it from being collected
+        task.add_done_callback(_background_tasks.discard)
+
 
     def requires_bug_id(funct):
         """
-        Decorator for those functions which fetch or modifies existing
-        bugs, thus requiring a bug_id. If Bug class is instantiated
-        without bug_id the calling of these functions will raise a
-        NameError exception.
+        Coroutine version of Bug.requires_bug_id.
 
         """
 
-        def inner(self, *args, **kwargs):
+        async def inner(self, *args, **kwargs):
             if self.bug_id is not None:
-                return funct(self, *args, **kwargs)
+                return await funct(self, *args, **kwargs)
             else:
                 raise NameError("Not callable without bug_id")
         return inner
 
-    def optional_args_filter(funct):
+    def time_limited(funct):
         """
-        Decorator that filters optional keyword arguments, accepting
-        only those data fields available in the Bugspad API:
-            - severity
-            - priority
-            - status
-            - version
-            - hardware
-            - whiteboard
-            - fixedinver
-            - component_id
-            - subcomponent_id
-            - emails (Can be either a single email or a list/tuple of
-                      mails)
+        Adds the timeout and deadline keyword arguments of Bug methods to
+        a coroutine, both bounding the whole call.
 
-        Applicable to those functions which accepts arbitrary keyword
-        arguments. If any of the keyword arguments added is not in
-        OPTIONAL_KWARGS list, those functions will return "Wrong kwargs"
-        string invariably.
+        """
+
+        async def inner(self, *args, timeout=None, deadline=None, **kwargs):
+            if timeout is None and deadline is None:
+                return await funct(self, *args, **kwargs)
+            limit = timeout
+            if deadline is not None:
+                limit = _time_left(timeout, deadline)
+            try:
+                return await asyncio.wait_for(funct(self, *args, **kwargs),
+                                              limit)
+            except asyncio.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded("Deadline exceeded") from None
+                raise Timeout("Call took over %s seconds" % limit) from None
+        return inner
 
+    def optional_args_filter(funct):
         """
+        Coroutine version of Bug.optional_args_filter.
 
-        def inner(self, *args, **kwargs):
-            for arg in kwargs.keys():
-                if arg not in self.OPTIONAL_KWARGS:
+        """
+
+        async def inner(self, *args, **kwargs):
+            if kwargs:
+                if not kwargs.keys() <= self.OPTIONAL_KWARGS_SET:
                     return "Wrong kwargs"
 
                 # Server requires a list as 'emails' value
-                if (arg == 'emails' and not
+                if ('emails' in kwargs and not
                         isinstance(kwargs['emails'], (list, tuple))):
                     kwargs['emails'] = [kwargs['emails']]
-            return funct(self, *args, **kwargs)
+            return await funct(self, *args, **kwargs)
         return inner
 
 
+    @time_limited
     @optional_args_filter
-    def new_bug(self, summary, description, component_id, **kwargs):
+    async def new_bug(self, summary, description, component_id, **kwargs):
         """
-        Adds a new bug for the component given in component_id.
-        Summary and description are the minimum required data for a new
-        bug to be filed. The other optional data fields can be added as
-        keyword arguments, which include:
-                * priority
-                * severity
-                * status
-                * version
-                * hardware
-                * witheboard
-                * fixedinver
-                * subcomponent_id
-                * emails (can be either a single mail or a list/tuple or
-                          mails)
-
-        These keyword arguments are filtered by the optional_args_filter
-        decorator, meaning that if one of the keywords is wrong, the
-        whole function will not be called and error message is returned
-        instead.
-
-        Returns a new instance of bug class with the new bug's id
-        provided, thus representing it and being able to modify it.
+        See Bug.new_bug. Returns a new AsyncBug instance.
 
         """
 
@@ -149,29 +3233,32 @@ class Bug(object):
                      'component_id' : component_id,
                      'summary' : summary,
                      'description' : description}
-        json_data.update(kwargs) # Adds optional args if any
-        request = post(complete_url, dumps(json_data))
-
-        try: 
-            return Bug(self.url,
-                       self.user,
-                       self.pwd,
-                       int(request.text))
+        json_data.update(kwargs)
+        response = await self._post(complete_url, json_data)
+
+        try:
+            return AsyncBug(self.url,
+                            self.user,
+                            self.pwd,
+                            int(response),
+                            session=self.session,
+                            semaphore=self.semaphore,
+                            cache=self.cache,
+                            single_flight=self.single_flight,
+                            hedging=self.hedging,
+                            compress_min_size=self.compress_min_size,
+                            limiter=self.limiter,
+                            cc_tracker=self.cc_tracker,
+                            registered=self.registered)
         except ValueError:
-            return request.text
+            return response
 
+    @time_limited
     @optional_args_filter
     @requires_bug_id
-    def update_bug(self, **kwargs):
+    async def update_bug(self, **kwargs):
         """
-        Updates the bug represented by the instance, adding or updating
-        those data fields passed as keyword arguments. As with new_bug,
-        these can be any of those keywords accepted by
-        optional_args_filter decorator, or else it won't be called and
-        an error message will be returned instead.
-
-        Returns the server response, wether 'Success' string if
-        succesful or convenient error message otherwise.
+        See Bug.update_bug.
 
         """
 
@@ -180,18 +3267,14 @@ class Bug(object):
                      'password' : self.pwd,
                      'bug_id' : self.bug_id}
         json_data.update(kwargs)
-        request = post(complete_url, dumps(json_data))
 
-        return request.text
+        return await self._post(complete_url, json_data)
 
+    @time_limited
     @requires_bug_id
-    def add_comment(self, comment):
+    async def add_comment(self, comment):
         """
-        Adds a new comment to the bug, therefore requires an instance
-        with bug_id provided.
-
-        Returns server response, either the new comment's id if
-        succesful or an error message. [WHICH?]
+        See Bug.add_comment.
 
         """
 
@@ -200,78 +3283,82 @@ class Bug(object):
                      'password' : self.pwd,
                      'desc' : comment,
                      'bug_id' : self.bug_id}
-        request = post(complete_url, dumps(json_data))
 
-        return request.text # ??
+        return await self._post(complete_url, json_data)
 
+    @time_limited
     @requires_bug_id
-    def add_bug_cc(self, *emails): # REVISE FUNCTION NAME
+    async def add_bug_cc(self, *emails):
         """
-        Adds cc users to the bug represented by the class instance. It
-        admits either one email or many, as many parameters or in a
-        single list/tuple. Must be an already registered user email,
-        otherwise it won't be added.
-
-        Returns empty string.
+        See Bug.add_bug_cc.
 
         """
 
-        # ASK KUSHAL IF POSSIBLE TO ADD SOME FEEDBACK WHEN SUCCEED OR ERROR
-
-        complete_url = "%s/bug/cc" % self.url
-
-        if isinstance(emails[0], (list, tuple)): # unpack if list is passed
+        if isinstance(emails[0], (list, tuple)):
             emails = emails[0]
 
-        json_data = {'user' : self.user,
-                     'password' : self.pwd,
-                     'bug_id' : self.bug_id,
-                     'action' : 'add',
-                     'emails' : emails}
-        request = post(complete_url, dumps(json_data))
-
-        return request.text
+        return await self._send_cc('add', emails)
 
+    @time_limited
     @requires_bug_id
-    def remove_bug_cc(self, *emails):
+    async def remove_bug_cc(self, *emails):
         """
-        Removes cc users from the bug represented by the class instance.
-        Emails can be either a single email, or many mails, as many
-        parameters or in a single list/tuple as the only parameter.
-
-        Returns empty string.
+        See Bug.remove_bug_cc.
 
         """
 
-        complete_url = "%s/bug/cc" % self.url
-
         if isinstance(emails[0], (list, tuple)):
             emails = emails[0]
 
+        return await self._send_cc('remove', emails)
+
+    @time_limited
+    @requires_bug_id
+    async def set_bug_cc(self, *emails):
+        """
+        See Bug.set_bug_cc.
+
+        """
+
+        if self.registered is None:
+            raise ValueError("set_bug_cc needs the registered users, "
+                             "see AsyncBug")
+        if emails and isinstance(emails[0], (list, tuple, set, frozenset)):
+            emails = emails[0]
+        desired = self.registered.intersection(emails)
+        known = self.cc_tracker.cc(self.bug_id) or frozenset()
+
+        response = None
+        added = desired - known
+        if added:
+            response = await self._send_cc('add', sorted(added))
+        removed = known - desired
+        if removed:
+            response = await self._send_cc('remove', sorted(removed))
+        return response
+
+    async def _send_cc(self, action, emails):
+        complete_url = "%s/bug/cc" % self.url
         json_data = {'user' : self.user,
                      'password' : self.pwd,
                      'bug_id' : self.bug_id,
-                     'action' : 'remove',
+                     'action' : action,
                      'emails' : emails}
-        request = post(complete_url, dumps(json_data))
+        response = await self._post(complete_url, json_data)
 
-        return request.text
+        if self.registered is not None and not response.strip():
+            if action == 'add':
+                # Unregistered users' emails were dropped
+                self.cc_tracker.record_cc(
+                    self.bug_id, added=self.registered.intersection(emails))
+            else:
+                self.cc_tracker.record_cc(self.bug_id, removed=emails)
+        return response
 
-    def add_component(self, name, description, product_id):
+    @time_limited
+    async def add_component(self, name, description, product_id):
         """
-        Adds new component to the given product. Requires the product id
-        to which to add the component, and the name and description of
-        this new component.
-
-        Returns server response: if success, returns the new component's
-        data in a dictionary, as this:
-
-            {'id' : 'new_id',
-             'name' : 'name_of_new_component',
-             'description' : 'description_of_new_component'}
-
-        If the product doesn't exist, an error message 'No such product'
-        is returned.
+        See Bug.add_component.
 
         """
 
@@ -282,17 +3369,19 @@ class Bug(object):
                      'name' : name,
                      'description' : description,
                      'product_id' : product_id}
-        request = post(complete_url, dumps(json_data))
+        response = await self._post(complete_url, json_data)
+        if self.cache is not None:
+            self.cache.discard("%s/components/%s/" % (self.url, product_id))
 
-        if request.content[0] is '{':  # Extra step for error message
-            return request.json        # quotation consistency.
+        if response[:1] == '{':
+            return loads(response)
         else:
-            return request.text
+            return response
 
-    def add_release(self, release_name):
+    @time_limited
+    async def add_release(self, release_name):
         """
-        Adds release to database, of which the name is provided in
-        release_name parameter. Returns SUCCESS msg.
+        See Bug.add_release.
 
         """
 
@@ -300,17 +3389,16 @@ class Bug(object):
         json_data = {'user' : self.user,
                      'password' : self.pwd,
                      'name' : release_name}
-        request = post(complete_url, dumps(json_data))
+        response = await self._post(complete_url, json_data)
+        if self.cache is not None:
+            self.cache.discard(complete_url)
 
-        return request.text
+        return response
 
-    def add_product(self, product_name, product_description):
+    @time_limited
+    async def add_product(self, product_name, product_description):
         """
-        Adds a new product to the database. Requires its name and
-        description as parameters.
-
-        Returns a dictionary containing id, name and description of the
-        new added product.
+        See Bug.add_product.
 
         """
 
@@ -319,84 +3407,393 @@ class Bug(object):
                      'password' : self.pwd,
                      'name' : product_name,
                      'description' : product_description}
-        request = post(complete_url, dumps(json_data))
+        response = await self._post(complete_url, json_data)
+        if self.cache is not None:
+            self.cache.discard_prefix("%s/components/" % self.url)
 
-        return request.json
+        return loads(response)
 
 
-    def get_latest_created_bugs(self):
+    @time_limited
+    async def get_latest_created_bugs(self):
         """
-        Fetches the 10 latest created bugs' ids. 
-
-        Returns a list with these 10 bugs' information, which is
-        delivered in a dictionary containing bug's id, status and
-        summary, as this:
-
-            [{id : 'id0', status : 'status0', summary : 'summary0'}, ...
-             {id : 'idX', status : 'statusX', summary : 'summaryX'}]
+        See Bug.get_latest_created_bugs.
 
         """
 
         complete_url = "%s/latestcreated/" % self.url
-        request = get(complete_url)
-
-        # Server's response is not well formed json data, needs to be
-        # recursively parsed.
-        # FIXME: Server's returns a list of string, not a list of json
-        # objects.
-        parsed_request = []
-        for bug_string in request.json:
-            parsed_request.append(loads(bug_string))
+        response = await self._get(complete_url)
 
-        return parsed_request
+        return loads_nested(response)
 
-    def get_latest_updated_bugs(self):
+    @time_limited
+    async def get_latest_updated_bugs(self):
         """
-        Fetches the 10 latest updated bugs' id.
-
-        Returns a list with these 10 bugs' information, which is
-        delivered in a dictionary containing bug's id, status and
-        summary, as this:
-
-            [{id : 'id0', status : 'status0', summary : 'summary0'}, ...
-             {id : 'idX', status : 'statusX', summary : 'summaryX'}]
+        See Bug.get_latest_updated_bugs.
 
         """
 
         complete_url = "%s/latestupdated/" % self.url
-        request = get(complete_url)
-        parsed_request = []
-        for bug_string in request.json:
-            parsed_request.append(loads(bug_string))
+        response = await self._get(complete_url)
 
-        return parsed_request
+        return loads_nested(response)
 
-    def get_components_list(self, product_id):
+    @time_limited
+    async def get_components_list(self, product_id):
         """
-        Fetches the components list of a product. Requires this
-        product's id.
-
-        Returns a dictionary containing the components of the given
-        product, where keys are the component's name and their values
-        are themself a list containing the id, name and description of
-        the corresponding component.
+        See Bug.get_components_list.
 
         """
 
         complete_url = "%s/components/%s/" % (self.url, product_id)
-        request = get(complete_url)
-        json_response = request.json
 
-        return request.json
+        return await self._get_reference(complete_url)
 
-    def get_releases(self):
+    @time_limited
+    async def get_releases(self):
         """
-        Fetches the releases list, returns a list with all releases name
-        as strings.
+        See Bug.get_releases.
 
         """
 
         complete_url = "%s/releases/" % self.url
-        request = get(complete_url)
 
-        return request.json
+        return await self._get_reference(complete_url)
+
+
+# Change notification yielded by ChangeFeed. kind is 'created',
+# 'updated' or 'gap'. bug is the bug, as returned by get_latest_*_bugs
+# (a dictionary, or a BugRecord), or None for gaps. missed is, for
+# gaps, the list of ids known to have been missed, or None if they
+# can't be known.
+FeedEvent = namedtuple('FeedEvent', 'kind bug missed')
+
+
+class ChangeFeed(object):
+
+    """
+    Incremental feed of bug changes built on top of the latestcreated
+    and latestupdated endpoints of a Bug instance (which may lack
+    bug_id). Iterating over it polls forever, yielding a FeedEvent for
+    every bug not seen before with its current status:
+
+        for event in ChangeFeed(bug):
+            if event.kind == 'gap':
+                resync(event.missed)
+            else:
+                refresh(event.bug)
+
+    Bugs are deduplicated by (id, status), remembering the last
+    max_seen bugs. The polling interval adapts to the change rate: it is
+    halved down to min_interval after every poll with changes, and
+    grown by half up to max_interval after every quiet one.
+
+    Since both endpoints only return the LATEST_WINDOW most recent bugs,
+    bursts of changes between polls can overflow them. For created bugs
+    this is detected exactly (ids are sequential) and a 'gap' event
+    lists the missed ids. For updated bugs it is detected when a full
+    window shares no bug with the previous one, and reported as a 'gap'
+    with missed=None. Either way the interval drops to min_interval.
+
+    Bugs present at the first poll are only reported if include_existing
+    is True. Use poll() to run a single polling round without sleeping.
+
+    """
+
+    LATEST_WINDOW = 10
+
+    def __init__(self, bug, created=True, updated=True, min_interval=1.0,
+                 max_interval=60.0, include_existing=False,
+                 max_seen=100000, sleep=time.sleep):
+        self.bug = bug
+        self.created = created
+        self.updated = updated
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.include_existing = include_existing
+        self.max_seen = max_seen
+        self.sleep = sleep
+
+        self._seen = OrderedDict()   # bug id -> last seen status
+        self._last_created = None    # highest created id seen
+        self._last_updated = None    # ids of the previous updated window
+
+    def __iter__(self):
+        while True:
+            for event in self.poll():
+                yield event
+            self.sleep(self.interval)
+
+    def _is_new(self, bug):
+        if self._seen.get(bug['id']) == bug['status']:
+            self._seen.move_to_end(bug['id'])
+            return False
+        self._seen[bug['id']] = bug['status']
+        self._seen.move_to_end(bug['id'])
+        if len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        return True
+
+    def _poll_created(self):
+        bugs = self.bug.get_latest_created_bugs()
+        first_poll = self._last_created is None
+        last = self._last_created or 0
+        events = []
+
+        oldest = min([bug['id'] for bug in bugs] or [last + 1])
+        if (not first_poll and oldest > last + 1 and
+                len(bugs) >= self.LATEST_WINDOW):
+            events.append(FeedEvent('gap', None,
+                                    list(range(last + 1, oldest))))
+
+        for bug in reversed(bugs):   # oldest first
+            # Status changes of older bugs are left to _poll_updated
+            if bug['id'] <= last:
+                continue
+            self._last_created = bug['id']
+            if self._is_new(bug) and (not first_poll or
+                                      self.include_existing):
+                events.append(FeedEvent('created', bug, None))
+        if self._last_created is None:
+            self._last_created = 0   # No bugs yet, every later one is new
+        return events
+
+    def _poll_updated(self):
+        bugs = self.bug.get_latest_updated_bugs()
+        ids = set(bug['id'] for bug in bugs)
+        first_poll = self._last_updated is None
+        events = []
+
+        if (not first_poll and len(bugs) >= self.LATEST_WINDOW and
+                not ids & self._last_updated):
+            events.append(FeedEvent('gap', None, None))
+
+        for bug in reversed(bugs):   # least recently updated first
+            if self._is_new(bug) and (not first_poll or
+                                      self.include_existing):
+                events.append(FeedEvent('updated', bug, None))
+        self._last_updated = ids
+        return events
+
+    def poll(self):
+        """
+        Runs one polling round and returns the list of new events,
+        adapting the polling interval to them.
+
+        """
+
+        events = []
+        if self.created:
+            events.extend(self._poll_created())
+        if self.updated:
+            events.extend(self._poll_updated())
+
+        if any(event.kind == 'gap' for event in events):
+            self.interval = self.min_interval
+        elif events:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        return events
+
+
+# Outcome of a BugSet operation on one bug. response is what the Bug
+# method returned, or None if it raised error.
+BugResult = namedtuple('BugResult', 'bug_id response error')
+
+# Weight of each call's duration in the average used by BugSet budgets
+_CALL_DURATION_ALPHA = 0.2
+
+
+class OutcomeUnknown(Exception):
+
+    """
+    Error of a BugResult whose request was sent, but got no response in
+    time: the server may have applied it or not. Unlike other errors,
+    retrying it blindly may apply the change twice.
+
+    """
+
+
+class BugSet(object):
+
+    """
+    Set of bugs, held as a compact array of ids, on which add_comment,
+    update_bug, add_bug_cc, remove_bug_cc and set_bug_cc can be run all
+    at once:
+
+        bugs = BugSet(Bug(base_url, user, pwd), range(1, 5001))
+        for result in bugs.add_comment("Mass triage"):
+            if result.error is not None:
+                retry(result.bug_id)
+
+    The operations take the same parameters as the Bug methods, start
+    right away, and run on up to max_workers bugs concurrently through
+    instances derived from bug (see Bug.derive). They return an iterator
+    of BugResult, yielded as soon as each bug is done, so one failing
+    bug never stops the rest. If bug has an AdaptiveLimit, concurrency
+    adapts below max_workers to the server's health.
+
+    They also take a timeout for each request, and a budget: the
+    seconds the whole operation may take. Every call then gets the
+    budget's end as its deadline, and no more calls are started once
+    what is left of the budget is shorter than the calls take on
+    average. When the budget runs out, the results gathered so far are
+    all there is: bugs never started are reported right away with a
+    DeadlineExceeded error, and can be retried safely.
+
+    Calls still in flight then, or whose response timed out, are
+    reported with an OutcomeUnknown error instead: the server may have
+    applied them or not, so check before retrying them, or the change
+    may be made twice.
+
+    """
+
+    def __init__(self, bug, bug_ids=(), max_workers=8):
+        self.bug = bug
+        self.bug_ids = array('q', bug_ids)
+        self.max_workers = max_workers
+
+    def __len__(self):
+        return len(self.bug_ids)
+
+    def __iter__(self):
+        return iter(self.bug_ids)
+
+    def add(self, bug_id):
+        self.bug_ids.append(bug_id)
+
+    def add_comment(self, comment, timeout=None, budget=None):
+        return self._fan_out('add_comment', (comment,), {}, timeout, budget)
+
+    def update_bug(self, timeout=None, budget=None, **kwargs):
+        return self._fan_out('update_bug', (), kwargs, timeout, budget)
+
+    def add_bug_cc(self, *emails, timeout=None, budget=None):
+        return self._fan_out('add_bug_cc', emails, {}, timeout, budget)
+
+    def remove_bug_cc(self, *emails, timeout=None, budget=None):
+        return self._fan_out('remove_bug_cc', emails, {}, timeout, budget)
+
+    def set_bug_cc(self, *emails, timeout=None, budget=None):
+        """
+        Runs Bug.set_bug_cc on every bug, with the same emails, or with
+        a different list per bug if given a single {bug_id: emails}
+        dictionary; bugs missing from it are skipped. Bugs whose cc list
+        is already as wanted send nothing and get a None response.
+
+        """
+
+        if len(emails) == 1 and isinstance(emails[0], dict):
+            by_bug = emails[0]
+            return self._fan_out('set_bug_cc', (), {}, timeout, budget,
+                                 lambda bug_id: (by_bug[bug_id],),
+                                 [bug_id for bug_id in self.bug_ids
+                                  if bug_id in by_bug])
+        return self._fan_out('set_bug_cc', emails, {}, timeout, budget)
+
+    def _fan_out(self, method, args, kwargs, timeout=None, budget=None,
+                 bug_args=None, bug_ids=None):
+        # bug_args, if given, returns the args for each bug id
+        results = Queue()
+        slots = threading.Semaphore(self.max_workers)
+        executor = ThreadPoolExecutor(self.max_workers)
+        if bug_ids is None:
+            bug_ids = self.bug_ids
+        bug_ids = array('q', bug_ids)   # Later adds not included
+        deadline = None if budget is None else time.monotonic() + budget
+        if timeout is not None:
+            kwargs = dict(kwargs, timeout=timeout)
+        if deadline is not None:
+            kwargs = dict(kwargs, deadline=deadline)
+
+        # Indexes in bug_ids of the calls in flight, and of the first
+        # one not started yet. Once expired, results are left to
+        # _results, and no more calls are started. duration is the
+        # moving average of the calls done, None until the first one.
+        lock = threading.Lock()
+        in_flight = set()
+        state = {'next' : 0, 'expired' : False, 'duration' : None}
+
+        def call(index, bug_id):
+            start = time.monotonic()
+            try:
+                response = getattr(self.bug.derive(bug_id), method)(
+                    *(args if bug_args is None else bug_args(bug_id)),
+                    **kwargs)
+            except ReadTimeout as error:
+                result = BugResult(bug_id, None, OutcomeUnknown(error))
+            except Exception as error:
+                result = BugResult(bug_id, None, error)
+            else:
+                result = BugResult(bug_id, response, None)
+            duration = time.monotonic() - start
+            with lock:
+                in_flight.discard(index)
+                if result.error is None:
+                    average = state['duration']
+                    state['duration'] = duration if average is None else (
+                        average + _CALL_DURATION_ALPHA * (duration - average))
+                if not state['expired']:
+                    results.put(result)
+            slots.release()
+
+        def dispatch():
+            # Submitting at most max_workers ahead keeps memory flat
+            # however many ids there are.
+            for index, bug_id in enumerate(bug_ids):
+                if deadline is None:
+                    slots.acquire()
+                else:
+                    left = deadline - time.monotonic()
+                    if left <= 0 or not slots.acquire(timeout=left):
+                        break
+                with lock:
+                    if state['expired'] or (
+                            deadline is not None and
+                            state['duration'] is not None and
+                            deadline - time.monotonic() < state['duration']):
+                        slots.release()   # Could not be done in time
+                        break
+                    in_flight.add(index)
+                    state['next'] = index + 1
+                executor.submit(call, index, bug_id)
+            executor.shutdown(wait=False)
+
+        dispatcher = threading.Thread(target=dispatch)
+        dispatcher.daemon = True
+        dispatcher.start()
+        return self._results(results, bug_ids, deadline, budget, lock,
+                             in_flight, state)
+
+    def _results(self, results, bug_ids, deadline, budget, lock, in_flight,
+                 state):
+        for _ in range(len(bug_ids)):
+            if deadline is None:
+                yield results.get()
+                continue
+            try:
+                yield results.get(timeout=max(0, deadline - time.monotonic()))
+            except Empty:
+                break
+        else:
+            return
+
+        # Out of budget: whatever is not done by now is given up
+        with lock:
+            state['expired'] = True
+            abandoned = sorted(in_flight)
+            first_unstarted = state['next']
+        while True:
+            try:
+                yield results.get_nowait()   # Done just in time
+            except Empty:
+                break
+        message = "Budget of %s seconds exhausted" % budget
+        unknown = OutcomeUnknown(message)
+        for index in abandoned:
+            yield BugResult(bug_ids[index], None, unknown)
+        error = DeadlineExceeded(message)
+        for bug_id in bug_ids[first_unstarted:]:
+            yield BugResult(bug_id, None, error)
@@ -0,0 +1,255 @@
+# Python-Bugspad micro-benchmarks
+# ===============================
+#
+# Measures the client-side cost of every Bug method against the
+# stand-in server (or any Bugspad instance given with --url).
+#
+#   python bugspad_bench.py [-n CALLS] [--latency SECS] [METHOD ...]
+#
+# ********************************************
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bugspad import Bug, InProcessTransport, UnixSocketTransport
+from bugspad_server import USERS, BugspadApp, BugspadState
+
+
+# Number of calls traced to measure allocations; tracing is slow, so
+# this runs separately from the timed calls.
+TRACED_CALLS = 20
+
+
+class CannedResponse(object):
+
+    def __init__(self, body):
+        self.content = body.encode('utf-8')
+        self.text = body
+        self.status_code = 200
+        self.ok = True
+
+    def raise_for_status(self):
+        pass
+
+
+class CannedSession(object):
+
+    """
+    Stand-in for a requests Session answering every request with a
+    canned response, without any I/O. Benchmarking through it measures
+    only the client's own work: building, encoding and decoding.
+
+    """
+
+    def __init__(self):
+        state = BugspadState()
+        latest = json.dumps(state.get_latest_created()) + "\n"
+        self.responses = {
+            ('POST', '/login/') : json.dumps({'token' : 'bench'}),
+            ('POST', '/bug/') : "11\n",
+            ('POST', '/updatebug/') : "\"Success\"\n",
+            ('POST', '/comment/') : "1\n",
+            ('POST', '/bug/cc') : "",
+            ('POST', '/component/') : json.dumps(
+                {'id' : 2, 'name' : 'bench', 'description' : 'Benchmark'}),
+            ('POST', '/releases/') : "\"Success\"\n",
+            ('POST', '/product/') : json.dumps(
+                {'id' : 2, 'name' : 'bench', 'description' : 'Benchmark'}),
+            ('GET', '/latestcreated/') : latest,
+            ('GET', '/latestupdated/') : latest,
+            ('GET', '/components/') : json.dumps(state.get_components(1)),
+            ('GET', '/releases/') : json.dumps(["bench"] * 10),
+        }
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        path = url[url.index('/', len('http://')):]
+        if path.startswith('/components/'):
+            path = '/components/'
+        return CannedResponse(self.responses[method, path])
+
+
+def bench_calls(bug):
+    """
+    Returns a {method name: callable} dict exercising every Bug method
+    through the given instance, which must have a bug_id.
+
+    """
+
+    email = next(iter(USERS))
+    return {
+        'new_bug' : lambda: bug.new_bug("Benchmark bug", "Benchmark", 1,
+                                        priority="high"),
+        'update_bug' : lambda: bug.update_bug(status="new",
+                                              priority="high"),
+        'add_comment' : lambda: bug.add_comment("Benchmark comment"),
+        'add_bug_cc' : lambda: bug.add_bug_cc(email),
+        'remove_bug_cc' : lambda: bug.remove_bug_cc(email),
+        'add_component' : lambda: bug.add_component("bench", "Benchmark",
+                                                    1),
+        'add_release' : lambda: bug.add_release("bench"),
+        'add_product' : lambda: bug.add_product("bench", "Benchmark"),
+        'get_latest_created_bugs' : bug.get_latest_created_bugs,
+        'get_latest_updated_bugs' : bug.get_latest_updated_bugs,
+        'get_components_list' : lambda: bug.get_components_list(1),
+        'get_releases' : bug.get_releases,
+    }
+
+
+def percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(call, calls):
+    """
+    Runs call calls times, and TRACED_CALLS more under tracemalloc.
+    Returns a dict with calls/sec, p50 and p99 latency in seconds,
+    client CPU seconds per call, errors (calls that raised) and the mean
+    peak of bytes allocated per call.
+
+    """
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(calls):
+        call_start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    latencies.sort()
+
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(TRACED_CALLS):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                call()
+            except Exception:
+                pass
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {'calls_per_sec' : calls / elapsed,
+            'p50' : percentile(latencies, 0.50),
+            'p99' : percentile(latencies, 0.99),
+            'cpu_per_call' : cpu / calls,
+            'errors' : errors,
+            'alloc_per_call' : allocated / TRACED_CALLS}
+
+
+def run(url, user, pwd, calls=1000, methods=None, session=None):
+    """
+    Benchmarks the given methods (all of them by default) against url,
+    through session if given. Returns a list of (method name, measure()
+    result) tuples.
+
+    """
+
+    bug = Bug(url, user, pwd, session=session, single_flight=None)
+    bug = bug.new_bug("Benchmark target", "Benchmark", 1)
+    available = bench_calls(bug)
+    results = []
+    for name in methods or available:
+        available[name]()   # warm up connection and code paths
+        results.append((name, measure(available[name], calls)))
+    return results
+
+
+def report(results, output=sys.stdout):
+    output.write("%-24s %10s %10s %10s %10s %7s %12s\n" % (
+        "method", "calls/s", "p50 ms", "p99 ms", "cpu us", "errors",
+        "alloc B/call"))
+    for name, result in results:
+        output.write("%-24s %10.0f %10.3f %10.3f %10.1f %7d %12.0f\n" % (
+            name,
+            result['calls_per_sec'],
+            result['p50'] * 1000,
+            result['p99'] * 1000,
+            result['cpu_per_call'] * 1000000,
+            result['errors'],
+            result['alloc_per_call']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Bug client methods.")
+    parser.add_argument('methods', nargs='*',
+                        help="methods to benchmark (default: all)")
+    parser.add_argument('-n', '--calls', type=int, default=1000,
+                        help="timed calls per method (default: 1000)")
+    parser.add_argument('--url',
+                        help="benchmark this server instead of a stand-in")
+    parser.add_argument('--user', default=next(iter(USERS)))
+    parser.add_argument('--password', default=USERS[next(iter(USERS))])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="stand-in server latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="stand-in server error injection rate")
+    parser.add_argument('--offline', action='store_true',
+                        help="answer with canned responses, without I/O, "
+                             "to measure client-side work only")
+    parser.add_argument('--transport', default='http',
+                        choices=('http', 'unix', 'inprocess'),
+                        help="stand-in server transport: TCP, Unix domain "
+                             "socket, or in-process calls, which count "
+                             "the server's work too (default: http)")
+    args = parser.parse_args(argv)
+
+    if args.offline:
+        report(run('http://offline', args.user, args.password, args.calls,
+                   args.methods, CannedSession()))
+        return
+    if args.transport == 'inprocess':
+        report(run('http://localhost', args.user, args.password, args.calls,
+                   args.methods, InProcessTransport(BugspadApp())))
+        return
+
+    server = None
+    session = None
+    url = args.url
+    tmp_dir = tempfile.TemporaryDirectory()
+    if url is None:
+        # The stand-in runs in its own process, so that neither its CPU
+        # time nor its allocations are attributed to the client.
+        command = [sys.executable,
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'bugspad_server.py'),
+                   '--latency', str(args.latency),
+                   '--error-rate', str(args.error_rate)]
+        if args.transport == 'unix':
+            command += ['--unix', os.path.join(tmp_dir.name, 'bench.sock')]
+        else:
+            command += ['--port', '0']
+        server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        url = server.stdout.readline().strip()
+        if args.transport == 'unix':
+            session = UnixSocketTransport(url)
+            url = 'http://localhost'
+
+    try:
+        report(run(url, args.user, args.password, args.calls, args.methods,
+                   session))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# Python-Bugspad bulk importer
+# ============================
+#
+# Files bugs in bulk from a JSONL or CSV dump through Bug.new_bug.
+#
+#   python bugspad_import.py URL USER INPUT -o OUTPUT [-w WORKERS]
+#
+# ********************************************
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED,
+                                ALL_COMPLETED)
+from getpass import getpass
+
+from requests import RequestException
+
+from bugspad import TIMEOUT, AdaptiveLimit, Bug
+
+
+REQUIRED_FIELDS = ('summary', 'description', 'component_id')
+INT_FIELDS = ('component_id', 'subcomponent_id')
+
+# Checkpoint is rewritten every CHECKPOINT_EVERY finished records.
+CHECKPOINT_EVERY = 100
+
+# Prefixes of the mapping lines of records not filed, see import_bugs.
+# Only the ERROR ones are tried again on resume.
+ERROR = 'error: '
+INVALID = 'invalid: '
+UNKNOWN = 'unknown: '
+
+# Counts of the records of an import_bugs run, by outcome
+ImportResult = namedtuple('ImportResult', 'filed failed unknown')
+
+
+def read_records(path, fmt=None):
+    """
+    Lazily yields (record_number, fields) tuples from a JSONL or CSV
+    file, one record at a time, so the input never sits in memory.
+    record_number starts at 1; for JSONL it is the line number, for CSV
+    the row number after the header. Blank JSONL lines are skipped but
+    still counted, and malformed ones yielded as the raw line, for
+    record_to_kwargs to reject.
+
+    fmt is either 'jsonl' or 'csv'; if None it is guessed from the file
+    extension.
+
+    """
+
+    if fmt is None:
+        fmt = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+    with open(path, newline='') as input_file:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(input_file), 1):
+                yield number, row
+        else:
+            for number, line in enumerate(input_file, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError:
+                        yield number, line
+
+
+def record_to_kwargs(fields):
+    """
+    Turns a raw input record into new_bug keyword arguments. Fields not
+    in REQUIRED_FIELDS or Bug.OPTIONAL_KWARGS, as well as empty ones,
+    are dropped. Raises ValueError if a required field is missing, or
+    the record is not a mapping of fields (e.g. a malformed line).
+
+    """
+
+    if not isinstance(fields, dict):
+        raise ValueError("Malformed record %.40r" % (fields,))
+    kwargs = {}
+    for key, value in fields.items():
+        if (key not in REQUIRED_FIELDS and key not in Bug.OPTIONAL_KWARGS
+                or value in (None, '')):
+            continue
+        if key in INT_FIELDS:
+            value = int(value)
+        elif key == 'emails' and isinstance(value, str):
+            value = [email.strip() for email in value.split(',')]
+        kwargs[key] = value
+
+    for key in REQUIRED_FIELDS:
+        if key not in kwargs:
+            raise ValueError("Missing required field '%s'" % key)
+    return kwargs
+
+
+def read_checkpoint(checkpoint_path, output_path):
+    """
+    Returns (watermark, done): every record up to watermark is finished,
+    and done is the set of finished record numbers above it, recovered
+    from the output mapping. Records mapped to an ERROR are not
+    finished, so that they are tried again. An incomplete last line, as
+    left by a crash, is removed from the mapping.
+
+    """
+
+    watermark = 0
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            watermark = json.load(checkpoint_file)['done']
+
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, 'rb+') as output_file:
+            size = 0
+            for line in output_file:
+                if not line.endswith(b'\n'):   # Cut short while written
+                    output_file.truncate(size)
+                    break
+                size += len(line)
+                number, result = line.decode('utf-8').split('\t', 1)
+                number = int(number)
+                if number > watermark and not result.startswith(ERROR):
+                    done.add(number)
+    return watermark, done
+
+
+def write_checkpoint(checkpoint_path, watermark):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump({'done': watermark}, checkpoint_file)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def file_record(bug, fields):
+    """
+    Files a single record. Returns the new bug's id, or the reason it
+    was not filed as a string, see import_bugs.
+
+    """
+
+    try:
+        kwargs = record_to_kwargs(fields)
+    except ValueError as error:
+        return INVALID + str(error)
+
+    try:
+        response = bug.new_bug(kwargs.pop('summary'),
+                               kwargs.pop('description'),
+                               kwargs.pop('component_id'),
+                               **kwargs)
+    except RequestException as error:
+        # Timed out or cut off, maybe after the server filed it
+        return UNKNOWN + str(error)
+    except Exception as error:
+        return ERROR + str(error)
+    if isinstance(response, Bug):
+        return response.bug_id
+    return ERROR + str(response).strip()
+
+
+def import_bugs(bug, records, output_path, checkpoint_path=None,
+                workers=8, budget=None):
+    """
+    Files every (record_number, fields) pair in records through
+    bug.new_bug using a pool of worker threads, and appends a
+    'record_number<TAB>bug_id' line to output_path for each one. When a
+    record is not filed, the bug id is replaced by a message: 'invalid:'
+    for malformed records, 'error:' for records the server rejected,
+    and 'unknown:' for requests that timed out or lost their connection,
+    which the server may have filed or not. Check these before filing
+    them again.
+
+    At most workers * 4 records are read ahead of the ones being filed.
+    Progress is checkpointed to checkpoint_path (output_path +
+    '.checkpoint' by default), so calling it again with the same files
+    resumes where the previous run stopped, skipping records already
+    written to the mapping. Records with an 'error:' are tried again
+    then, so a record number may be mapped more than once: the last line
+    wins.
+
+    With a budget, no more records are started after that many seconds:
+    the ones queued but not started yet are left to the next run, and
+    the ones already sent are waited for, so that none is filed twice.
+    The run may then end up to a request timeout past the budget.
+
+    Returns an ImportResult with the number of records filed in this
+    run, of those failed ('invalid:' or 'error:') and of those unknown.
+
+    """
+
+    if checkpoint_path is None:
+        checkpoint_path = output_path + '.checkpoint'
+    watermark, done = read_checkpoint(checkpoint_path, output_path)
+    deadline = None if budget is None else time.monotonic() + budget
+
+    counts = {'filed' : 0, 'failed' : 0, 'unknown' : 0}
+    pending = {}
+    with open(output_path, 'a') as output_file, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def collect(return_when):
+            nonlocal watermark
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                number = pending.pop(future)
+                if future.cancelled():
+                    continue   # Out of budget, left to the next run
+                result = future.result()
+                output_file.write("%d\t%s\n" % (number, result))
+                if not isinstance(result, str):
+                    counts['filed'] += 1
+                elif result.startswith(UNKNOWN):
+                    counts['unknown'] += 1
+                else:
+                    counts['failed'] += 1
+                if not isinstance(result, str) or \
+                        not result.startswith(ERROR):   # Errors retried
+                    done.add(number)
+            output_file.flush()
+
+            # Advance the watermark over contiguous finished records
+            previous = watermark
+            while watermark + 1 in done:
+                watermark += 1
+                done.discard(watermark)
+            if watermark // CHECKPOINT_EVERY > previous // CHECKPOINT_EVERY:
+                write_checkpoint(checkpoint_path, watermark)
+
+        last = 0
+        for number, fields in records:
+            # Records skipped by the reader (e.g. blank lines) count as
+            # finished for the watermark.
+            done.update(range(max(last, watermark) + 1, number))
+            last = number
+            if number <= watermark or number in done:
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+            pending[executor.submit(file_record, bug, fields)] = number
+            if len(pending) >= workers * 4:
+                collect(FIRST_COMPLETED)
+        if deadline is not None and time.monotonic() >= deadline:
+            for future in pending:
+                future.cancel()   # Only succeeds for those not started
+        if pending:
+            collect(ALL_COMPLETED)
+
+    write_checkpoint(checkpoint_path, watermark)
+    return ImportResult(**counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Bulk file bugs from a JSONL or CSV file.")
+    parser.add_argument('url', help="Bugspad server base url")
+    parser.add_argument('user', help="registered user email")
+    parser.add_argument('input', help="JSONL or CSV file of bug records")
+    parser.add_argument('-o', '--output', required=True,
+                        help="record number to bug id mapping file")
+    parser.add_argument('-f', '--format', choices=('jsonl', 'csv'),
+                        help="input format (default: from extension)")
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help="maximum parallel workers (default: 8)")
+    parser.add_argument('--fixed', action='store_true',
+                        help="always use every worker, instead of adapting "
+                             "concurrency to the server's health")
+    parser.add_argument('-c', '--checkpoint',
+                        help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument('-t', '--timeout', type=float,
+                        help="seconds to wait for the server on each "
+                             "request (default: %s)" % TIMEOUT)
+    parser.add_argument('-b', '--budget', type=float,
+                        help="stop after this many seconds, to resume "
+                             "later (default: run to the end)")
+    parser.add_argument('-z', '--compress-min-size', type=int,
+                        help="gzip request bodies of at least this many "
+                             "bytes (the server must support it)")
+    args = parser.parse_args(argv)
+
+    pwd = os.environ.get('BUGSPAD_PASSWORD') or getpass()
+    limiter = None
+    if not args.fixed:
+        limiter = AdaptiveLimit(initial_limit=min(args.workers, 4),
+                                max_limit=args.workers)
+    bug = Bug(args.url, args.user, pwd, pool_maxsize=args.workers,
+              compress_min_size=args.compress_min_size, limiter=limiter,
+              timeout=TIMEOUT if args.timeout is None else args.timeout)
+    result = import_bugs(bug,
+                         read_records(args.input, args.format),
+                         args.output,
+                         args.checkpoint,
+                         args.workers,
+                         args.budget)
+    print("%d bugs filed, %d failed" % (result.filed, result.failed),
+          file=sys.stderr)
+    if result.unknown:
+        print("%d unknown, maybe filed: check the 'unknown:' lines of %s "
+              "before filing them again" % (result.unknown, args.output),
+              file=sys.stderr)
+    if limiter is not None:
+        print("concurrency limit %(limit)d, %(drops)d drops, "
+              "%(waited)d waits" % limiter.snapshot(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
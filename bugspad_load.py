@@ -0,0 +1,363 @@
+# Python-Bugspad load generator
+# =============================
+#
+# Drives a mix of Bug operations against a Bugspad server (a stand-in
+# one by default) and reports throughput, latency percentiles and error
+# rates every interval, to find out what a deployment can sustain.
+#
+#   python bugspad_load.py [--url URL ... | --replicas N]
+#                          [--users N | --rate OPS]
+#                          [--mix OP=WEIGHT,...] [-d SECS]
+#
+# ********************************************
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bugspad import POOL_MAXSIZE, Bug, Client
+from bugspad_server import USERS
+
+
+DEFAULT_MIX = 'new_bug=1,update_bug=4,add_comment=3,' \
+              'get_latest_created_bugs=1,get_latest_updated_bugs=1'
+
+
+def _filed(response):
+    return isinstance(response, Bug)
+
+
+def _success(response):
+    return response.strip() == '"Success"'
+
+
+def _comment_id(response):
+    return response.strip().isdigit()
+
+
+def _bug_list(response):
+    return isinstance(response, list)
+
+
+# Operation name -> (function(handle), check(response)). The handle is
+# a Bug on a random bug filed by the run, see LoadTarget.
+OPERATIONS = {
+    'new_bug' : (lambda bug: bug.new_bug("Load test bug", "Load test", 1,
+                                         priority="low"),
+                 _filed),
+    'update_bug' : (lambda bug: bug.update_bug(status="new",
+                                               priority="high"),
+                    _success),
+    'add_comment' : (lambda bug: bug.add_comment("Load test comment"),
+                     _comment_id),
+    'get_latest_created_bugs' : (lambda bug: bug.get_latest_created_bugs(),
+                                 _bug_list),
+    'get_latest_updated_bugs' : (lambda bug: bug.get_latest_updated_bugs(),
+                                 _bug_list),
+}
+
+
+def parse_mix(text):
+    """
+    Parses an operation mix such as 'new_bug=1,update_bug=4' into a
+    list of (operation name, weight) tuples. A missing weight means 1.
+    Raises ValueError for unknown operations or negative weights.
+
+    """
+
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation '%s'" % name)
+        weight = float(weight) if weight else 1.0
+        if weight < 0:
+            raise ValueError("Negative weight for '%s'" % name)
+        mix.append((name, weight))
+    if not any(weight for _, weight in mix):
+        raise ValueError("Empty operation mix")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class LoadStats(object):
+
+    """
+    Thread-safe collector of operation outcomes. Keeps them both for the
+    current reporting window, emptied by take_window, and for the whole
+    run, per operation.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window = []   # (latency, ok) tuples
+        self._totals = {}   # operation name -> [latencies, errors]
+
+    def record(self, name, latency, ok):
+        with self._lock:
+            self._window.append((latency, ok))
+            totals = self._totals.get(name)
+            if totals is None:
+                totals = self._totals[name] = [[], 0]
+            totals[0].append(latency)
+            if not ok:
+                totals[1] += 1
+
+    def take_window(self):
+        with self._lock:
+            window, self._window = self._window, []
+        return window
+
+    def totals(self):
+        """
+        Returns a {operation name: (latencies sorted, errors)} dict.
+
+        """
+
+        with self._lock:
+            return dict((name, (sorted(latencies), errors))
+                        for name, (latencies, errors)
+                        in self._totals.items())
+
+
+class LoadTarget(object):
+
+    """
+    Runs operations through client, on handles for the bugs filed
+    during the run (the first one filed at creation), so that updates
+    and comments spread over a growing set of bugs as they would in
+    production.
+
+    """
+
+    def __init__(self, client, mix, stats):
+        self.client = client
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.stats = stats
+        first = client.bug().new_bug("Load test target", "Load test", 1)
+        if not isinstance(first, Bug):
+            raise RuntimeError("Cannot file bugs: %s" % str(first).strip())
+        self.bug_ids = [first.bug_id]
+
+    def run_one(self, scheduled=None):
+        # Latency counts from scheduled, if given, so that requests
+        # queued behind a saturated server are not left out.
+        name = random.choices(self.names, self.weights)[0]
+        function, check = OPERATIONS[name]
+        bug = self.client.bug(random.choice(self.bug_ids))
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            response = function(bug)
+            ok = check(response)
+        except Exception:
+            ok = False
+        self.stats.record(name, time.perf_counter() - start, ok)
+        if ok and name == 'new_bug':
+            self.bug_ids.append(response.bug_id)
+
+
+def closed_loop(target, users, duration):
+    """
+    Runs users threads, each issuing one operation after another until
+    duration seconds have passed.
+
+    """
+
+    deadline = time.perf_counter() + duration
+
+    def user():
+        while time.perf_counter() < deadline:
+            target.run_one()
+
+    threads = [threading.Thread(target=user) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def open_loop(target, rate, duration, workers):
+    """
+    Starts rate operations per second, evenly spaced, for duration
+    seconds, whatever the server's response times, through a pool of
+    workers threads. Operations that find every worker busy wait for
+    one, and that wait counts in their latency.
+
+    """
+
+    start = time.perf_counter()
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for number in range(total):
+            scheduled = start + number / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(target.run_one, scheduled)
+
+
+def report_window(window, elapsed, seconds, output=sys.stdout):
+    latencies = sorted(latency for latency, _ in window)
+    errors = sum(1 for _, ok in window if not ok)
+    output.write("%8.1f %10.1f %10.3f %10.3f %10.3f %8.2f\n" % (
+        elapsed,
+        len(window) / seconds,
+        percentile(latencies, 0.50) * 1000,
+        percentile(latencies, 0.95) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        100.0 * errors / len(window) if window else 0.0))
+    output.flush()
+
+
+def report_totals(totals, elapsed, output=sys.stdout):
+    output.write("\n%-24s %8s %10s %10s %10s %10s %8s\n" % (
+        "operation", "count", "ops/s", "p50 ms", "p95 ms", "p99 ms",
+        "errors%"))
+    for name in sorted(totals):
+        latencies, errors = totals[name]
+        output.write("%-24s %8d %10.1f %10.3f %10.3f %10.3f %8.2f\n" % (
+            name,
+            len(latencies),
+            len(latencies) / elapsed,
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            100.0 * errors / len(latencies)))
+
+
+def run(client, mix, duration, users=None, rate=None, workers=64,
+        interval=1.0, output=sys.stdout):
+    """
+    Generates load through client for duration seconds, closed loop
+    with users concurrent users, or open loop at rate operations per
+    second if rate is given. mix is a list of (operation name, weight)
+    tuples, see parse_mix. Writes a line of statistics every interval
+    seconds, and per operation totals at the end.
+
+    Returns the totals, as LoadStats.totals does.
+
+    """
+
+    stats = LoadStats()
+    target = LoadTarget(client, mix, stats)
+    finished = threading.Event()
+
+    output.write("%8s %10s %10s %10s %10s %8s\n" % (
+        "time s", "ops/s", "p50 ms", "p95 ms", "p99 ms", "errors%"))
+
+    start = time.perf_counter()
+
+    def reporter():
+        last = start
+        while True:
+            stopping = finished.wait(last + interval - time.perf_counter())
+            now = time.perf_counter()
+            window = stats.take_window()
+            if window or not stopping:   # The last one may be partial
+                report_window(window, now - start, now - last, output)
+            if stopping:
+                return
+            last = now
+
+    thread = threading.Thread(target=reporter)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        if rate is None:
+            closed_loop(target, users or 1, duration)
+        else:
+            open_loop(target, rate, duration, workers)
+    finally:
+        finished.set()
+        thread.join()
+    totals = stats.totals()
+    report_totals(totals, time.perf_counter() - start, output)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate load against a Bugspad server.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', action='append',
+                        help="load this server instead of a stand-in; "
+                             "repeat for replicas, the first taking the "
+                             "writes")
+    target.add_argument('--replicas', type=int, default=1,
+                        help="stand-in servers to start (default: 1)")
+    parser.add_argument('--user', default=next(iter(USERS)))
+    parser.add_argument('--password',
+                        default=os.environ.get('BUGSPAD_PASSWORD',
+                                               USERS[next(iter(USERS))]))
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-u', '--users', type=int, default=8,
+                      help="closed loop: concurrent users (default: 8)")
+    mode.add_argument('-r', '--rate', type=float,
+                      help="open loop: operations started per second")
+    parser.add_argument('-w', '--workers', type=int, default=64,
+                        help="open loop: maximum operations in flight "
+                             "(default: 64)")
+    parser.add_argument('-m', '--mix', default=DEFAULT_MIX,
+                        help="operation weights (default: %s)" %
+                             DEFAULT_MIX)
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help="seconds to run (default: 10)")
+    parser.add_argument('-i', '--interval', type=float, default=1.0,
+                        help="seconds between reports (default: 1)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="stand-in server latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="stand-in server error injection rate")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+
+    servers = []
+    urls = args.url
+    if urls is None:
+        # In their own processes, so that they do not compete with the
+        # load generator for the interpreter.
+        for _ in range(args.replicas):
+            servers.append(subprocess.Popen(
+                [sys.executable,
+                 os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'bugspad_server.py'),
+                 '--port', '0',
+                 '--latency', str(args.latency),
+                 '--error-rate', str(args.error_rate)],
+                stdout=subprocess.PIPE, text=True))
+        urls = [server.stdout.readline().strip() for server in servers]
+
+    concurrency = args.workers if args.rate is not None else args.users
+    client = Client(urls[0] if len(urls) == 1 else urls, args.user,
+                    args.password,
+                    pool_maxsize=max(concurrency, POOL_MAXSIZE))
+    try:
+        run(client, mix, args.duration, args.users, args.rate,
+            args.workers, args.interval)
+    finally:
+        client.close()
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
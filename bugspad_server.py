@@ -0,0 +1,522 @@
+# Python-Bugspad stand-in server
+# ==============================
+#
+# In-process, in-memory imitation of the Bugspad web API, answering
+# every endpoint used by bugspad.py the way the real server does. Meant
+# for tests and benchmarks, not for storing anything.
+#
+#   python bugspad_server.py [--port PORT | --unix PATH] [--latency SECS]
+#                            [--error-rate RATE] [--compress-min-size N]
+#
+# ********************************************
+
+import argparse
+import gzip
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from socketserver import ThreadingUnixStreamServer
+from json import dumps, loads
+
+
+# Default user, the same one used by tests.py against a live server.
+USERS = {'kushaldas@gmail.com' : 'asdf'}
+
+AUTH_ERROR = "Authentication failure."
+SUCCESS = "Success"
+NO_SUCH_PRODUCT = "No such product."
+NO_SUCH_BUG = "No such bug."
+
+# Number of items returned by /latestcreated/ and /latestupdated/.
+LATEST_WINDOW = 10
+
+
+class BugspadState(object):
+
+    """
+    In-memory Bugspad database. Starts with one product (id 1) holding
+    one component, and initial_bugs bugs filed against it.
+
+    All methods take the json data sent by the client and return the
+    value to be json encoded in the response; None means empty body.
+
+    """
+
+    def __init__(self, users=None, initial_bugs=10):
+        self.users = dict(USERS if users is None else users)
+        self.tokens = {}   # session token -> user
+        self.lock = threading.Lock()
+
+        self.products = {}
+        self.components = {}   # component_id -> [id, name, description]
+        self.product_components = {}   # product_id -> [component_id]
+        self.releases = []
+        self.bugs = {}
+        self.comments = {}
+        self.updated = {}   # bug ids, most recently updated last
+
+        user = next(iter(self.users), None)
+        product = self.add_product({'name' : 'Default product',
+                                    'description' : 'Stand-in product'})
+        self.add_component({'name' : 'default',
+                            'description' : 'Stand-in component',
+                            'product_id' : product['id'],
+                            'owner' : user})
+        for number in range(initial_bugs):
+            self.new_bug({'summary' : 'Stand-in bug %d' % (number + 1),
+                          'description' : 'Filed at start up',
+                          'component_id' : 1})
+
+    def authenticated(self, json_data):
+        if 'token' in json_data:
+            return json_data['token'] in self.tokens
+        password = self.users.get(json_data.get('user'))
+        return password is not None and password == json_data.get('password')
+
+    def login(self, json_data):
+        if not self.authenticated(json_data):
+            return AUTH_ERROR
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.tokens[token] = json_data['user']
+        return {'token' : token}
+
+    def _touch(self, bug_id):
+        self.updated.pop(bug_id, None)
+        self.updated[bug_id] = None
+
+    def _latest(self, bug_ids):
+        # bug_ids must be ordered newest first
+        return [dumps({'id' : bug_id,
+                       'status' : self.bugs[bug_id]['status'],
+                       'summary' : self.bugs[bug_id]['summary']})
+                for bug_id in islice(bug_ids, LATEST_WINDOW)]
+
+    def new_bug(self, json_data):
+        with self.lock:
+            bug_id = len(self.bugs) + 1
+            bug = {'status' : 'new', 'emails' : []}
+            bug.update(json_data)
+            bug.pop('user', None)
+            bug.pop('password', None)
+            bug.pop('token', None)
+            bug['emails'] = list(bug['emails'])
+            self.bugs[bug_id] = bug
+            self._touch(bug_id)
+        return bug_id
+
+    def update_bug(self, json_data):
+        with self.lock:
+            bug = self.bugs.get(json_data['bug_id'])
+            if bug is None:
+                return NO_SUCH_BUG
+            for key, value in json_data.items():
+                if key not in ('user', 'password', 'token', 'bug_id'):
+                    bug[key] = value
+            self._touch(json_data['bug_id'])
+        return SUCCESS
+
+    def add_comment(self, json_data):
+        with self.lock:
+            if json_data['bug_id'] not in self.bugs:
+                return NO_SUCH_BUG
+            comment_id = len(self.comments) + 1
+            self.comments[comment_id] = (json_data['bug_id'],
+                                         json_data['desc'])
+        return comment_id
+
+    def bug_cc(self, json_data):
+        with self.lock:
+            bug = self.bugs.get(json_data['bug_id'])
+            if bug is not None:
+                emails = json_data['emails']
+                if json_data['action'] == 'add':
+                    bug['emails'].extend(email for email in emails
+                                         if email in self.users and
+                                         email not in bug['emails'])
+                else:
+                    bug['emails'] = [email for email in bug['emails']
+                                     if email not in emails]
+        return None
+
+    def add_component(self, json_data):
+        with self.lock:
+            product_id = json_data['product_id']
+            if product_id not in self.products:
+                return {'id' : NO_SUCH_PRODUCT}
+            component_id = len(self.components) + 1
+            self.components[component_id] = [component_id,
+                                             json_data['name'],
+                                             json_data['description']]
+            self.product_components[product_id].append(component_id)
+        return {'id' : component_id,
+                'name' : json_data['name'],
+                'description' : json_data['description']}
+
+    def add_product(self, json_data):
+        with self.lock:
+            product_id = len(self.products) + 1
+            self.products[product_id] = json_data['name']
+            self.product_components[product_id] = []
+        return {'id' : product_id,
+                'name' : json_data['name'],
+                'description' : json_data['description']}
+
+    def add_release(self, json_data):
+        with self.lock:
+            self.releases.append(json_data['name'])
+        return SUCCESS
+
+    def get_components(self, product_id):
+        with self.lock:
+            components = {}
+            for component_id in self.product_components.get(product_id, ()):
+                component = self.components[component_id]
+                components[component[1]] = component
+        return components
+
+    def get_latest_created(self):
+        with self.lock:
+            return self._latest(range(len(self.bugs), 0, -1))
+
+    def get_latest_updated(self):
+        with self.lock:
+            return self._latest(reversed(self.updated))
+
+    def get_releases(self):
+        with self.lock:
+            return list(self.releases)
+
+
+def encode(value):
+    # Response body for value, as the Bugspad server writes it
+    if value is None:
+        return b''
+    return (dumps(value) + "\n").encode('utf-8')
+
+
+class BugspadApp(object):
+
+    """
+    Bugspad endpoints over a BugspadState, independent of any HTTP
+    server. Calling it with a request's method, path, headers (any
+    mapping with get) and raw body returns the (status, body) response.
+    BugspadHandler serves it over HTTP; bugspad.InProcessTransport can
+    call it directly.
+
+    """
+
+    # path -> (state method, requires authentication)
+    POST_ROUTES = {'/bug/' : ('new_bug', True),
+                   '/updatebug/' : ('update_bug', True),
+                   '/comment/' : ('add_comment', True),
+                   '/bug/cc' : ('bug_cc', True),
+                   '/component/' : ('add_component', True),
+                   '/product/' : ('add_product', True),
+                   '/releases/' : ('add_release', False),
+                   '/login/' : ('login', False)}
+
+    def __init__(self, state=None):
+        if state is None:
+            state = BugspadState()
+        self.state = state
+
+    def __call__(self, method, path, headers, body):
+        if method == 'POST':
+            return self.post(path, headers, body)
+        elif method == 'GET':
+            return self.get(path)
+        return 405, encode("Method not allowed")
+
+    def _decode_body(self, headers, body):
+        # Raises ValueError if the Content-Encoding is not supported
+        encoding = headers.get('Content-Encoding', 'identity')
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        elif encoding == 'deflate':
+            return zlib.decompress(body)
+        elif encoding != 'identity':
+            raise ValueError("Unsupported Content-Encoding")
+        return body
+
+    def post(self, path, headers, body):
+        route = self.POST_ROUTES.get(path)
+        if route is None:
+            return 404, encode("Not found")
+        method, auth_required = route
+
+        try:
+            json_data = loads(self._decode_body(headers, body))
+        except (ValueError, EOFError, OSError, zlib.error):
+            return 400, encode("Malformed request")
+        if auth_required and not self.state.authenticated(json_data):
+            return 200, encode(AUTH_ERROR)
+        return 200, encode(getattr(self.state, method)(json_data))
+
+    def get(self, path):
+        state = self.state
+        if path == '/latestcreated/':
+            return 200, encode(state.get_latest_created())
+        elif path == '/latestupdated/':
+            return 200, encode(state.get_latest_updated())
+        elif path == '/releases/':
+            return 200, encode(state.get_releases())
+        elif path.startswith('/components/') and path.endswith('/'):
+            try:
+                product_id = int(path[len('/components/'):-1])
+            except ValueError:
+                return 404, encode("Not found")
+            return 200, encode(state.get_components(product_id))
+        return 404, encode("Not found")
+
+
+class BugspadHandler(BaseHTTPRequestHandler):
+
+    """
+    Serves the server's BugspadApp, applying the configured latency and
+    error injection first.
+
+    """
+
+    protocol_version = 'HTTP/1.1'   # keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _inject(self):
+        """
+        Sleeps the configured latency and returns True if this request
+        must fail with an injected error.
+
+        """
+
+        server = self.server
+        with server.hits_lock:
+            server.hits[self.path] += 1
+
+        delay = server.latency
+        if server.jitter:
+            delay += server.random.uniform(0, server.jitter)
+        if server.stall_rate and server.random.random() < server.stall_rate:
+            delay += server.stall
+        failed = (server.error_rate and
+                  server.random.random() < server.error_rate)
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+
+        min_size = self.server.compress_min_size
+        if min_size is not None and len(body) >= min_size:
+            accepted = self.headers.get('Accept-Encoding', '')
+            if 'gzip' in accepted:
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            elif 'deflate' in accepted:
+                body = zlib.compress(body)
+                self.send_header('Content-Encoding', 'deflate')
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.hits_lock:
+            self.server.traffic['sent'] += len(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        with self.server.hits_lock:
+            self.server.traffic['received'] += len(body)
+        return body
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._inject():
+            return self._respond(500, encode("Injected error"))
+        self._respond(*self.server.app('POST', self.path, self.headers,
+                                       body))
+
+    def do_GET(self):
+        if self._inject():
+            return self._respond(500, encode("Injected error"))
+        self._respond(*self.server.app('GET', self.path, self.headers, b''))
+
+
+class UnixBugspadHandler(BugspadHandler):
+
+    disable_nagle_algorithm = False   # Not a TCP socket
+
+
+class StandInMixin(object):
+
+    """
+    Configuration, state and life cycle shared by the stand-in servers,
+    see StandInServer.
+
+    """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow response, e.g. after a timeout,
+        # are not worth a traceback.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(StandInMixin, self).handle_error(request, client_address)
+
+    def setup_stand_in(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                       users=None, initial_bugs=10, stall_rate=0.0,
+                       stall=1.0, seed=None, compress_min_size=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.random = random.Random(seed)
+        self.state = BugspadState(users, initial_bugs)
+        self.app = BugspadApp(self.state)
+        self.compress_min_size = compress_min_size
+        self.hits = Counter()
+        self.traffic = Counter()
+        self.hits_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StandInServer(StandInMixin, ThreadingHTTPServer):
+
+    """
+    Bugspad stand-in HTTP server. Listens on host:port (port 0 picks a
+    free one, see url) and serves from a fresh BugspadState.
+
+    latency is a delay in seconds added to every request, plus a random
+    extra delay of up to jitter seconds. With probability stall_rate a
+    request stalls for stall more seconds. error_rate is the probability
+    of any request failing with a 500 response. seed seeds the random
+    generator behind all of them. hits counts the requests received per
+    path.
+
+    Request bodies may be gzip or deflate encoded. Response bodies of
+    compress_min_size bytes or more are compressed with the first of
+    gzip or deflate accepted by the client; None disables it. traffic
+    counts the body bytes 'received' and 'sent', as transferred.
+
+    Use start() and stop() to serve from a background thread, or the
+    instance as a context manager:
+
+        with StandInServer(latency=0.01) as server:
+            bug = Bug(server.url, 'kushaldas@gmail.com', 'asdf')
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, users=None, initial_bugs=10,
+                 stall_rate=0.0, stall=1.0, seed=None,
+                 compress_min_size=None):
+        ThreadingHTTPServer.__init__(self, (host, port), BugspadHandler)
+        self.setup_stand_in(latency, jitter, error_rate, users,
+                            initial_bugs, stall_rate, stall, seed,
+                            compress_min_size)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+
+class UnixStandInServer(StandInMixin, ThreadingUnixStreamServer):
+
+    """
+    StandInServer listening on the Unix domain socket at path instead,
+    taking the same keyword arguments. Talk to it through a
+    bugspad.UnixSocketTransport:
+
+        with UnixStandInServer('/tmp/bugspad.sock') as server:
+            bug = Bug(server.url, 'kushaldas@gmail.com', 'asdf',
+                      session=UnixSocketTransport(server.path))
+
+    """
+
+    url = "http://localhost"   # Only the paths matter
+
+    def __init__(self, path, **options):
+        ThreadingUnixStreamServer.__init__(self, path, UnixBugspadHandler)
+        self.path = path
+        self.setup_stand_in(**options)
+
+    def server_close(self):
+        ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run an in-memory Bugspad stand-in server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9998)
+    parser.add_argument('--unix', metavar='PATH',
+                        help="listen on this Unix domain socket instead")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="maximum random extra latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="probability of a request failing with 500")
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help="probability of a request stalling")
+    parser.add_argument('--stall', type=float, default=1.0,
+                        help="stall duration, in seconds (default: 1)")
+    parser.add_argument('--compress-min-size', type=int,
+                        help="compress responses of at least this many "
+                             "bytes (default: never)")
+    args = parser.parse_args(argv)
+
+    options = {'latency' : args.latency,
+               'jitter' : args.jitter,
+               'error_rate' : args.error_rate,
+               'stall_rate' : args.stall_rate,
+               'stall' : args.stall,
+               'compress_min_size' : args.compress_min_size}
+    if args.unix is None:
+        server = StandInServer(args.host, args.port, **options)
+        print(server.url, flush=True)
+    else:
+        server = UnixStandInServer(args.unix, **options)
+        print(server.path, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,38 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
-from bugspad import Bug
-from random import randint
+import bugspad
+import requests
+from bugspad import (AsyncBug, Bug, ChangeFeed, ReferenceCache,
+                     SingleFlight)
+from bugspad_import import import_bugs, read_records, record_to_kwargs
+from bugspad_load import main as load_main, parse_mix, run as run_load
+from bugspad_server import BugspadApp, StandInServer, UnixStandInServer
+from random import Random, randint
+
+
+# Tests run against a bundled stand-in server unless BUGSPAD_URL points
+# to a live Bugspad instance.
+URL = os.environ.get('BUGSPAD_URL')
+server = None
+
+
+def setUpModule():
+    global URL, server
+    if URL is None:
+        server = StandInServer().start()
+        URL = server.url
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
 
 
 class BugTest(unittest.TestCase):
@@ -16,7 +48,7 @@ class BugTest(unittest.TestCase):
         self.WRONG_KWARGS = "Wrong kwargs"
         self.WRONG_PRODUCT = "No such product."
 
-        self.url = "http://127.0.0.1:9998"
+        self.url = URL
         self.usr = "kushaldas@gmail.com"
         self.pwd = "asdf"
 
@@ -28,7 +60,8 @@ class BugTest(unittest.TestCase):
         self.wrong_auth_bug = Bug(self.url,
                                   "wrongusr",
                                   self.pwd,
-                                  1)
+                                  1,
+                                  authenticate=False)
 
 
     def test_add_comment_without_id_raises_Exception(self):
@@ -111,7 +144,7 @@ class BugTest(unittest.TestCase):
 
         self.assertIs(type(response), dict)
         self.assertNotEqual(len(response), 0)
-        for component in response.iteritems():
+        for component in response.items():
             self.assertEqual(component[0], component[1][1])
 
     @unittest.skip("Too slow, comment this line to test this function")
@@ -120,7 +153,7 @@ class BugTest(unittest.TestCase):
 
         self.assertIs(type(response), dict)
         self.assertNotEqual(len(response), 0)
-        for component in response.iteritems():
+        for component in response.items():
             self.assertEqual(component[0], component[1][1])
 
     def test_get_components_list_wrong_product_id_returns_empty_dict(self):
@@ -171,7 +204,8 @@ class BugTest(unittest.TestCase):
 
             # Range inversed (start, stop(not included), step)
             self.assertEqual([bug['id'] for bug in response],
-                         range(response[0]['id'], (response[-1]['id']-1), -1))
+                         list(range(response[0]['id'],
+                                    (response[-1]['id']-1), -1)))
 
     def test_get_latest_created_bugs_auth_not_required(self):
         response = self.wrong_auth_bug.get_latest_created_bugs()
@@ -187,7 +221,8 @@ class BugTest(unittest.TestCase):
 
             # Range inversed (start, stop(not included), step)
             self.assertEqual([bug['id'] for bug in response],
-                         range(response[0]['id'], (response[-1]['id']-1), -1))
+                         list(range(response[0]['id'],
+                                    (response[-1]['id']-1), -1)))
 
 
     def test_get_latest_updated_bugs_returns_latest_bugs_list(self):
@@ -229,7 +264,7 @@ class BugTest(unittest.TestCase):
 
         self.assertIs(type(response), list)
         for release in response:
-            self.assertIsInstance(release, basestring)
+            self.assertIsInstance(release, str)
 
 
     def test_add_product_returns_product_info_dict(self):
@@ -279,6 +314,1587 @@ class BugTest(unittest.TestCase):
         self.assertEqual(response, '')
 
 
+class AsyncBugTest(unittest.TestCase):
+
+    """
+    TestCase for AsyncBug class, mirroring BugTest.
+
+    """
+
+    def setUp(self):
+        self.AUTH_ERROR = "\"Authentication failure.\"\n"
+        self.SUCCESS = "\"Success\"\n"
+        self.WRONG_KWARGS = "Wrong kwargs"
+
+        self.server = StandInServer().start()
+        self.usr = "kushaldas@gmail.com"
+        self.pwd = "asdf"
+
+    def tearDown(self):
+        self.server.stop()
+
+    def call(self, method, *args, bug_id=None, usr=None, **kwargs):
+        # Runs an AsyncBug method in its own event loop and session
+        async def run():
+            async with AsyncBug(self.server.url, usr or self.usr, self.pwd,
+                                bug_id) as bug:
+                return await getattr(bug, method)(*args, **kwargs)
+        return asyncio.run(run())
+
+
+    def test_add_comment_without_id_raises_Exception(self):
+        self.assertRaises(NameError, self.call, 'add_comment',
+                          "this is a comment")
+
+    def test_add_comment_wrong_auth_returns_AUTH_ERROR(self):
+        response = self.call('add_comment', "this is a comment", bug_id=1,
+                             usr="wrongusr")
+        self.assertEqual(response, self.AUTH_ERROR)
+
+    def test_add_comment_returns_comment_id(self):
+        response = self.call('add_comment', "this is a comment", bug_id=1)
+        self.assertTrue(response.strip().isdigit())
+        self.assertEqual(len(self.server.state.comments), 1)
+
+
+    def test_update_bug_without_id_raises_Exception(self):
+        self.assertRaises(NameError, self.call, 'update_bug',
+                          hardware="x86_64")
+
+    def test_update_bug_wrong_auth_returns_AUTH_ERROR(self):
+        response = self.call('update_bug', bug_id=1, usr="wrongusr",
+                             status="new", hardware="x86_64")
+        self.assertEqual(response, self.AUTH_ERROR)
+
+    def test_update_bug_returns_SUCCESS(self):
+        response = self.call('update_bug', bug_id=1, status="assigned",
+                             hardware="x86_64", priority="high")
+        self.assertEqual(response, self.SUCCESS)
+        self.assertEqual(self.server.state.bugs[1]['status'], "assigned")
+
+    def test_update_bug_wrong_kwargs_returns_WRONG_KWARGS(self):
+        response = self.call('update_bug', bug_id=1, wrong_kwarg="dummy")
+        self.assertEqual(response, self.WRONG_KWARGS)
+
+
+    def test_new_bug_returns_async_bug_instance(self):
+        response = self.call('new_bug', "This is a summary",
+                             "I had a bug...!", 1, priority="high",
+                             emails="kushaldas@gmail.com")
+        self.assertIsInstance(response, AsyncBug)
+        self.assertEqual(self.server.state.bugs[response.bug_id]['emails'],
+                         ["kushaldas@gmail.com"])
+
+    def test_new_bug_wrong_kwargs_returns_WRONG_KWARGS(self):
+        response = self.call('new_bug', "This is a summary",
+                             "I had a bug...!", 1, wrong_kwarg="dummy")
+        self.assertEqual(response, self.WRONG_KWARGS)
+
+    def test_new_bug_wrong_auth_returns_AUTH_ERROR(self):
+        response = self.call('new_bug', "This is a summary",
+                             "I had a bug...!", 1, usr="wrongusr")
+        self.assertEqual(response, self.AUTH_ERROR)
+
+
+    def test_add_bug_cc_one_email_returns_empty_string(self):
+        response = self.call('add_bug_cc', 'kushaldas@gmail.com', bug_id=1)
+        self.assertEqual(response, '')
+        self.assertEqual(self.server.state.bugs[1]['emails'],
+                         ['kushaldas@gmail.com'])
+
+    def test_add_bug_cc_emails_list_return_empty_string(self):
+        response = self.call('add_bug_cc', ['kushaldas@gmail.com',
+                                            'arnauorriolsmiro@gmail.com'],
+                             bug_id=1)
+        self.assertEqual(response, '')
+
+    def test_add_bug_cc_without_id_raises_Exception(self):
+        self.assertRaises(NameError, self.call, 'add_bug_cc',
+                          'kushaldas@gmail.com')
+
+    def test_remove_bug_cc_many_parameters_returns_empty_string(self):
+        self.call('add_bug_cc', 'kushaldas@gmail.com', bug_id=1)
+        response = self.call('remove_bug_cc', 'kushaldas@gmail.com',
+                             'arnauorriolsmiro@gmail.com', bug_id=1)
+        self.assertEqual(response, '')
+        self.assertEqual(self.server.state.bugs[1]['emails'], [])
+
+    def test_set_bug_cc_sends_only_the_delta(self):
+        async def run():
+            async with AsyncBug(self.server.url, self.usr, self.pwd, 1,
+                                registered=["arnauorriolsmiro@gmail.com"]
+                                ) as bug:
+                await bug.set_bug_cc("kushaldas@gmail.com",
+                                     "nobody@example.com")
+                return await bug.set_bug_cc(["kushaldas@gmail.com"])
+        self.assertIsNone(asyncio.run(run()))
+        self.assertEqual(self.server.hits['/bug/cc'], 1)
+        self.assertEqual(self.server.state.bugs[1]['emails'],
+                         ["kushaldas@gmail.com"])
+
+    def test_set_bug_cc_needs_registered_users(self):
+        self.assertRaises(ValueError, self.call, 'set_bug_cc',
+                          "kushaldas@gmail.com", bug_id=1)
+
+    def test_timeout_bounds_the_call(self):
+        with StandInServer(latency=0.5) as slow_server:
+            async def run():
+                async with AsyncBug(slow_server.url, self.usr,
+                                    self.pwd) as bug:
+                    await bug.get_releases(timeout=0.05)
+            self.assertRaises(requests.Timeout, asyncio.run, run())
+
+    def test_deadline_bounds_the_call(self):
+        with StandInServer(latency=0.5) as slow_server:
+            async def run():
+                async with AsyncBug(slow_server.url, self.usr,
+                                    self.pwd, 1) as bug:
+                    await bug.add_comment("this is a comment",
+                                          deadline=time.monotonic() + 0.05)
+            self.assertRaises(bugspad.DeadlineExceeded, asyncio.run, run())
+
+
+    def test_get_latest_created_bugs_returns_latest_bugs_list(self):
+        response = self.call('get_latest_created_bugs')
+
+        self.assertIs(type(response), list)
+        self.assertIn(len(response), range(1, 11))
+        for bug in response:
+            self.assertEqual(sorted(bug), ['id', 'status', 'summary'])
+        self.assertEqual([bug['id'] for bug in response],
+                         list(range(response[0]['id'],
+                                    response[-1]['id'] - 1, -1)))
+
+    def test_get_latest_updated_bugs_returns_latest_bugs_list(self):
+        self.call('update_bug', bug_id=3, status="assigned")
+        response = self.call('get_latest_updated_bugs')
+
+        self.assertIs(type(response), list)
+        self.assertEqual(response[0]['id'], 3)
+        for bug in response:
+            self.assertEqual(sorted(bug), ['id', 'status', 'summary'])
+
+    def test_get_components_list_wrong_product_id_returns_empty_dict(self):
+        self.assertEqual(self.call('get_components_list', 0), {})
+
+    def test_add_component_returns_component_info_dict(self):
+        response = self.call('add_component', 'new_component',
+                             'This is an awesome new useless component', 1)
+        self.assertEqual(response['name'], 'new_component')
+        self.assertIn('new_component', self.call('get_components_list', 1))
+
+    def test_add_release_returns_SUCCESS(self):
+        self.assertEqual(self.call('add_release', 'BP-2'), self.SUCCESS)
+        self.assertEqual(self.call('get_releases'), ['BP-2'])
+
+    def test_add_product_returns_product_info_dict(self):
+        response = self.call('add_product', "New product",
+                             "This is going to blow your mind!")
+        self.assertEqual(sorted(response), ['description', 'id', 'name'])
+        self.assertEqual(response['name'], "New product")
+
+
+class ReferenceCacheTest(unittest.TestCase):
+
+    """
+    TestCase for the reference data cache.
+
+    """
+
+    def setUp(self):
+        self.now = 0
+        self.cache = ReferenceCache(ttl=10, maxsize=2, max_bytes=10,
+                                    clock=lambda: self.now)
+        self.bug = Bug(URL, "kushaldas@gmail.com", "asdf",
+                       cache=ReferenceCache())
+        self.other_bug = Bug(URL, "kushaldas@gmail.com", "asdf")
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set('a', 'x')
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', 'x')
+        self.cache.set('b', 'x')
+        self.cache.get('a')
+        self.cache.set('c', 'x')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'x')
+
+    def test_max_bytes_bounds_cached_text(self):
+        self.cache.set('a', 'x' * 6)
+        self.cache.set('b', 'x' * 6)
+        self.cache.set('c', 'x' * 11)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 6)
+
+    def test_texts_fetched_before_an_invalidation_are_not_stored(self):
+        generation = self.cache.generation('a/1')
+        self.cache.discard_prefix('a/')
+        self.cache.set('a/1', 'x', generation)
+        self.assertIsNone(self.cache.get('a/1'))
+
+        self.cache.set('a/1', 'y', self.cache.generation('a/1'))
+        self.assertEqual(self.cache.get('a/1'), 'y')
+
+    def test_get_releases_is_cached(self):
+        releases = self.bug.get_releases()
+        self.other_bug.add_release('cached')
+        self.assertEqual(self.bug.get_releases(), releases)
+
+    def test_add_release_invalidates_releases(self):
+        self.bug.get_releases()
+        self.bug.add_release('invalidated')
+        self.assertIn('invalidated', self.bug.get_releases())
+
+    def test_add_component_invalidates_components_list(self):
+        self.bug.get_components_list(1)
+        self.bug.add_component('invalidated', 'Some description', 1)
+        self.assertIn('invalidated', self.bug.get_components_list(1))
+
+
+class ChangeFeedTest(unittest.TestCase):
+
+    """
+    TestCase for ChangeFeed, against a fresh stand-in server.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        self.feed = ChangeFeed(self.bug)
+        self.feed.poll()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_yields_new_bugs_once(self):
+        new_bug = self.bug.new_bug("This is a summary", "I had a bug", 1)
+        events = self.feed.poll()
+        self.assertEqual([(event.kind, event.bug['id']) for event in events],
+                         [('created', new_bug.bug_id)])
+        self.assertEqual(self.feed.poll(), [])
+
+    def test_yields_status_changes(self):
+        Bug(self.server.url, "kushaldas@gmail.com", "asdf", 3).update_bug(
+            status="closed")
+        events = self.feed.poll()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].kind, 'updated')
+        self.assertEqual(events[0].bug['status'], 'closed')
+
+    def test_created_window_overflow_reports_missed_ids(self):
+        for _ in range(15):
+            self.bug.new_bug("This is a summary", "I had a bug", 1)
+        gaps = [event for event in self.feed.poll() if event.kind == 'gap']
+        self.assertEqual(gaps[0].missed, [11, 12, 13, 14, 15])
+
+    def test_bugs_filed_after_an_empty_first_poll_are_new(self):
+        with StandInServer(initial_bugs=0) as empty_server:
+            bug = Bug(empty_server.url, "kushaldas@gmail.com", "asdf")
+            feed = ChangeFeed(bug)
+            self.assertEqual(feed.poll(), [])
+            new_bug = bug.new_bug("This is a summary", "I had a bug", 1)
+            self.assertEqual([(event.kind, event.bug['id'])
+                              for event in feed.poll()],
+                             [('created', new_bug.bug_id)])
+
+    def test_interval_adapts_to_change_rate(self):
+        quiet_interval = self.feed.interval
+        self.feed.poll()
+        self.assertGreater(self.feed.interval, quiet_interval)
+        self.bug.new_bug("This is a summary", "I had a bug", 1)
+        self.feed.poll()
+        self.assertLess(self.feed.interval, quiet_interval * 1.5)
+
+
+class JsonBackendTest(unittest.TestCase):
+
+    """
+    TestCase for the pluggable JSON backend.
+
+    """
+
+    def tearDown(self):
+        bugspad.set_json_backend()
+
+    def test_loads_nested_decodes_list_of_json_strings(self):
+        body = json.dumps([json.dumps({'id' : 2, 'status' : 'new'}),
+                           json.dumps({'id' : 1, 'status' : 'closed'})])
+        self.assertEqual(bugspad.loads_nested(body),
+                         [{'id' : 2, 'status' : 'new'},
+                          {'id' : 1, 'status' : 'closed'}])
+
+    def test_loads_nested_empty_list(self):
+        self.assertEqual(bugspad.loads_nested(b"[]\n"), [])
+
+    def test_stdlib_backend_is_used_by_Bug(self):
+        bugspad.set_json_backend(json.loads, json.dumps)
+        bug = Bug(URL, "kushaldas@gmail.com", "asdf")
+        self.assertIs(type(bug.get_latest_created_bugs()), list)
+        self.assertIs(type(bug.get_components_list(1)), dict)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    """
+    TestCase for coalescing of concurrent identical GET requests.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer(latency=0.1).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_concurrent_threads_share_one_request(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  single_flight=SingleFlight())
+        results = []
+        threads = [threading.Thread(
+                       target=lambda: results.append(bug.get_releases()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [[]] * 5)
+        self.assertEqual(self.server.hits['/releases/'], 1)
+
+    def test_concurrent_coroutines_share_one_request(self):
+        async def gather():
+            async with AsyncBug(self.server.url, "kushaldas@gmail.com",
+                                "asdf") as bug:
+                return await asyncio.gather(
+                    *[bug.get_components_list(1) for _ in range(5)])
+
+        results = asyncio.run(gather())
+        self.assertEqual(len(results), 5)
+        self.assertIsNot(results[0], results[1])
+        self.assertEqual(self.server.hits['/components/1/'], 1)
+
+    def test_lookups_after_a_write_do_not_join_earlier_ones(self):
+        # The first GET /releases/ is answered before add_release, but
+        # only returned once the lookup after it is done.
+        app = BugspadApp()
+        answered, returned = threading.Event(), threading.Event()
+
+        def handle(method, path, headers, body):
+            response = app(method, path, headers, body)
+            if path == '/releases/' and not answered.is_set():
+                answered.set()
+                returned.wait(1)
+            return response
+
+        bug = Bug("http://localhost", "kushaldas@gmail.com", "asdf",
+                  session=bugspad.InProcessTransport(handle),
+                  cache=ReferenceCache(), single_flight=SingleFlight())
+        stale = []
+        thread = threading.Thread(
+            target=lambda: stale.append(bug.get_releases()))
+        thread.start()
+        answered.wait(1)
+        bug.add_release('invalidated')
+        self.assertIn('invalidated', bug.get_releases())
+        returned.set()
+        thread.join()
+
+        self.assertNotIn('invalidated', stale[0])
+        self.assertIn('invalidated', bug.get_releases())
+
+    def test_clients_of_different_servers_are_not_coalesced(self):
+        # Both transports use the same placeholder url
+        def slow(app):
+            def handle(*request):
+                time.sleep(0.1)
+                return app(*request)
+            return bugspad.InProcessTransport(handle)
+
+        single_flight = SingleFlight()
+        bugs = [Bug("http://localhost", "kushaldas@gmail.com", "asdf",
+                    session=slow(BugspadApp()), single_flight=single_flight)
+                for _ in range(2)]
+        bugs[0].add_release("Only on the first server")
+
+        results = [None, None]
+
+        def get(index):
+            results[index] = bugs[index].get_releases()
+
+        threads = [threading.Thread(target=get, args=(index,))
+                   for index in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [["Only on the first server"], []])
+
+    def in_flight(self, bug, **kwargs):
+        # Starts a get_releases in another thread, returning its thread
+        # and the list its outcome is appended to
+        outcome = []
+
+        def get():
+            try:
+                outcome.append(bug.get_releases(**kwargs))
+            except Exception as error:
+                outcome.append(error)
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        time.sleep(0.05)   # In flight by now
+        return thread, outcome
+
+    def test_waiters_keep_their_own_time_limits(self):
+        self.server.latency = 0.5
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  single_flight=SingleFlight())
+        thread, outcome = self.in_flight(bug)
+        start = time.monotonic()
+        self.assertRaises(bugspad.DeadlineExceeded, bug.get_releases,
+                          deadline=time.monotonic() + 0.1)
+        self.assertRaises(requests.Timeout, bug.get_releases, timeout=0.1)
+        self.assertLess(time.monotonic() - start, 0.4)
+        thread.join()
+        self.assertEqual(outcome, [[]])
+        self.assertEqual(self.server.hits['/releases/'], 1)
+
+    def test_first_caller_timeout_is_not_shared(self):
+        self.server.latency = 0.3
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  single_flight=SingleFlight())
+        thread, outcome = self.in_flight(bug, timeout=0.1)
+        self.assertEqual(bug.get_releases(), [])
+        thread.join()
+        self.assertIsInstance(outcome[0], requests.Timeout)
+        self.assertEqual(self.server.hits['/releases/'], 2)
+
+    def test_cancelled_first_coroutine_does_not_cancel_the_others(self):
+        self.server.latency = 0.3
+
+        async def gather():
+            async with AsyncBug(self.server.url, "kushaldas@gmail.com",
+                                "asdf",
+                                single_flight=bugspad.AsyncSingleFlight()
+                                ) as bug:
+                first = asyncio.ensure_future(
+                    asyncio.wait_for(bug.get_releases(), 0.1))
+                await asyncio.sleep(0.05)   # In flight by now
+                return await asyncio.gather(first, bug.get_releases(),
+                                            return_exceptions=True)
+
+        results = asyncio.run(gather())
+        self.assertIsInstance(results[0], asyncio.TimeoutError)
+        self.assertEqual(results[1], [])
+
+    def test_without_single_flight_every_call_is_sent(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  single_flight=None)
+        bug.get_releases()
+        bug.get_releases()
+        self.assertEqual(self.server.hits['/releases/'], 2)
+
+
+class MetricsTest(unittest.TestCase):
+
+    """
+    TestCase for the metrics hooks.
+
+    """
+
+    def setUp(self):
+        self.metrics = bugspad.Metrics()
+        bugspad.add_metrics_hook(self.metrics)
+        self.bug = Bug(URL, "kushaldas@gmail.com", "asdf", 1,
+                       single_flight=None)
+
+    def tearDown(self):
+        bugspad.remove_metrics_hook(self.metrics)
+
+    def test_snapshot_counts_calls_and_bytes_per_endpoint(self):
+        self.bug.add_comment("this is a comment")
+        self.bug.add_comment("this is a comment")
+        self.bug.get_components_list(1)
+
+        snapshot = self.metrics.snapshot()
+        comments = snapshot['/comment/']
+        self.assertEqual(comments['calls'], 2)
+        self.assertEqual(comments['errors'], 0)
+        self.assertGreater(comments['request_bytes'], 0)
+        self.assertGreater(comments['response_bytes'], 0)
+        self.assertEqual(sum(count for bound, count
+                             in comments['latency_histogram']), 2)
+        self.assertEqual(snapshot['/components/<id>/']['calls'], 1)
+
+    def test_error_responses_are_counted(self):
+        with StandInServer(error_rate=1.0) as faulty_server:
+            bug = Bug(faulty_server.url, "kushaldas@gmail.com", "asdf", 1)
+            bug.update_bug(status="new")
+        self.assertEqual(self.metrics.snapshot()['/updatebug/']['errors'], 1)
+
+    def test_removed_hook_is_not_called(self):
+        bugspad.remove_metrics_hook(self.metrics)
+        self.bug.add_comment("this is a comment")
+        self.assertNotIn('/comment/', self.metrics.snapshot())
+
+
+class HedgingTest(unittest.TestCase):
+
+    """
+    TestCase for hedged reads. The seeded stand-in stalls the first
+    request for 2 seconds but not the second one, so clients don't log
+    in first.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer(stall_rate=0.5, stall=2, seed=1).start()
+        self.hedging = bugspad.Hedging(initial_delay=0.05)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_stalled_read_is_answered_by_hedge(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  hedging=self.hedging, authenticate=False)
+        start = time.time()
+        self.assertEqual(bug.get_releases(), [])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.hedging.hedge_wins, 1)
+        self.assertEqual(self.server.hits['/releases/'], 2)
+
+    def test_stalled_async_read_is_answered_by_hedge(self):
+        async def get_releases():
+            async with AsyncBug(self.server.url, "kushaldas@gmail.com",
+                                "asdf", hedging=self.hedging) as bug:
+                return await bug.get_releases()
+
+        start = time.time()
+        self.assertEqual(asyncio.run(get_releases()), [])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.hedging.hedge_wins, 1)
+
+    def test_no_hedge_beyond_budget(self):
+        hedging = bugspad.Hedging(initial_delay=0.05, max_ratio=0, burst=0)
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  hedging=hedging, authenticate=False)
+        bug.get_releases()
+        self.assertEqual(self.server.hits['/releases/'], 1)
+        self.assertEqual(hedging.hedged, 0)
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    """
+    TestCase for write-behind merging of update_bug calls.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_updates_within_window_are_merged(self):
+        with bugspad.WriteBehind(window=0.2) as write_behind:
+            bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                      write_behind=write_behind)
+            futures = [bug.update_bug(status="assigned"),
+                       bug.update_bug(priority="high"),
+                       bug.update_bug(status="closed")]
+            bug.flush()
+
+        self.assertEqual([future.result() for future in futures],
+                         ["\"Success\"\n"] * 3)
+        self.assertEqual(self.server.hits['/updatebug/'], 1)
+        stored = self.server.state.bugs[1]
+        self.assertEqual((stored['status'], stored['priority']),
+                         ("closed", "high"))
+
+    def test_errors_are_reported_to_every_caller(self):
+        closed_server = StandInServer()
+        closed_server.server_close()
+        with bugspad.WriteBehind() as write_behind:
+            bug = Bug(closed_server.url, "kushaldas@gmail.com", "asdf", 1,
+                      write_behind=write_behind)
+            futures = [bug.update_bug(status="assigned"),
+                       bug.update_bug(priority="high")]
+        for future in futures:
+            self.assertIsInstance(future.exception(), Exception)
+
+    def test_wrong_kwargs_are_reported_immediately(self):
+        with bugspad.WriteBehind() as write_behind:
+            bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                      write_behind=write_behind)
+            self.assertEqual(bug.update_bug(wrong_kwarg="dummy"),
+                             "Wrong kwargs")
+
+    def test_time_limits_are_refused(self):
+        with bugspad.WriteBehind() as write_behind:
+            bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                      write_behind=write_behind)
+            self.assertRaises(ValueError, bug.update_bug, status="assigned",
+                              deadline=time.monotonic() + 1)
+
+
+class BugSetTest(unittest.TestCase):
+
+    """
+    TestCase for BugSet fan-out operations.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_add_comment_returns_result_per_bug(self):
+        bugs = bugspad.BugSet(self.bug, range(1, 11), max_workers=4)
+        results = list(bugs.add_comment("this is a comment"))
+
+        self.assertEqual(sorted(result.bug_id for result in results),
+                         list(range(1, 11)))
+        for result in results:
+            self.assertIsNone(result.error)
+            int(result.response)
+        self.assertEqual(self.server.hits['/comment/'], 10)
+
+    def test_update_bug_updates_every_bug(self):
+        bugs = bugspad.BugSet(self.bug, [2, 4])
+        for result in bugs.update_bug(status="closed"):
+            self.assertEqual(result.response, "\"Success\"\n")
+        self.assertEqual(self.server.state.bugs[4]['status'], "closed")
+
+    def test_failures_do_not_stop_the_batch(self):
+        closed_server = StandInServer()
+        closed_server.server_close()
+        bug = Bug(closed_server.url, "kushaldas@gmail.com", "asdf")
+        results = list(bugspad.BugSet(bug, [1, 2, 3]).add_bug_cc("a@b.c"))
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result.error, Exception)
+
+
+class ReplicaTest(unittest.TestCase):
+
+    """
+    TestCase for the local SQLite replica.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.replica = bugspad.Replica()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                       replica=self.replica)
+
+    def tearDown(self):
+        self.replica.close()
+        self.server.stop()
+
+    def test_own_writes_are_mirrored(self):
+        new_bug = self.bug.new_bug("Replicated", "Some description", 1,
+                                   priority="high")
+        new_bug.update_bug(status="assigned")
+        stored = self.replica.bug(new_bug.bug_id)
+        self.assertEqual((stored['summary'], stored['priority'],
+                          stored['status'], stored['component_id']),
+                         ("Replicated", "high", "assigned", 1))
+
+    def test_update_without_mirrored_fields(self):
+        bug = self.bug.derive(2)
+        self.assertEqual(bug.update_bug(emails="kushaldas@gmail.com").strip(),
+                         '"Success"')
+        self.assertEqual(bug.update_bug().strip(), '"Success"')
+        self.assertEqual(self.replica.bug(2)['id'], 2)
+
+    def test_latest_bugs_are_mirrored(self):
+        self.bug.get_latest_created_bugs()
+        self.assertEqual(self.replica.count(status="new"), 10)
+        self.assertEqual(self.replica.bug(3)['summary'], "Stand-in bug 3")
+
+    def test_query_filters(self):
+        self.bug.get_latest_created_bugs()
+        self.bug.derive(2).update_bug(priority="high")
+        self.bug.derive(5).update_bug(priority="high", status="closed")
+
+        bugs = self.replica.bugs(status=("new", "assigned"),
+                                 priority="high")
+        self.assertEqual([bug['id'] for bug in bugs], [2])
+        self.assertEqual(len(self.replica.bugs(priority=None)), 8)
+        self.assertRaises(ValueError, self.replica.bugs, wrong_field=1)
+
+    def test_reference_data_is_mirrored(self):
+        self.bug.add_release("replicated")
+        self.bug.add_component("replicated", "Some description", 1)
+        self.assertIn("replicated", self.replica.releases())
+        self.assertIn("replicated", self.replica.components(1))
+
+        components = self.bug.get_components_list(1)
+        releases = self.bug.get_releases()
+        self.assertEqual(self.replica.components(1), components)
+        self.assertEqual(self.replica.releases(), releases)
+
+
+class CompressionTest(unittest.TestCase):
+
+    """
+    TestCase for compressed requests and responses.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer(compress_min_size=100).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_large_request_bodies_are_compressed(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                  compress_min_size=100)
+        description = "log line\n" * 1000
+        new_bug = bug.new_bug("Compressed", description, 1)
+
+        self.assertIsInstance(new_bug, Bug)
+        self.assertEqual(self.server.state.bugs[new_bug.bug_id]
+                         ['description'], description)
+        self.assertLess(self.server.traffic['received'], 1000)
+
+    def test_small_request_bodies_are_not_compressed(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                  compress_min_size=1000)
+        self.assertEqual(bug.update_bug(status="new"), "\"Success\"\n")
+
+    def test_large_responses_are_decompressed(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        for number in range(20):
+            bug.add_component("component %d" % number,
+                              "Some description", 1)
+        sent = self.server.traffic['sent']
+
+        components = bug.get_components_list(1)
+        self.assertEqual(len(components), 21)
+        self.assertLess(self.server.traffic['sent'] - sent,
+                        len(json.dumps(components)) / 2)
+
+    def test_unsupported_encoding_is_rejected(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        request = bug.session.post(self.server.url + "/releases/",
+                                   data=b"{}",
+                                   headers={'Content-Encoding' : 'br'})
+        self.assertEqual(request.status_code, 400)
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+
+    """
+    TestCase for the AIMD concurrency limiter.
+
+    """
+
+    def setUp(self):
+        self.now = 0.0
+        self.limit = bugspad.AdaptiveLimit(initial_limit=4, max_limit=8,
+                                           max_latency=1.0, max_wait=0.01,
+                                           clock=lambda: self.now)
+
+    def test_healthy_responses_raise_the_limit_additively(self):
+        for _ in range(4):
+            self.limit.release(self.limit.acquire())
+        self.assertAlmostEqual(self.limit.limit, 5, delta=0.2)
+
+    def test_failures_cut_the_limit_once_per_round(self):
+        tokens = [self.limit.acquire() for _ in range(4)]
+        self.now = 0.5
+        for token in tokens:
+            self.limit.release(token, ok=False)
+        self.assertEqual(self.limit.limit, 2)
+        self.assertEqual(self.limit.snapshot()['drops'], 4)
+
+        self.limit.release(self.limit.acquire(), ok=False)
+        self.assertEqual(self.limit.limit, 1)
+
+    def test_latency_spikes_cut_the_limit(self):
+        token = self.limit.acquire()
+        self.now = 2.0
+        self.limit.release(token)
+        self.assertEqual(self.limit.limit, 2)
+
+    def test_requests_beyond_the_limit_wait_or_are_rejected(self):
+        for _ in range(4):
+            self.limit.acquire()
+        self.assertRaises(bugspad.LimitExceeded, self.limit.acquire)
+        snapshot = self.limit.snapshot()
+        self.assertEqual((snapshot['waited'], snapshot['rejected']), (1, 1))
+
+    def test_async_requests_beyond_the_limit_wait(self):
+        limit = bugspad.AsyncAdaptiveLimit(initial_limit=1)
+        order = []
+
+        async def request(name):
+            token = await limit.acquire()
+            order.append(name)
+            await asyncio.sleep(0.01)
+            limit.release(token)
+
+        async def main():
+            await asyncio.gather(request(1), request(2))
+
+        asyncio.run(main())
+        self.assertEqual(order, [1, 2])
+        self.assertEqual(limit.snapshot()['waited'], 1)
+        self.assertEqual(limit.in_flight, 0)
+
+    def test_server_errors_throttle_bulk_operations(self):
+        with StandInServer(error_rate=1.0) as faulty_server:
+            limit = bugspad.AdaptiveLimit(initial_limit=8, max_limit=8)
+            bug = Bug(faulty_server.url, "kushaldas@gmail.com", "asdf",
+                      limiter=limit, authenticate=False)
+            list(bugspad.BugSet(bug, range(1, 11)).add_comment("comment"))
+        self.assertLess(limit.limit, 8)
+        self.assertEqual(limit.drops, 10)
+
+
+class SnapshotCacheTest(unittest.TestCase):
+
+    """
+    TestCase for the on-disk reference data snapshot.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'snapshot')
+        self.now = 1000.0
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def new_bug(self):
+        cache = bugspad.SnapshotCache(self.path, max_age=60,
+                                      wall_clock=lambda: self.now)
+        return Bug(self.server.url, "kushaldas@gmail.com", "asdf",
+                   cache=cache, single_flight=None)
+
+    def test_new_process_starts_warm(self):
+        releases = self.new_bug().get_releases()
+        self.assertEqual(self.new_bug().get_releases(), releases)
+        self.assertEqual(self.server.hits['/releases/'], 1)
+
+    def test_stale_entries_are_refreshed_in_background(self):
+        bug = self.new_bug()
+        bug.get_releases()
+        bug.add_release("other process")   # Not seen through the cache
+        bug.cache.set(bug._urls['/releases/'], b'["stale"]\n')
+
+        self.now += 120
+        bug = self.new_bug()
+        self.assertEqual(bug.get_releases(), ["stale"])
+        for _ in range(100):
+            if "other process" in self.new_bug().get_releases():
+                break
+            time.sleep(0.01)
+        self.assertIn("other process", self.new_bug().get_releases())
+
+    def test_invalidations_are_written_through(self):
+        bug = self.new_bug()
+        bug.get_components_list(1)
+        bug.add_component("written through", "Some description", 1)
+        self.assertIn("written through",
+                      self.new_bug().get_components_list(1))
+
+    def test_unknown_formats_are_ignored(self):
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write(b"BSPS\xff\xff garbage")
+        self.assertIsInstance(self.new_bug().get_releases(), list)
+        self.assertEqual(self.server.hits['/releases/'], 1)
+
+
+class AuthenticationTest(unittest.TestCase):
+
+    """
+    TestCase for authenticating once per client.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_wrong_credentials_fail_at_creation(self):
+        self.assertRaises(bugspad.AuthenticationError, Bug,
+                          self.server.url, "wrongusr", "asdf")
+
+    def test_derived_instances_share_the_session_token(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        self.assertIn(bug.authentication.token, self.server.state.tokens)
+
+        new_bug = bug.new_bug("Token", "Some description", 1)
+        self.assertEqual(new_bug.update_bug(status="assigned"),
+                         "\"Success\"\n")
+        self.assertIs(new_bug.authentication, bug.authentication)
+        self.assertEqual(self.server.hits['/login/'], 1)
+
+    def test_expired_token_is_renewed(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1)
+        self.server.state.tokens.clear()
+        self.assertEqual(bug.update_bug(status="assigned"), "\"Success\"\n")
+        self.assertEqual(self.server.hits['/login/'], 2)
+
+    def test_revoked_user_raises(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1)
+        self.server.state.tokens.clear()
+        self.server.state.users.clear()
+        self.assertRaises(bugspad.AuthenticationError, bug.add_comment,
+                          "this is a comment")
+
+    def test_credentials_are_checked_by_writes_without_session_tokens(self):
+        self.server.app.POST_ROUTES = dict(self.server.app.POST_ROUTES)
+        del self.server.app.POST_ROUTES['/login/']
+
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1)
+        self.assertIsNone(bug.authentication.token)
+        self.assertEqual(bug.update_bug(status="new"), "\"Success\"\n")
+        self.assertEqual(self.server.hits['/bug/cc'], 0)   # No probing
+
+        wrong = Bug(self.server.url, "wrongusr", "asdf", 1)
+        self.assertRaises(bugspad.AuthenticationError, wrong.update_bug,
+                          status="new")
+
+    def test_login_is_seen_by_metrics_hooks(self):
+        metrics = bugspad.Metrics()
+        bugspad.add_metrics_hook(metrics)
+        try:
+            Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        finally:
+            bugspad.remove_metrics_hook(metrics)
+        self.assertEqual(metrics.snapshot()['/login/']['calls'], 1)
+
+
+class TransportTest(unittest.TestCase):
+
+    """
+    TestCase for the Unix domain socket and in-process transports.
+
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'bugspad.sock')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def exercise(self, bug):
+        new_bug = bug.new_bug("Transport", "Some description", 1)
+        self.assertIsInstance(new_bug, Bug)
+        self.assertEqual(new_bug.update_bug(status="assigned"),
+                         "\"Success\"\n")
+        self.assertIn('default', bug.get_components_list(1))
+        self.assertEqual(bug.get_latest_updated_bugs()[0]['id'],
+                         new_bug.bug_id)
+
+    def test_unix_socket_transport(self):
+        with UnixStandInServer(self.path) as server:
+            transport = bugspad.UnixSocketTransport(server.path)
+            self.exercise(Bug(server.url, "kushaldas@gmail.com", "asdf",
+                              session=transport))
+            transport.close()
+        self.assertEqual(server.hits['/login/'], 1)
+
+    def test_unix_socket_transport_reconnects(self):
+        with UnixStandInServer(self.path) as server:
+            transport = bugspad.UnixSocketTransport(server.path)
+            bug = Bug(server.url, "kushaldas@gmail.com", "asdf",
+                      session=transport)
+            for connection in transport._idle:
+                connection.sock.close()   # As if closed by the server
+            self.assertEqual(bug.get_releases(), [])
+
+    def test_unreachable_socket_raises_connection_error(self):
+        transport = bugspad.UnixSocketTransport(self.path)
+        bug = Bug("http://localhost", "kushaldas@gmail.com", "asdf",
+                  session=transport)
+        self.assertRaises(requests.ConnectionError, bug.get_releases)
+
+    def test_in_process_transport(self):
+        app = BugspadApp()
+        self.exercise(Bug("http://localhost", "kushaldas@gmail.com", "asdf",
+                          session=bugspad.InProcessTransport(app)))
+        self.assertEqual(len(app.state.bugs), 11)
+
+
+class SetBugCcTest(unittest.TestCase):
+
+    """
+    TestCase for delta-aware cc management.
+
+    """
+
+    USERS = {'a@example.com' : 'a',
+             'b@example.com' : 'b',
+             'c@example.com' : 'c',
+             'kushaldas@gmail.com' : 'asdf'}
+
+    def setUp(self):
+        self.server = StandInServer(users=self.USERS).start()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                       registered=self.USERS)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_only_the_delta_is_sent(self):
+        self.bug.set_bug_cc('a@example.com', 'b@example.com')
+        self.assertIsNone(self.bug.set_bug_cc(['b@example.com',
+                                               'a@example.com']))
+        self.assertEqual(self.server.hits['/bug/cc'], 1)
+
+        self.bug.set_bug_cc('b@example.com', 'c@example.com')
+        self.assertEqual(self.server.hits['/bug/cc'], 3)
+        self.assertEqual(sorted(self.server.state.bugs[1]['emails']),
+                         ['b@example.com', 'c@example.com'])
+
+    def test_unregistered_emails_are_not_sent(self):
+        self.bug.set_bug_cc('a@example.com', 'nobody@example.com')
+        self.assertIsNone(self.bug.set_bug_cc('a@example.com',
+                                              'nobody@example.com'))
+        self.assertEqual(self.server.hits['/bug/cc'], 1)
+        self.assertEqual(self.server.state.bugs[1]['emails'],
+                         ['a@example.com'])
+
+    def test_registered_users_are_required(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1)
+        self.assertRaises(ValueError, bug.set_bug_cc, 'a@example.com')
+        self.assertEqual(self.server.hits['/bug/cc'], 0)
+
+    def test_cc_of_new_bugs_is_known(self):
+        new_bug = self.bug.new_bug("Cc", "Some description", 1,
+                                   emails='a@example.com')
+        self.assertIsNone(new_bug.set_bug_cc('a@example.com'))
+        self.assertEqual(self.server.hits['/bug/cc'], 0)
+
+    def test_replica_keeps_cc_across_processes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'replica.db')
+            replica = bugspad.Replica(path)
+            Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                replica=replica,
+                registered=self.USERS).set_bug_cc('a@example.com')
+            replica.close()
+
+            replica = bugspad.Replica(path)
+            bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                      replica=replica, registered=self.USERS)
+            self.assertIsNone(bug.set_bug_cc('a@example.com'))
+            replica.close()
+        self.assertEqual(self.server.hits['/bug/cc'], 1)
+
+    def test_bug_set_applies_a_list_per_bug(self):
+        bugs = bugspad.BugSet(Bug(self.server.url, "kushaldas@gmail.com",
+                                  "asdf", registered=self.USERS), [1, 2, 3])
+        results = list(bugs.set_bug_cc({1 : ['a@example.com'],
+                                        2 : ['b@example.com']}))
+        self.assertEqual(sorted(result.bug_id for result in results), [1, 2])
+        self.assertEqual(self.server.state.bugs[2]['emails'],
+                         ['b@example.com'])
+
+        results = list(bugs.set_bug_cc({1 : ['a@example.com']}))
+        self.assertIsNone(results[0].response)
+        self.assertEqual(self.server.hits['/bug/cc'], 2)
+
+
+class ClientTest(unittest.TestCase):
+
+    """
+    TestCase for Client and the Bug handles it gives out.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.client = bugspad.Client(self.server.url, "kushaldas@gmail.com",
+                                     "asdf")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_handles_hold_only_id_and_client(self):
+        bug = self.client.bug(1)
+        self.assertRaises(AttributeError, setattr, bug, 'extra', 1)
+        self.assertIs(bug.derive(2).client, self.client)
+        self.assertIs(bug.new_bug("Handle", "Some description", 1).client,
+                      self.client)
+        self.assertEqual(bug.url, self.server.url)   # From the client
+
+    def test_threads_share_one_client(self):
+        errors = []
+
+        def update(bug_id):
+            try:
+                for _ in range(10):
+                    response = self.client.bug(bug_id).update_bug(
+                        priority="high")
+                    self.assertEqual(response.strip(), '"Success"')
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=update, args=(bug_id,))
+                   for bug_id in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.hits['/updatebug/'], 80)
+        self.assertEqual(self.server.hits['/login/'], 1)
+
+    def test_bug_builds_its_own_client(self):
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                  authenticate=False)
+        self.assertIsNot(bug.client, self.client)
+        self.assertIsNone(bug.authentication)
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    """
+    TestCase for the bugspad_load load generator.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.client = bugspad.Client(self.server.url, "kushaldas@gmail.com",
+                                     "asdf")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("new_bug=2, add_comment"),
+                         [('new_bug', 2.0), ('add_comment', 1.0)])
+        self.assertRaises(ValueError, parse_mix, "new_bug,delete_bug")
+        self.assertRaises(ValueError, parse_mix, "new_bug=0")
+
+    def test_closed_loop(self):
+        output = io.StringIO()
+        totals = run_load(self.client, parse_mix("update_bug,add_comment"),
+                          0.3, users=2, interval=0.1, output=output)
+        self.assertEqual(sorted(totals), ['add_comment', 'update_bug'])
+        for latencies, errors in totals.values():
+            self.assertTrue(latencies)
+            self.assertEqual(errors, 0)
+        self.assertIn("update_bug", output.getvalue())
+
+    def test_open_loop_keeps_the_rate(self):
+        totals = run_load(self.client, parse_mix("get_latest_created_bugs"),
+                          0.5, rate=40, interval=0.1, output=io.StringIO())
+        latencies, errors = totals['get_latest_created_bugs']
+        self.assertEqual((len(latencies), errors), (20, 0))
+
+    def test_urls_and_replicas_are_exclusive(self):
+        with contextlib.redirect_stderr(io.StringIO()) as error:
+            self.assertRaises(SystemExit, load_main,
+                              ['--url', URL, '--replicas', '2'])
+        self.assertIn("not allowed", error.getvalue())
+
+
+class ResultRecordsTest(unittest.TestCase):
+
+    """
+    TestCase for the compact result forms of Client.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def bug(self, results):
+        return bugspad.Client(self.server.url, "kushaldas@gmail.com", "asdf",
+                              results=results).bug(1)
+
+    def test_records(self):
+        bug = self.bug('records')
+        bugs = bug.get_latest_created_bugs()
+        self.assertEqual(bugs, [bugspad.BugRecord.from_dict(record)
+                                for record in
+                                self.bug('dicts').get_latest_created_bugs()])
+        self.assertEqual(bugs[0]['id'], bugs[0].id)
+        self.assertIs(bugs[0].status, bugs[1].status)   # Interned
+
+        components = bug.get_components_list(1)
+        self.assertEqual(components['default'],
+                         bugspad.ComponentRecord(1, 'default',
+                                                 'Stand-in component'))
+        self.assertEqual(components['default'][0], 1)
+
+    def test_columns(self):
+        bug = self.bug('columns')
+        bugs = bug.get_latest_updated_bugs()
+        self.assertIsInstance(bugs, bugspad.BugColumns)
+        self.assertEqual(list(bugs), self.bug('records').
+                         get_latest_updated_bugs())
+        bugs.extend(bug.get_latest_created_bugs())
+        self.assertEqual(len(bugs), 20)
+        self.assertEqual(bugs[19].id, 1)
+
+        components = bug.get_components_list(1)
+        self.assertEqual(len(components), 1)
+        self.assertEqual(components.get('default').id, 1)
+        self.assertIsNone(components.get('missing'))
+
+    def test_change_feed_takes_records(self):
+        feed = ChangeFeed(self.bug('columns'), include_existing=True)
+        events = feed.poll()
+        self.assertEqual(len([event for event in events
+                              if event.kind == 'created']), 10)
+        self.assertIsInstance(events[0].bug, bugspad.BugRecord)
+
+    def test_replica_takes_records(self):
+        replica = bugspad.Replica()
+        for results in ('records', 'columns'):
+            client = bugspad.Client(self.server.url, "kushaldas@gmail.com",
+                                    "asdf", results=results, replica=replica)
+            client.bug().get_latest_created_bugs()
+        self.assertEqual(replica.bug(10)['status'], 'new')
+        replica.close()
+
+    def test_unknown_form(self):
+        self.assertRaises(ValueError, bugspad.Client, self.server.url,
+                          "kushaldas@gmail.com", "asdf", results='rows')
+
+
+class DeadlineTest(unittest.TestCase):
+
+    """
+    TestCase for request timeouts, call deadlines and bulk budgets.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_timeout_bounds_a_stalled_request(self):
+        self.server.stall_rate = 1.0
+        self.server.stall = 0.5
+        start = time.monotonic()
+        self.assertRaises(requests.Timeout, self.bug.add_comment, "Stalled",
+                          timeout=0.1)
+        self.assertRaises(requests.Timeout, self.bug.update_bug,
+                          timeout=0.1, priority="high")
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_client_timeout(self):
+        self.server.stall_rate = 1.0
+        self.server.stall = 0.5
+        bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf", 1,
+                  authenticate=False, timeout=0.1)
+        self.assertRaises(requests.Timeout, bug.get_releases)
+
+    def test_expired_deadline_sends_nothing(self):
+        self.assertRaises(bugspad.DeadlineExceeded, self.bug.add_comment,
+                          "Late", deadline=time.monotonic() - 1)
+        self.assertEqual(self.server.hits['/comment/'], 0)
+        self.assertEqual(self.bug.update_bug(
+            deadline=time.monotonic() + 5, priority="high").strip(),
+            '"Success"')
+
+    def test_bulk_budget_bounds_the_whole_operation(self):
+        # Calls that cannot be done in what is left are not started
+        self.server.latency = 0.1
+        bugs = bugspad.BugSet(self.bug, range(1, 11), max_workers=2)
+        start = time.monotonic()
+        results = list(bugs.add_comment("Budget", budget=0.45))
+        self.assertLess(time.monotonic() - start, 0.6)
+
+        self.assertEqual(sorted(result.bug_id for result in results),
+                         list(range(1, 11)))
+        done = [result for result in results if result.error is None]
+        self.assertGreaterEqual(len(done), 4)
+        self.assertLess(len(done), 10)
+        for result in results:
+            if result.error is not None:
+                self.assertIsInstance(result.error,
+                                      (bugspad.DeadlineExceeded,
+                                       bugspad.OutcomeUnknown))
+
+    def test_bulk_budget_reports_calls_in_flight_as_unknown(self):
+        # Stalled calls may still be applied, the rest get done
+        self.server.random.seed(3)
+        self.server.stall_rate = 0.2
+        self.server.stall = 1.0
+        bugs = bugspad.BugSet(self.bug, range(1, 21), max_workers=4)
+        start = time.monotonic()
+        results = list(bugs.add_comment("Budget", budget=0.8))
+        self.assertLess(time.monotonic() - start, 0.9)
+
+        failed = [result for result in results if result.error is not None]
+        self.assertTrue(failed)
+        self.assertLess(len(failed), 10)
+        unknown = [result for result in failed
+                   if isinstance(result.error, bugspad.OutcomeUnknown)]
+        self.assertTrue(unknown)
+        for result in failed:
+            if result not in unknown:
+                self.assertIsInstance(result.error, bugspad.DeadlineExceeded)
+
+
+class ServerPoolTest(unittest.TestCase):
+
+    """
+    TestCase for clients of several replica servers.
+
+    """
+
+    def setUp(self):
+        self.servers = [StandInServer().start() for _ in range(3)]
+        self.urls = [server.url for server in self.servers]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def client(self, **options):
+        return bugspad.Client(self.urls, "kushaldas@gmail.com", "asdf",
+                              single_flight=None, **options)
+
+    def test_reads_are_spread_and_writes_pinned(self):
+        client = self.client(primary=self.urls[1])
+        self.assertEqual(client.url, self.urls[1])
+
+        def read():
+            for _ in range(20):
+                client.bug().get_releases()
+
+        threads = [threading.Thread(target=read) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for server in self.servers:
+            self.assertGreater(server.hits['/releases/'], 0)
+
+        client.bug(1).add_comment("Pinned")
+        self.assertEqual([server.hits['/comment/']
+                          for server in self.servers], [0, 1, 0])
+
+    def test_reads_prefer_the_fastest(self):
+        self.servers[0].latency = self.servers[1].latency = 0.02
+        client = self.client(server_options={'rng' : Random(5)})
+        for _ in range(30):
+            client.bug().get_latest_created_bugs()
+        hits = [server.hits['/latestcreated/'] for server in self.servers]
+        self.assertGreater(hits[2], sum(hits[:2]))
+
+    def test_failover(self):
+        self.servers[1].error_rate = 1.0
+        self.servers[2].stall_rate = 1.0
+        self.servers[2].stall = 0.5
+        client = self.client(timeout=0.1)
+        for _ in range(10):
+            self.assertIsInstance(client.bug().get_releases(), list)
+        health = client.servers.snapshot()
+        self.assertEqual([health[url]['healthy'] for url in self.urls],
+                         [True, False, False])
+
+    def test_writes_stay_on_an_unreachable_primary(self):
+        client = self.client(authenticate=False)
+        self.servers[0].stop()
+        self.assertRaises(requests.ConnectionError,
+                          client.bug(1).add_comment, "Not moved")
+        self.assertEqual([server.hits['/comment/']
+                          for server in self.servers[1:]], [0, 0])
+
+    def test_writes_fail_over_from_an_unreachable_primary(self):
+        client = self.client(authenticate=False,
+                             server_options={'write_failover' : True})
+        self.servers[0].stop()
+        self.assertEqual(client.bug(1).add_comment("Moved").strip(), "1")
+        self.assertEqual(self.servers[1].hits['/comment/'], 1)
+        self.assertFalse(client.servers.snapshot()[self.urls[0]]['healthy'])
+
+
+class StandInServerTest(unittest.TestCase):
+
+    """
+    TestCase for the stand-in server fault injection.
+
+    """
+
+    def test_error_rate_one_fails_every_request(self):
+        with StandInServer(error_rate=1.0) as faulty_server:
+            bug = Bug(faulty_server.url, "kushaldas@gmail.com", "asdf", 1)
+            response = bug.update_bug(status="new")
+        self.assertEqual(response, "\"Injected error\"\n")
+
+    def test_latency_delays_responses(self):
+        with StandInServer(latency=0.05) as slow_server:
+            bug = Bug(slow_server.url, "kushaldas@gmail.com", "asdf")
+            start = time.time()
+            bug.get_releases()
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+
+class ImportTest(unittest.TestCase):
+
+    """
+    TestCase for the bulk importer record parsing.
+
+    """
+
+    def test_record_to_kwargs_drops_unknown_and_empty_fields(self):
+        kwargs = record_to_kwargs({'summary' : 's',
+                                   'description' : 'd',
+                                   'component_id' : '3',
+                                   'priority' : '',
+                                   'unknown' : 'dummy'})
+        self.assertEqual(kwargs, {'summary' : 's',
+                                  'description' : 'd',
+                                  'component_id' : 3})
+
+    def test_record_to_kwargs_splits_emails_string(self):
+        kwargs = record_to_kwargs({'summary' : 's',
+                                   'description' : 'd',
+                                   'component_id' : 3,
+                                   'emails' : 'a@b.c, d@e.f'})
+        self.assertEqual(kwargs['emails'], ['a@b.c', 'd@e.f'])
+
+    def test_record_to_kwargs_missing_field_raises_ValueError(self):
+        self.assertRaises(ValueError,
+                          record_to_kwargs,
+                          {'summary' : 's', 'component_id' : 3})
+
+
+class ImportBugsTest(unittest.TestCase):
+
+    """
+    TestCase for the bulk importer runs, checkpoints and resumes.
+
+    """
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.bug = Bug(self.server.url, "kushaldas@gmail.com", "asdf")
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'mapping.tsv')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.server.stop()
+
+    def records(self, count):
+        return [(number, {'summary' : 'Imported %d' % number,
+                          'description' : 'Bulk import',
+                          'component_id' : 1})
+                for number in range(1, count + 1)]
+
+    def mapping(self):
+        with open(self.output) as output_file:
+            return [line.rstrip('\n').split('\t') for line in output_file]
+
+    def test_budget_lets_sent_records_finish(self):
+        self.server.latency = 0.2
+        initial = len(self.server.state.bugs)
+        filed = import_bugs(self.bug, self.records(20), self.output,
+                            workers=2, budget=0.1).filed
+        self.assertTrue(0 < filed < 20)
+        mapping = self.mapping()
+        self.assertEqual(len(mapping), filed)
+        self.assertTrue(all(bug_id.isdigit() for _, bug_id in mapping))
+
+        # Resuming files the rest, and none twice
+        self.server.latency = 0.0
+        self.assertEqual(import_bugs(self.bug, self.records(20),
+                                     self.output, workers=2),
+                         (20 - filed, 0, 0))
+        self.assertEqual(sorted(int(number) for number, _ in self.mapping()),
+                         list(range(1, 21)))
+        self.assertEqual(len(self.server.state.bugs), initial + 20)
+
+    def test_checkpoint_resumes_after_finished_records(self):
+        self.assertEqual(import_bugs(self.bug, self.records(5), self.output),
+                         (5, 0, 0))
+        with open(self.output + '.checkpoint') as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file), {'done' : 5})
+        self.assertEqual(import_bugs(self.bug, self.records(8), self.output),
+                         (3, 0, 0))
+        self.assertEqual(sorted(int(number) for number, _ in self.mapping()),
+                         list(range(1, 9)))
+
+    def test_resume_drops_a_line_cut_short(self):
+        import_bugs(self.bug, self.records(3), self.output)
+        with open(self.output, 'a') as output_file:
+            output_file.write('4\t1')   # Crashed while writing
+        self.assertEqual(import_bugs(self.bug, self.records(5), self.output),
+                         (2, 0, 0))
+        self.assertEqual(sorted(int(number) for number, _ in self.mapping()),
+                         [1, 2, 3, 4, 5])
+
+    def test_malformed_line_is_mapped_as_invalid(self):
+        path = os.path.join(self.directory.name, 'bugs.jsonl')
+        record = json.dumps(self.records(1)[0][1])
+        with open(path, 'w') as input_file:
+            input_file.write('%s\n{"summary": \n%s\n' % (record, record))
+        self.assertEqual(import_bugs(self.bug, read_records(path),
+                                     self.output),
+                         (2, 1, 0))
+        mapping = dict(self.mapping())
+        self.assertTrue(mapping['2'].startswith('invalid: Malformed record'))
+        self.assertTrue(mapping['3'].isdigit())
+
+        # Not tried again, and not holding the checkpoint back
+        self.assertEqual(import_bugs(self.bug, read_records(path),
+                                     self.output),
+                         (0, 0, 0))
+        with open(self.output + '.checkpoint') as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file), {'done' : 3})
+
+    def test_rejected_records_are_retried(self):
+        wrong = Bug(self.server.url, "wrongusr", "asdf", authenticate=False)
+        self.assertEqual(import_bugs(wrong, self.records(3), self.output),
+                         (0, 3, 0))
+        self.assertTrue(all(result.startswith('error:')
+                            for _, result in self.mapping()))
+
+        self.assertEqual(import_bugs(self.bug, self.records(3), self.output),
+                         (3, 0, 0))
+        self.assertTrue(all(result.isdigit()
+                            for _, result in self.mapping()[3:]))
+
+    def test_transport_errors_are_unknown(self):
+        unreachable = Bug('http://127.0.0.1:1', "kushaldas@gmail.com",
+                          "asdf", authenticate=False)
+        self.assertEqual(import_bugs(unreachable, self.records(3),
+                                     self.output),
+                         (0, 0, 3))
+        self.assertTrue(all(result.startswith('unknown:')
+                            for _, result in self.mapping()))
+
+        # Left for the user to check, not filed again
+        self.assertEqual(import_bugs(self.bug, self.records(3), self.output),
+                         (0, 0, 0))
 
 if __name__ == "__main__":
     unittest.main(verbosity = 2)